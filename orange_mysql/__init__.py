@@ -1,6 +1,15 @@
-from .init import OrangeMySqlConfig
+from .init import OrangeMySqlConfig, get_datasource, get_datasource_metrics, get_sync_datasource
 from .repo import BaseRepo
+from .repo import PAGE_SEQUENTIAL, PAGE_MULTI_STATEMENT, PAGE_WINDOW, PAGE_CONCURRENT
+from .repo import COUNT_EXACT, COUNT_ESTIMATED, COUNT_CACHED
+from .sync_repo import SyncBaseRepo
+from .fan_out import SyncFanOut
+from .datasource import DataSource
+from .shard import HashShard, RangeShard
+from .transaction import transaction, Transaction
 from .field.sql_field import SqlField
+from .aiomysql.pool import PoolExhaustedError, PoolOverloadedError, CircuitOpenError
+from .aiomysql.pool import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 
 
 
@@ -31,7 +31,11 @@ from ..pymysql.err import (Warning, Error, InterfaceError, DataError,
 
 from .connection import Connection, connect
 from .cursors import Cursor, SSCursor, DictCursor, SSDictCursor
-from .pool import create_pool, Pool
+from .pool import (create_pool, Pool, PoolExhaustedError,
+                   PoolOverloadedError, CircuitOpenError,
+                   PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+from .overload import AdaptiveLimiter, CircuitBreaker
+from .budget import ConnectionBudget, ProcessConnectionBudget
 from ._version import version
 
 __version__ = version
@@ -57,6 +61,16 @@ __all__ = [
 
     'Connection',
     'Pool',
+    'PoolExhaustedError',
+    'PoolOverloadedError',
+    'CircuitOpenError',
+    'AdaptiveLimiter',
+    'CircuitBreaker',
+    'ConnectionBudget',
+    'ProcessConnectionBudget',
+    'PRIORITY_HIGH',
+    'PRIORITY_NORMAL',
+    'PRIORITY_LOW',
     'connect',
     'create_pool',
     'Cursor',
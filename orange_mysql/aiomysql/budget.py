@@ -0,0 +1,216 @@
+"""Connection budget shared by several pools.
+
+A pool with a budget takes one unit of the budget before opening a
+connection and gives it back once the connection is closed, so the total
+number of connections of all the pools sharing the budget stays bounded
+whatever the event loop or thread each pool runs in.
+
+``ProcessConnectionBudget`` extends the bound to all the processes of a host
+(prefork servers) with one byte record locks of a shared file. A prefork
+master should not hold units when it forks: they stay taken while it lives
+and no worker can use them, a warning is issued when it does.
+"""
+
+import os
+import threading
+import warnings
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# budgets reset in forked children, the units of the parent belong to the
+# connections of the parent
+_budgets = weakref.WeakSet()
+
+
+class ConnectionBudget:
+    """Thread safe connection budget for pools of one process.
+
+    Pools register a listener which is called, possibly from another
+    thread, whenever units are given back so their waiters can retry, and
+    a reclaimer which closes their surplus idle connections when another
+    pool finds the budget used up.
+    """
+
+    # units given back by other processes are not notified, pools poll
+    # the budget every ``retry_interval`` seconds when it is set
+    retry_interval = None
+
+    # acquire timeout of the pools sharing the budget which have none, a
+    # pool short of budget must not wait forever for the others
+    acquire_timeout = 30.0
+
+    # idle timeout of the pools sharing the budget which have none, idle
+    # connections over the pool minsize give their units back
+    idle_timeout = 60.0
+
+    def __init__(self, limit):
+        if limit < 1:
+            raise ValueError("connection budget limit should be at least 1")
+        self._limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._reclaimers = []
+        _budgets.add(self)
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def used(self):
+        return self._used
+
+    def try_acquire(self):
+        """Take one unit, ``False`` when the budget is used up."""
+        with self._lock:
+            if self._used >= self._limit:
+                return False
+            self._used += 1
+            return True
+
+    def release(self, n=1):
+        """Give back ``n`` units and notify the listeners."""
+        with self._lock:
+            self._used -= n
+            assert self._used >= 0, self._used
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def add_reclaimer(self, reclaimer):
+        with self._lock:
+            self._reclaimers.append(reclaimer)
+
+    def remove_reclaimer(self, reclaimer):
+        with self._lock:
+            if reclaimer in self._reclaimers:
+                self._reclaimers.remove(reclaimer)
+
+    def request_release(self, requester=None):
+        """Ask the pools sharing the budget, but the ``requester`` one, to
+        close their idle connections over their minimum."""
+        with self._lock:
+            reclaimers = [r for r in self._reclaimers if r != requester]
+        for reclaimer in reclaimers:
+            reclaimer()
+
+    def _after_fork(self):
+        # the pools of the parent are not used by the child
+        self._lock = threading.Lock()
+        self._used = 0
+        self._listeners = []
+        self._reclaimers = []
+
+
+class ProcessConnectionBudget(ConnectionBudget):
+    """Connection budget shared by the processes of one host.
+
+    Unit ``i`` is an exclusive record lock on byte ``i`` of the file
+    ``path``. The kernel releases the locks of a process when it exits,
+    even when killed, and a forked child does not inherit them.
+
+    Record locks belong to the process and are all dropped when any file
+    descriptor of the file is closed, so use :meth:`shared` to get the one
+    budget of a path in a process.
+    """
+
+    retry_interval = 0.05
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, limit):
+        if fcntl is None:
+            raise RuntimeError("process connection budget needs fcntl")
+        super().__init__(limit)
+        self._path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._held = set()
+        # spread the processes over the slots so a lookup usually
+        # succeeds at the first try
+        self._start = os.getpid() % limit
+
+    @classmethod
+    def shared(cls, path, limit):
+        """The budget of ``path`` in this process, created at first call."""
+        key = os.path.realpath(path)
+        with cls._instances_lock:
+            budget = cls._instances.get(key)
+            if budget is None:
+                budget = cls._instances[key] = cls(path, limit)
+            elif budget.limit != limit:
+                raise ValueError("budget %r already opened with limit %d"
+                                 % (path, budget.limit))
+            return budget
+
+    @property
+    def path(self):
+        return self._path
+
+    def try_acquire(self):
+        with self._lock:
+            for i in range(self._limit):
+                slot = (self._start + i) % self._limit
+                if slot in self._held:
+                    continue
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB,
+                                1, slot)
+                except OSError:
+                    continue
+                self._held.add(slot)
+                self._used += 1
+                return True
+            return False
+
+    def release(self, n=1):
+        with self._lock:
+            assert n <= len(self._held), (n, self._held)
+            for _ in range(n):
+                slot = self._held.pop()
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+            self._used -= n
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def _after_fork(self):
+        super()._after_fork()
+        # the locks of the parent are not inherited, the descriptor is kept
+        # open: closing it would drop the locks this process takes later
+        self._held = set()
+        self._start = os.getpid() % self._limit
+
+
+def _check_budgets_before_fork():
+    for budget in list(_budgets):
+        if isinstance(budget, ProcessConnectionBudget) and budget.used:
+            warnings.warn(
+                "process connection budget %r: %d units are held by the "
+                "forking process, its children can not use them until it "
+                "exits, close the parent connections before forking"
+                % (budget.path, budget.used), RuntimeWarning)
+
+
+def _reset_budgets_after_fork():
+    for budget in list(_budgets):
+        budget._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_check_budgets_before_fork,
+                        after_in_child=_reset_budgets_after_fork)
@@ -211,6 +211,9 @@ class Connection:
         self._db = db
         self._echo = echo
         self._last_usage = self._loop.time()
+        # round trips of the queries, their latency feeds the pool limiter
+        self._query_count = 0
+        self._query_time = 0.0
         self._client_auth_plugin = auth_plugin
         self._server_auth_plugin = ""
         self._auth_plugin_used = ""
@@ -310,6 +313,17 @@ class Connection:
         """Return time() when connection was used."""
         return self._last_usage
 
+    @property
+    def query_count(self):
+        """Number of queries sent on this connection."""
+        return self._query_count
+
+    @property
+    def query_time(self):
+        """Seconds spent waiting for the results of the queries sent on
+        this connection, from sending the query to its result."""
+        return self._query_time
+
     @property
     def loop(self):
         return self._loop
@@ -463,12 +477,21 @@ class Connection:
         # logger.debug("DEBUG: sending query: %s", _convert_to_str(sql))
         if isinstance(sql, str):
             sql = sql.encode(self.encoding, 'surrogateescape')
-        await self._execute_command(COMMAND.COM_QUERY, sql)
-        await self._read_query_result(unbuffered=unbuffered)
+        start = self._loop.time()
+        try:
+            await self._execute_command(COMMAND.COM_QUERY, sql)
+            await self._read_query_result(unbuffered=unbuffered)
+        finally:
+            self._query_count += 1
+            self._query_time += self._loop.time() - start
         return self._affected_rows
 
     async def next_result(self):
-        await self._read_query_result()
+        start = self._loop.time()
+        try:
+            await self._read_query_result()
+        finally:
+            self._query_time += self._loop.time() - start
         return self._affected_rows
 
     def affected_rows(self):
@@ -17,12 +17,17 @@ from .connection import FIELD_TYPE
 #: Regular expression for :meth:`Cursor.executemany`.
 #: executemany only supports simple bulk insert.
 #: You can use it to load large dataset.
+#: The MySQL 8 row alias ``AS new ON DUPLICATE ...`` is kept in the postfix.
 RE_INSERT_VALUES = re.compile(
     r"\s*((?:INSERT|REPLACE)\s.+\sVALUES?\s+)" +
     r"(\(\s*(?:%s|%\(.+\)s)\s*(?:,\s*(?:%s|%\(.+\)s)\s*)*\))" +
-    r"(\s*(?:ON DUPLICATE.*)?);?\s*\Z",
+    r"(\s*(?:(?:AS\s+\w+\s+)?ON DUPLICATE.*)?);?\s*\Z",
     re.IGNORECASE | re.DOTALL)
 
+#: executemany packs UPDATE and DELETE statements into multiple statements
+#: packets, connections are always opened with CLIENT.MULTI_STATEMENTS.
+RE_UPDATE_DELETE = re.compile(r"\s*(?:UPDATE|DELETE)\s", re.IGNORECASE)
+
 
 class Cursor:
     """Cursor is used to interact with the database."""
@@ -48,6 +53,7 @@ class Cursor:
         self._result = None
         self._rows = None
         self._lastrowid = None
+        self._batch_results = []
         self._echo = echo
 
     @property
@@ -138,6 +144,15 @@ class Cursor:
         """
         return self._lastrowid
 
+    @property
+    def batch_results(self):
+        """List of ``(lastrowid, rowcount)`` of every statement sent by the
+        last :meth:`executemany`, in order, empty when it sent multiple
+        statements packets. A multiple rows INSERT gets ``lastrowid`` for
+        its first row.
+        """
+        return self._batch_results
+
     @property
     def echo(self):
         """Return echo mode status."""
@@ -261,11 +276,15 @@ class Cursor:
             await cursor.executemany(stmt, data)
 
         INSERT or REPLACE statements are optimized by batching the data,
-        that is using the MySQL multiple rows syntax.
+        that is using the MySQL multiple rows syntax. UPDATE and DELETE
+        statements are sent as multiple statements packets of at most
+        ``max_stmt_length`` bytes, the affected rows of all the statements
+        are summed.
 
         :param query: `str`, sql statement
         :param args: ``tuple`` or ``list`` of arguments for sql query
         """
+        self._batch_results = []
         if not args:
             return
 
@@ -282,11 +301,15 @@ class Cursor:
             return (await self._do_execute_many(
                 q_prefix, q_values, q_postfix, args, self.max_stmt_length,
                 self._get_db().encoding))
+        elif RE_UPDATE_DELETE.match(query):
+            return (await self._do_execute_many_statements(
+                query, args, self.max_stmt_length, self._get_db().encoding))
         else:
             rows = 0
             for arg in args:
                 await self.execute(query, arg)
                 rows += self._rowcount
+                self._batch_results.append((self._lastrowid, self._rowcount))
             self._rowcount = rows
         return self._rowcount
 
@@ -312,15 +335,46 @@ class Cursor:
             if len(sql) + len(v) + len(postfix) + 1 > max_stmt_length:
                 r = await self.execute(sql + postfix)
                 rows += r
+                self._batch_results.append((self._lastrowid, r))
                 sql = bytearray(prefix)
             else:
                 sql += b','
             sql += v
         r = await self.execute(sql + postfix)
         rows += r
+        self._batch_results.append((self._lastrowid, r))
+        self._rowcount = rows
+        return rows
+
+    async def _do_execute_many_statements(self, query, args, max_stmt_length,
+                                          encoding):
+        conn = self._get_db()
+        escape = self._escape_args
+        query = query.strip().rstrip(';')
+        sql = bytearray()
+        rows = 0
+        for arg in args:
+            q = query % escape(arg, conn)
+            if isinstance(q, str):
+                q = q.encode(encoding, 'surrogateescape')
+            if sql and len(sql) + len(q) + 1 > max_stmt_length:
+                rows += await self._execute_statements(sql)
+                sql = bytearray()
+            elif sql:
+                sql += b';'
+            sql += q
+        rows += await self._execute_statements(sql)
         self._rowcount = rows
         return rows
 
+    async def _execute_statements(self, sql):
+        # read the OK packet of every statement of the packet, an error
+        # stops the server at the failing statement and is raised here
+        rows = await self.execute(sql)
+        while (await self.nextset()):
+            rows += self._rowcount
+        return rows
+
     async def callproc(self, procname, args=()):
         """Execute stored procedure procname with args
 
@@ -0,0 +1,163 @@
+"""Overload protection for the connection pool.
+
+``AdaptiveLimiter`` limits the number of concurrent acquisitions with a limit
+adapted from the observed latency (gradient algorithm, the limit goes down
+when the recent latency rises above the long term one) and from errors.
+
+``CircuitBreaker`` fails fast after repeated database failures and lets a few
+probe acquisitions through after ``reset_timeout`` to detect recovery.
+"""
+
+import math
+import time
+
+from ..pymysql.err import OperationalError, InterfaceError, InternalError
+
+
+def is_db_failure(exc):
+    """Whether ``exc`` means the database is unhealthy, as opposed to an
+    error of the query itself (syntax, duplicate key ...)."""
+    return isinstance(exc, (OperationalError, InterfaceError, InternalError,
+                            TimeoutError, ConnectionError))
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adapted from latency and errors.
+
+    :param initial_limit: limit before any sample is observed.
+    :param min_limit: the limit never goes below this value.
+    :param max_limit: the limit never goes above this value.
+    :param tolerance: how much the recent latency may exceed the long term
+        latency before the limit is reduced.
+    :param smoothing: weight of a new limit estimate, 0 < smoothing <= 1.
+    :param backoff: factor applied to the limit on a database failure.
+    :param long_window: number of samples of the long term latency average.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=200,
+                 tolerance=2.0, smoothing=0.2, backoff=0.9,
+                 long_window=600):
+        if not 0 < min_limit <= initial_limit <= max_limit:
+            raise ValueError("limits should satisfy "
+                             "0 < min_limit <= initial_limit <= max_limit")
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._tolerance = tolerance
+        self._smoothing = smoothing
+        self._backoff = backoff
+        self._long_factor = 2.0 / (long_window + 1)
+        self._long_rtt = None
+        self._inflight = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def try_acquire(self):
+        """Take a slot, ``False`` when the limit is reached."""
+        if self._inflight >= int(self._limit):
+            return False
+        self._inflight += 1
+        return True
+
+    def release(self, latency, error=None):
+        """Give back a slot and update the limit with the observed
+        ``latency`` in seconds (``None`` when not measured)."""
+        self._inflight -= 1
+        if error is not None and is_db_failure(error):
+            self._set_limit(self._limit * self._backoff)
+        elif latency is not None and latency > 0:
+            self._update(latency)
+
+    def _update(self, rtt):
+        if self._long_rtt is None:
+            self._long_rtt = rtt
+            return
+        self._long_rtt += (rtt - self._long_rtt) * self._long_factor
+        # a long lasting load shift becomes the new normal faster
+        if self._long_rtt / rtt > 2:
+            self._long_rtt *= 0.95
+
+        # don't grow the limit when it is not even used
+        if self._inflight < self._limit / 2:
+            return
+        gradient = max(0.5, min(1.0, self._tolerance * self._long_rtt / rtt))
+        new_limit = self._limit * gradient + math.sqrt(self._limit)
+        self._set_limit(self._limit * (1 - self._smoothing)
+                        + new_limit * self._smoothing)
+
+    def _set_limit(self, limit):
+        self._limit = max(self._min_limit, min(self._max_limit, limit))
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive database failures,
+    reject everything for ``reset_timeout`` seconds then go half open and
+    let ``half_open_max`` probes through. A successful probe closes the
+    circuit, a failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0,
+                 half_open_max=1, clock=time.monotonic):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold should be at least 1")
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._half_open_max = half_open_max
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self):
+        if (self._state == self.OPEN and
+                self._clock() - self._opened_at >= self._reset_timeout):
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self):
+        """Whether a new acquisition may go on."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self._half_open_max:
+            self._probes += 1
+            return True
+        return False
+
+    def release_probe(self):
+        """An allowed acquisition ended without telling anything about the
+        database health (cancelled, pool exhausted), give the probe back."""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        self._failures = 0
+        if self._state != self.CLOSED:
+            self._state = self.CLOSED
+
+    def record_failure(self, exc=None):
+        """Count a failure, returns ``True`` when the circuit just opened.
+        Errors which are not database failures are ignored."""
+        if exc is not None and not is_db_failure(exc):
+            return False
+        self._failures += 1
+        if (self._state == self.HALF_OPEN or
+                (self._state == self.CLOSED and
+                 self._failures >= self._failure_threshold)):
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+            return True
+        return False
@@ -2,42 +2,123 @@
 # https://github.com/aio-libs/aiopg/blob/master/aiopg/pool.py
 
 import asyncio
+import bisect
 import collections
+import itertools
 import warnings
 
 from .connection import connect, Connection
+from .overload import is_db_failure
 from .utils import (_PoolContextManager, _PoolConnectionContextManager,
                     _PoolAcquireContextManager)
 
 
+# Acquire priorities, a lower value is served first. Waiters with the same
+# priority are served strictly in arrival order.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+
+class PoolExhaustedError(Exception):
+    """No connection could be acquired from the pool within the timeout."""
+
+
+class PoolOverloadedError(PoolExhaustedError):
+    """The acquisition was rejected by the pool concurrency limiter."""
+
+
+class CircuitOpenError(PoolExhaustedError):
+    """The acquisition was rejected because the pool circuit breaker is
+    open after repeated database failures."""
+
+
+class _Waiter:
+
+    __slots__ = ('priority', 'seq', 'partition', 'fut')
+
+    def __init__(self, priority, seq, partition=None):
+        self.priority = priority
+        self.seq = seq
+        self.partition = partition
+        self.fut = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
 def create_pool(minsize=1, maxsize=10, echo=False, pool_recycle=-1,
-                loop=None, **kwargs):
+                loop=None, acquire_timeout=None, partitions=None,
+                limiter=None, breaker=None, budget=None, idle_timeout=None,
+                **kwargs):
     coro = _create_pool(minsize=minsize, maxsize=maxsize, echo=echo,
-                        pool_recycle=pool_recycle, loop=loop, **kwargs)
+                        pool_recycle=pool_recycle, loop=loop,
+                        acquire_timeout=acquire_timeout,
+                        partitions=partitions, limiter=limiter,
+                        breaker=breaker, budget=budget,
+                        idle_timeout=idle_timeout, **kwargs)
     return _PoolContextManager(coro)
 
 
 async def _create_pool(minsize=1, maxsize=10, echo=False, pool_recycle=-1,
-                       loop=None, **kwargs):
+                       loop=None, acquire_timeout=None, partitions=None,
+                       limiter=None, breaker=None, budget=None,
+                       idle_timeout=None, **kwargs):
     if loop is None:
         loop = asyncio.get_event_loop()
 
     pool = Pool(minsize=minsize, maxsize=maxsize, echo=echo,
-                pool_recycle=pool_recycle, loop=loop, **kwargs)
+                pool_recycle=pool_recycle, loop=loop,
+                acquire_timeout=acquire_timeout, partitions=partitions,
+                limiter=limiter, breaker=breaker, budget=budget,
+                idle_timeout=idle_timeout, **kwargs)
     if minsize > 0:
-        async with pool._cond:
-            await pool._fill_free_pool(False)
+        await pool.fill()
     return pool
 
 
 class Pool(asyncio.AbstractServer):
-    """Connection pool"""
-
-    def __init__(self, minsize, maxsize, echo, pool_recycle, loop, **kwargs):
+    """Connection pool
+
+    ``partitions`` splits the pool capacity between workload classes, it is a
+    dict of ``name -> (min, max)``. ``min`` connections are kept available
+    for the partition whatever the other partitions do, ``max`` is a hard
+    limit of connections in use by the partition (``None`` means no limit
+    but the pool one). Connections acquired without a partition only use
+    the capacity not reserved for the partitions.
+
+    ``limiter`` (an :class:`~.overload.AdaptiveLimiter`) rejects
+    acquisitions over its adaptive concurrency limit with
+    :class:`PoolOverloadedError`, it samples the average latency of the
+    queries run on each acquired connection, ``breaker`` (a
+    :class:`~.overload.CircuitBreaker`) rejects them with
+    :class:`CircuitOpenError` while the database keeps failing.
+
+    ``budget`` (a :class:`~.budget.ConnectionBudget`) bounds the number of
+    connections of all the pools sharing it, e.g. pools of the same
+    database running in different event loops. The pool does not open a
+    connection while the budget is used up, it asks the other pools to
+    close their free connections over ``minsize`` and waits for a unit,
+    at most the budget ``acquire_timeout`` when the pool has no
+    ``acquire_timeout`` of its own. The unit of a closed connection is
+    given back once its socket is actually closed, ``wait_closed`` waits
+    for them.
+
+    ``idle_timeout`` closes the free connections over ``minsize`` unused
+    for that many seconds, it defaults to the budget ``idle_timeout`` for a
+    pool with a budget so idle pools give their units back, also to the
+    pools of other processes which can not ask for them. The most recently
+    released connection is handed out first so the surplus ones go idle.
+    """
+
+    def __init__(self, minsize, maxsize, echo, pool_recycle, loop,
+                 acquire_timeout=None, partitions=None, limiter=None,
+                 breaker=None, budget=None, idle_timeout=None, **kwargs):
         if minsize < 0:
             raise ValueError("minsize should be zero or greater")
         if maxsize < minsize and maxsize != 0:
             raise ValueError("maxsize should be not less than minsize")
+        self._partitions = self._check_partitions(partitions or {}, maxsize)
         self._minsize = minsize
         self._loop = loop
         self._conn_kwargs = kwargs
@@ -50,11 +131,108 @@ class Pool(asyncio.AbstractServer):
         self._closed = False
         self._echo = echo
         self._recycle = pool_recycle
+        self._acquire_timeout = acquire_timeout
+        # waiters sorted by (priority, arrival), only the head may take
+        # a connection so a waiter can not be overtaken by later arrivals
+        self._waiters = []
+        self._waiter_seq = itertools.count()
+        # connections in use per partition
+        self._partition_used = dict.fromkeys(self._partitions, 0)
+        self._conn_partition = {}
+        self._limiter = limiter
+        self._breaker = breaker
+        # (query count, query time) of the used connections when they were
+        # handed out, the limiter samples the database latency of the
+        # queries run meanwhile, not the queue wait nor the caller's work
+        self._query_started = {}
+        self._stats = dict.fromkeys(
+            ('acquired', 'rejected', 'timeouts', 'errors'), 0)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._budget = budget
+        # budget units taken by this pool
+        self._budget_held = 0
+        self._budget_retry = None
+        # sockets of the closed connections not closed yet, their budget
+        # units are given back once the sockets are closed
+        self._closing_sockets = set()
+        self._idle_timeout = idle_timeout
+        self._idle_check = None
+        if budget is not None:
+            if acquire_timeout is None:
+                self._acquire_timeout = budget.acquire_timeout
+            if idle_timeout is None:
+                self._idle_timeout = budget.idle_timeout
+            budget.add_listener(self._on_budget_released)
+            budget.add_reclaimer(self._on_budget_reclaim)
+
+    @staticmethod
+    def _check_partitions(partitions, maxsize):
+        checked = {}
+        for name, (p_min, p_max) in partitions.items():
+            p_min = p_min or 0
+            if p_min < 0:
+                raise ValueError("partition %r min should be zero or greater"
+                                 % name)
+            if p_max is not None and p_max < max(p_min, 1):
+                raise ValueError("partition %r max should be not less than "
+                                 "min and at least 1" % name)
+            if maxsize and p_max is not None and p_max > maxsize:
+                raise ValueError("partition %r max should be not greater "
+                                 "than pool maxsize" % name)
+            checked[name] = (p_min, p_max)
+        if maxsize and sum(p[0] for p in checked.values()) > maxsize:
+            raise ValueError("sum of partition min should be not greater "
+                             "than pool maxsize")
+        return checked
+
+    @property
+    def circuit_open(self):
+        """``True`` while the circuit breaker rejects acquisitions."""
+        return (self._breaker is not None and
+                self._breaker.state == self._breaker.OPEN)
+
+    @property
+    def partitions(self):
+        return dict(self._partitions)
+
+    def metrics(self):
+        """Snapshot of the pool state and counters since creation."""
+        acquired = self._stats['acquired']
+        metrics = {
+            'size': self.size,
+            'freesize': self.freesize,
+            'used': len(self._used),
+            'waiting': len(self._waiters),
+            'minsize': self.minsize,
+            'maxsize': self.maxsize,
+            'acquire_wait_avg': self._wait_total / acquired if acquired else 0.0,
+            'acquire_wait_max': self._wait_max,
+        }
+        metrics.update(self._stats)
+        if self._partitions:
+            metrics['partition_used'] = dict(self._partition_used)
+        if self._limiter is not None:
+            metrics['limit'] = self._limiter.limit
+        if self._breaker is not None:
+            metrics['breaker'] = self._breaker.state
+        if self._budget is not None:
+            metrics['budget_held'] = self._budget_held
+        return metrics
+
+    def partition_used(self, name):
+        """Connections in use by the partition ``name``."""
+        return self._partition_used[name]
 
     @property
     def echo(self):
         return self._echo
 
+    @property
+    def loop(self):
+        """The event loop the pool and its connections are bound to."""
+        return self._loop
+
     @property
     def minsize(self):
         return self._minsize
@@ -71,13 +249,22 @@ class Pool(asyncio.AbstractServer):
     def freesize(self):
         return len(self._free)
 
+    async def fill(self):
+        """Open connections up to ``minsize``."""
+        async with self._cond:
+            await self._fill_free_pool(False)
+
     async def clear(self):
         """Close all free connections in pool."""
         async with self._cond:
             while self._free:
                 conn = self._free.popleft()
+                writer = conn._writer
                 await conn.ensure_closed()
+                self._hold_budget_until_closed(writer)
+            self._sync_budget()
             self._cond.notify()
+            self._wake_next_waiter()
 
     @property
     def closed(self):
@@ -105,10 +292,17 @@ class Pool(asyncio.AbstractServer):
         self.close()
 
         for conn in list(self._used):
-            conn.close()
+            self._close_conn(conn)
             self._terminated.add(conn)
 
         self._used.clear()
+        self._sync_budget()
+        self._conn_partition.clear()
+        for conn, started in self._query_started.items():
+            self._record_outcome(self._query_latency(conn, started),
+                                 None, True)
+        self._query_started.clear()
+        self._partition_used = dict.fromkeys(self._partitions, 0)
 
     async def wait_closed(self):
         """Wait for closing all pool's connections."""
@@ -121,33 +315,208 @@ class Pool(asyncio.AbstractServer):
 
         while self._free:
             conn = self._free.popleft()
-            conn.close()
+            self._close_conn(conn)
+        self._sync_budget()
 
         async with self._cond:
             while self.size > self.freesize:
                 await self._cond.wait()
 
+        while self._closing_sockets:
+            await asyncio.gather(*self._closing_sockets)
+        self._sync_budget()
+        if self._budget is not None:
+            self._budget.remove_listener(self._on_budget_released)
+            self._budget.remove_reclaimer(self._on_budget_reclaim)
+        if self._budget_retry is not None:
+            self._budget_retry.cancel()
+            self._budget_retry = None
+        if self._idle_check is not None:
+            self._idle_check.cancel()
+            self._idle_check = None
         self._closed = True
 
-    def acquire(self)->Connection:
-        """Acquire free connection from the pool."""
-        coro = self._acquire()
+    def acquire(self, timeout=None, priority=PRIORITY_NORMAL,
+                partition=None)->Connection:
+        """Acquire free connection from the pool.
+
+        :param timeout: seconds to wait for a connection before raising
+            :class:`PoolExhaustedError`, defaults to the pool
+            ``acquire_timeout``, ``None`` waits forever.
+        :param priority: waiters with a lower value are served first,
+            see ``PRIORITY_HIGH``, ``PRIORITY_NORMAL`` and ``PRIORITY_LOW``.
+        :param partition: name of the capacity partition to acquire from.
+        """
+        if partition is not None and partition not in self._partitions:
+            raise ValueError("unknown pool partition %r" % (partition,))
+        coro = self._acquire(timeout, priority, partition)
         return _PoolAcquireContextManager(coro, self)
 
-    async def _acquire(self):
+    async def _acquire(self, timeout=None, priority=PRIORITY_NORMAL,
+                       partition=None):
         if self._closing:
             raise RuntimeError("Cannot acquire connection after closing pool")
+        limiter = self._limiter
+        if limiter is not None and not limiter.try_acquire():
+            self._stats['rejected'] += 1
+            raise PoolOverloadedError(
+                "pool concurrency limit %d reached" % limiter.limit)
+        breaker = self._breaker
+        if breaker is not None and not breaker.allow():
+            if limiter is not None:
+                limiter.release(None)
+            self._stats['rejected'] += 1
+            raise CircuitOpenError("pool circuit breaker is open")
+        start = self._loop.time()
+        try:
+            conn = await self._acquire_conn(timeout, priority, partition)
+        except BaseException as e:
+            if isinstance(e, (CircuitOpenError, PoolOverloadedError)):
+                # failed fast while waiting, not a timeout
+                self._stats['rejected'] += 1
+            elif isinstance(e, PoolExhaustedError):
+                self._stats['timeouts'] += 1
+            elif isinstance(e, Exception):
+                self._stats['errors'] += 1
+            self._record_outcome(None, e, False)
+            raise
+        wait = self._loop.time() - start
+        self._stats['acquired'] += 1
+        self._wait_total += wait
+        if wait > self._wait_max:
+            self._wait_max = wait
+        if limiter is not None or breaker is not None:
+            self._query_started[conn] = (conn.query_count, conn.query_time)
+        return conn
+
+    @staticmethod
+    def _query_latency(conn, started):
+        """Average latency of the queries run since ``started``, ``None``
+        when the connection ran no query."""
+        count = conn.query_count - started[0]
+        if count <= 0:
+            return None
+        return (conn.query_time - started[1]) / count
+
+    def _record_outcome(self, latency, error, acquired):
+        """Feed the limiter and the circuit breaker with the outcome of an
+        acquisition, ``acquired`` tells whether a connection was obtained,
+        ``latency`` is the database latency observed meanwhile.
+        """
+        if self._limiter is not None:
+            self._limiter.release(latency, error)
+        breaker = self._breaker
+        if breaker is None:
+            return
+        if error is None:
+            breaker.record_success()
+        elif is_db_failure(error):
+            if breaker.record_failure(error):
+                # fail the queued waiters fast too
+                for waiter in self._waiters:
+                    if waiter.fut is not None and not waiter.fut.done():
+                        waiter.fut.set_result(None)
+        elif acquired:
+            # the database answered, the query itself failed
+            breaker.record_success()
+        else:
+            breaker.release_probe()
+
+    async def _acquire_conn(self, timeout, priority, partition):
+        if timeout is None:
+            timeout = self._acquire_timeout
+        deadline = None if timeout is None else self._loop.time() + timeout
+        waiter = _Waiter(priority, next(self._waiter_seq), partition)
         async with self._cond:
+            bisect.insort(self._waiters, waiter)
+            try:
+                while True:
+                    if self._next_waiter() is waiter:
+                        await self._fill_free_pool(True)
+                        if self._free:
+                            conn = self._free.pop()
+                            assert not conn.closed, conn
+                            assert conn not in self._used, (conn, self._used)
+                            self._used.add(conn)
+                            if partition is not None:
+                                self._partition_used[partition] += 1
+                                self._conn_partition[conn] = partition
+                            return conn
+                    await self._wait_turn(waiter, deadline)
+                    if self.circuit_open:
+                        raise CircuitOpenError("pool circuit breaker is open")
+            finally:
+                self._waiters.remove(waiter)
+                self._wake_next_waiter()
+
+    async def _wait_turn(self, waiter, deadline):
+        """Release the lock until ``waiter`` is woken up as the head waiter.
+
+        Same lock handling as ``asyncio.Condition.wait()``, but every waiter
+        has its own future so the wake up can pick the next in line.
+        """
+        waiter.fut = self._loop.create_future()
+        self._cond.release()
+        try:
+            if deadline is None:
+                await waiter.fut
+            else:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    raise PoolExhaustedError(
+                        "no free connection in pool (size=%d, maxsize=%d)"
+                        % (self.size, self.maxsize))
+                try:
+                    await asyncio.wait_for(waiter.fut, timeout)
+                except asyncio.TimeoutError:
+                    raise PoolExhaustedError(
+                        "timeout waiting for a free connection in pool "
+                        "(size=%d, maxsize=%d)"
+                        % (self.size, self.maxsize)) from None
+        finally:
+            waiter.fut = None
+            cancelled = False
             while True:
-                await self._fill_free_pool(True)
-                if self._free:
-                    conn = self._free.popleft()
-                    assert not conn.closed, conn
-                    assert conn not in self._used, (conn, self._used)
-                    self._used.add(conn)
-                    return conn
-                else:
-                    await self._cond.wait()
+                try:
+                    await self._cond.acquire()
+                    break
+                except asyncio.CancelledError:
+                    cancelled = True
+            if cancelled:
+                raise asyncio.CancelledError
+
+    def _can_take(self, partition):
+        """Whether one more connection can be used by ``partition`` without
+        breaking its max or the min reserved by the other partitions."""
+        if not self._partitions:
+            return True
+        if partition is not None:
+            p_max = self._partitions[partition][1]
+            if p_max is not None and self._partition_used[partition] >= p_max:
+                return False
+        if not self.maxsize:
+            return True
+        reserved = 0
+        for name, (p_min, _) in self._partitions.items():
+            if name != partition:
+                reserved += max(0, p_min - self._partition_used[name])
+        return len(self._used) + reserved < self.maxsize
+
+    def _next_waiter(self):
+        """The first waiter in line which is allowed to take a connection,
+        a waiter blocked by its partition limit does not hold up the others.
+        """
+        for waiter in self._waiters:
+            if self._can_take(waiter.partition):
+                return waiter
+        return None
+
+    def _wake_next_waiter(self):
+        waiter = self._next_waiter()
+        if waiter is not None:
+            fut = waiter.fut
+            if fut is not None and not fut.done():
+                fut.set_result(None)
 
     async def _fill_free_pool(self, override_min):
         # iterate over free connections and remove timed out ones
@@ -157,7 +526,7 @@ class Pool(asyncio.AbstractServer):
             conn = self._free[-1]
             if conn._reader.at_eof() or conn._reader.exception():
                 self._free.pop()
-                conn.close()
+                self._close_conn(conn)
 
             # On MySQL 8.0 a timed out connection sends an error packet before
             # closing the connection, preventing us from relying on at_eof().
@@ -165,69 +534,190 @@ class Pool(asyncio.AbstractServer):
             # present in asyncio.StreamReader.
             elif conn._reader.eof_received:
                 self._free.pop()
-                conn.close()
+                self._close_conn(conn)
 
             elif (self._recycle > -1 and
                   self._loop.time() - conn.last_usage > self._recycle):
                 self._free.pop()
-                conn.close()
+                self._close_conn(conn)
 
             else:
                 self._free.rotate()
             n += 1
+        self._sync_budget()
 
         while self.size < self.minsize:
-            self._acquiring += 1
-            try:
-                conn = await connect(echo=self._echo, loop=self._loop,
-                                     **self._conn_kwargs)
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
-                self._acquiring -= 1
+            if not await self._new_connection():
+                break
         if self._free:
             return
 
         if override_min and (not self.maxsize or self.size < self.maxsize):
-            self._acquiring += 1
-            try:
-                conn = await connect(echo=self._echo, loop=self._loop,
-                                     **self._conn_kwargs)
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
-                self._acquiring -= 1
+            await self._new_connection()
+
+    async def _new_connection(self):
+        """Open a connection into the free list, ``False`` when the shared
+        connection budget is used up."""
+        if self._budget is not None:
+            if not self._budget.try_acquire():
+                self._budget.request_release(self._on_budget_reclaim)
+                self._schedule_budget_retry()
+                return False
+            self._budget_held += 1
+        self._acquiring += 1
+        try:
+            conn = await connect(echo=self._echo, loop=self._loop,
+                                 **self._conn_kwargs)
+            # raise exception if pool is closing
+            self._free.append(conn)
+            self._schedule_idle_check()
+            self._cond.notify()
+            self._wake_next_waiter()
+        finally:
+            self._acquiring -= 1
+            self._sync_budget()
+        return True
+
+    def _close_conn(self, conn):
+        """Close a connection of the pool. With a budget its unit stays
+        held until the socket is actually closed, another pool must not
+        open a connection on top of it meanwhile."""
+        writer = conn._writer
+        conn.close()
+        self._hold_budget_until_closed(writer)
+
+    def _hold_budget_until_closed(self, writer):
+        if self._budget is None or writer is None:
+            return
+        closing = self._loop.create_task(self._wait_socket_closed(writer))
+        self._closing_sockets.add(closing)
+
+    async def _wait_socket_closed(self, writer):
+        try:
+            await writer.wait_closed()
+        except Exception:
+            # the socket is closed whatever the error
+            pass
+        finally:
+            self._closing_sockets.discard(asyncio.current_task())
+            self._sync_budget()
+
+    def _sync_budget(self):
+        """Give back the budget units of the connections closed since."""
+        if self._budget is None:
+            return
+        excess = self._budget_held - self.size - len(self._closing_sockets)
+        if excess > 0:
+            self._budget_held -= excess
+            self._budget.release(excess)
+
+    def _schedule_budget_retry(self):
+        # units given back by another process are not notified, retry later
+        interval = self._budget.retry_interval
+        if interval is None or self._budget_retry is not None:
+            return
+        self._budget_retry = self._loop.call_later(
+            interval, self._on_budget_retry)
+
+    def _on_budget_retry(self):
+        self._budget_retry = None
+        if self._waiters:
+            self._schedule_wakeup()
+
+    def _on_budget_released(self):
+        # called from the thread of the pool which closed a connection
+        if not self._waiters or self._closed:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._schedule_wakeup)
+        except RuntimeError:
+            # the loop of this pool is closed
+            pass
+
+    def _on_budget_reclaim(self):
+        # called from the thread of the pool short of budget
+        if self._closing:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._close_surplus)
+        except RuntimeError:
+            # the loop of this pool is closed
+            pass
+
+    def _close_surplus(self):
+        """Close the free connections over ``minsize``, their budget units
+        go to the pool which asked for them."""
+        while self._free and self.size > self._minsize:
+            self._close_conn(self._free.popleft())
+        self._sync_budget()
+
+    def _schedule_idle_check(self):
+        if (self._idle_timeout is None or self._idle_check is not None or
+                self._closing):
+            return
+        self._idle_check = self._loop.call_later(
+            self._idle_timeout, self._on_idle_check)
+
+    def _on_idle_check(self):
+        self._idle_check = None
+        if self._closing:
+            return
+        now = self._loop.time()
+        # the free list is ordered by release time, oldest first
+        while (self._free and self.size > self._minsize and
+               now - self._free[0].last_usage >= self._idle_timeout):
+            self._close_conn(self._free.popleft())
+        self._sync_budget()
+        if self._free and self.size > self._minsize:
+            delay = self._free[0].last_usage + self._idle_timeout - now
+            self._idle_check = self._loop.call_later(
+                max(delay, 0.1), self._on_idle_check)
+
+    def _schedule_wakeup(self):
+        if not self._closed:
+            self._loop.create_task(self._wakeup())
 
     async def _wakeup(self):
         async with self._cond:
             self._cond.notify()
+            self._wake_next_waiter()
 
-    def release(self, conn):
+    def release(self, conn, error=None):
         """Release free connection back to the connection pool.
 
         This is **NOT** a coroutine.
+
+        :param error: the exception raised while the connection was used,
+            it feeds the limiter and the circuit breaker.
         """
         fut = self._loop.create_future()
         fut.set_result(None)
 
+        started = self._query_started.pop(conn, None)
+        if started is not None:
+            self._record_outcome(self._query_latency(conn, started),
+                                 error, True)
         if conn in self._terminated:
             assert conn.closed, conn
             self._terminated.remove(conn)
             return fut
         assert conn in self._used, (conn, self._used)
         self._used.remove(conn)
+        partition = self._conn_partition.pop(conn, None)
+        if partition is not None:
+            self._partition_used[partition] -= 1
         if not conn.closed:
             in_trans = conn.get_transaction_status()
-            if in_trans:
-                conn.close()
-                return fut
-            if self._closing:
-                conn.close()
+            if in_trans or self._closing:
+                self._close_conn(conn)
             else:
+                # idle from now on, for pool_recycle and idle_timeout
+                conn._last_usage = self._loop.time()
                 self._free.append(conn)
-            fut = self._loop.create_task(self._wakeup())
+                self._schedule_idle_check()
+        self._sync_budget()
+        # a closed connection also frees capacity for the next waiter
+        fut = self._loop.create_task(self._wakeup())
         return fut
 
     def get(self):
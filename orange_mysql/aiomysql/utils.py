@@ -136,7 +136,7 @@ class _PoolAcquireContextManager(_ContextManager):
 
     async def __aexit__(self, exc_type, exc, tb):
         try:
-            await self._pool.release(self._conn)
+            await self._pool.release(self._conn, exc)
         finally:
             self._pool = None
             self._conn = None
@@ -0,0 +1,304 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+
+from .aiomysql.pool import Pool
+from .dbutils.pooled_db import PooledDB
+from .utils import SqlError
+
+
+class PinnedConnection:
+  """事务固定的连接, 同一个事务里并发的操作排队使用这个连接"""
+
+  __slots__ = ("conn", "lock", "commit_callback_dict")
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.lock = asyncio.Lock()
+    # 事务提交之后执行的函数, key -> 函数
+    self.commit_callback_dict = {}
+
+  def use(self):
+    return _PinnedConnectionContextManager(self)
+
+
+class _PinnedConnectionContextManager:
+
+  __slots__ = ("__pinned",)
+
+  def __init__(self, pinned: PinnedConnection):
+    self.__pinned = pinned
+
+  async def __aenter__(self):
+    await self.__pinned.lock.acquire()
+    return self.__pinned.conn
+
+  async def __aexit__(self, exc_type, exc, tb):
+    # 连接不归还连接池, 事务结束时统一归还
+    self.__pinned.lock.release()
+
+
+# fork 之后从父进程继承的连接池, 一直保留引用防止被回收时关闭父进程的连接
+_inherited_pools_list = []
+
+
+class DataSource:
+  """
+  一个数据库的连接池组, 写操作走主库, 只读查询走从库
+  没有从库的时候读写都走主库
+
+  连接池绑定创建它的事件循环, 在其他事件循环(例如工作线程里的循环)里使用时,
+  用 pool_factory 为该循环创建一组新的连接池, 按当前运行的循环自动选择
+  """
+
+  __slots__ = ("name", "read_after_write", "__pool_factory", "__first_pools",
+               "__loop_pools", "__lock", "__last_write", "__next_replica",
+               "__pinned")
+
+  def __init__(self, name, primary: Pool, replica_list: list[Pool] = None, read_after_write=0,
+               pool_factory=None):
+    """
+    :param read_after_write: 同一个上下文(协程)写入之后多少秒内的读也走主库, 保证读到自己的写入, 0 不启用
+    :param pool_factory: loop -> (主库连接池, 从库连接池列表), 为其他事件循环创建连接池, 不设置则只能在 primary 的循环里使用
+    """
+    self.name = name
+    self.read_after_write = read_after_write
+    self.__pool_factory = pool_factory
+    self.__first_pools = (primary, replica_list or [])
+    # 事件循环 -> (主库连接池, 从库连接池列表)
+    self.__loop_pools = {primary.loop: self.__first_pools}
+    self.__lock = threading.Lock()
+    self.__last_write = ContextVar(f"orange_mysql_last_write_{name}", default=None)
+    self.__next_replica = 0
+    # 当前上下文事务固定的连接
+    self.__pinned = ContextVar(f"orange_mysql_pinned_{name}", default=None)
+
+  def __pools(self):
+    """当前运行的事件循环的连接池, 第一次在该循环使用时创建, 没有运行的循环时用初始化的连接池"""
+    try:
+      loop = asyncio.get_running_loop()
+    except RuntimeError:
+      if self.__first_pools is None:
+        raise SqlError(f"datasource '{self.name}' has no pool outside an event loop after fork") from None
+      return self.__first_pools
+    pools = self.__loop_pools.get(loop)
+    if pools is not None:
+      return pools
+    with self.__lock:
+      pools = self.__loop_pools.get(loop)
+      if pools is None:
+        if self.__pool_factory is None:
+          raise SqlError(f"datasource '{self.name}' can not be used in another event loop")
+        pools = self.__pool_factory(loop)
+        self.__loop_pools[loop] = pools
+    return pools
+
+  def reset_after_fork(self):
+    """
+    fork 出的子进程里调用, 丢弃从父进程继承的连接池, 之后在子进程的事件循环里重新创建
+    继承的连接和事件循环的文件描述符跟父进程共用, 关闭会影响父进程, 所以只保留引用不关闭
+    """
+    _inherited_pools_list.extend(self.__loop_pools.values())
+    self.__loop_pools = {}
+    self.__first_pools = None
+    self.__lock = threading.Lock()
+
+  @property
+  def primary(self) -> Pool:
+    """当前事件循环的主库连接池"""
+    return self.__pools()[0]
+
+  @property
+  def replica_list(self) -> list[Pool]:
+    """当前事件循环的从库连接池"""
+    return self.__pools()[1]
+
+  def pin(self, conn):
+    """当前上下文固定使用 conn, 返回用于 unpin 的 token"""
+    return self.__pinned.set(PinnedConnection(conn))
+
+  def unpin(self, token):
+    self.__pinned.reset(token)
+
+  def pinned_conn(self):
+    """当前上下文固定的连接, 没有返回 None"""
+    pinned = self.__pinned.get()
+    if pinned is None: return None
+    return pinned.conn
+
+  def on_commit(self, key, callback):
+    """在事务里时, 事务提交之后执行 callback, 同一个 key 只执行一次, 不在事务里不执行"""
+    pinned = self.__pinned.get()
+    if pinned is not None:
+      pinned.commit_callback_dict[key] = callback
+
+  def take_commit_callbacks(self) -> list:
+    """取出当前事务提交之后要执行的函数, 由 Transaction 在提交时调用"""
+    pinned = self.__pinned.get()
+    if pinned is None: return []
+    callback_list = list(pinned.commit_callback_dict.values())
+    pinned.commit_callback_dict.clear()
+    return callback_list
+
+  def acquire(self, **kwargs):
+    """从主库获取连接, 在事务里就用事务的连接"""
+    pinned = self.__pinned.get()
+    if pinned is not None:
+      return pinned.use()
+    return self.primary.acquire(**kwargs)
+
+  def acquire_write(self, **kwargs):
+    """获取写连接, 并记录写入时间用于读写一致"""
+    self.mark_write()
+    return self.acquire(**kwargs)
+
+  def mark_write(self):
+    """
+    在当前上下文记录写入时间, read_after_write 秒内的读走主库
+    写入在 asyncio.gather 的子任务里执行时, 子任务的上下文是复制的, 要在调用方的上下文里再记录一次
+    """
+    if self.read_after_write > 0:
+      self.__last_write.set(time.monotonic())
+
+  def acquire_read(self, primary=False, **kwargs):
+    """
+    获取只读连接, 在事务里就用事务的连接
+    :param primary: 强制走主库
+    """
+    pinned = self.__pinned.get()
+    if pinned is not None:
+      return pinned.use()
+    return self.read_pool(primary).acquire(**kwargs)
+
+  def read_pool(self, primary=False) -> Pool:
+    """
+    只读查询使用的连接池, 同一个查询要在同一个库上执行的多条语句先选好连接池再分别获取连接,
+    不在事务里使用 (事务里用 acquire_read)
+    :param primary: 强制走主库
+    """
+    if primary is True or self.__read_pinned():
+      return self.primary
+    return self.__pick_replica()
+
+  def __read_pinned(self):
+    if self.read_after_write <= 0: return False
+    last_write = self.__last_write.get()
+    if last_write is None: return False
+    return time.monotonic() - last_write < self.read_after_write
+
+  def __pick_replica(self) -> Pool:
+    """选正在使用连接最少的从库, 一样多的时候轮询, 熔断的从库跳过, 都不可用就用主库"""
+    replica_list = self.replica_list
+    count = len(replica_list)
+    best = None
+    best_used = None
+    start = self.__next_replica
+    for i in range(count):
+      pool = replica_list[(start + i) % count]
+      if pool.closed or pool.circuit_open:
+        continue
+      used = pool.size - pool.freesize
+      if best is None or used < best_used:
+        best = pool
+        best_used = used
+    self.__next_replica = (start + 1) % count if count > 0 else 0
+    if best is None:
+      return self.primary
+    return best
+
+  def metrics(self) -> dict:
+    """当前事件循环的连接池统计信息"""
+    primary, replica_list = self.__pools()
+    return {
+      "primary": primary.metrics(),
+      "replicas": [pool.metrics() for pool in replica_list],
+      "loops": len(self.__loop_pools),
+    }
+
+  def all_pools(self) -> list[Pool]:
+    """当前事件循环的所有连接池"""
+    primary, replica_list = self.__pools()
+    return [primary] + replica_list
+
+  def close(self):
+    """关闭所有事件循环的连接池"""
+    with self.__lock:
+      pools_list = list(self.__loop_pools.values())
+    for primary, replica_list in pools_list:
+      for pool in [primary] + replica_list:
+        pool.close()
+
+  async def wait_closed(self):
+    """等待当前事件循环的连接池关闭"""
+    for pool in self.all_pools():
+      await pool.wait_closed()
+
+  async def fill(self):
+    """当前事件循环的连接池建立最小连接数"""
+    await asyncio.gather(*[pool.fill() for pool in self.all_pools()])
+
+  async def close_loop_pools(self):
+    """
+    关闭并移除当前事件循环的连接池, 工作线程的事件循环结束前调用, 归还连接预算
+    初始化时创建的连接池由 close 关闭
+    """
+    loop = asyncio.get_running_loop()
+    with self.__lock:
+      pools = self.__loop_pools.get(loop)
+      if pools is None or pools is self.__first_pools:
+        return
+      self.__loop_pools.pop(loop)
+    primary, replica_list = pools
+    for pool in [primary] + replica_list:
+      pool.close()
+    for pool in [primary] + replica_list:
+      await pool.wait_closed()
+
+
+class SyncDataSource:
+  """
+  同步的数据源, 基于 PooledDB 的线程安全连接池, 给线程里运行的同步代码使用
+  每次取到的连接由当前线程独占, 用完 close (或者 with 结束) 放回连接池
+  """
+
+  __slots__ = ("name", "__pool", "__pool_factory", "__lock")
+
+  def __init__(self, name, pool: PooledDB, pool_factory=None):
+    """
+    :param pool_factory: () -> PooledDB, fork 之后在子进程里重新创建连接池, 不设置则子进程不能使用
+    """
+    self.name = name
+    self.__pool = pool
+    self.__pool_factory = pool_factory
+    self.__lock = threading.Lock()
+
+  @property
+  def pool(self) -> PooledDB:
+    """连接池, fork 之后第一次使用时重新创建"""
+    pool = self.__pool
+    if pool is not None:
+      return pool
+    with self.__lock:
+      if self.__pool is None:
+        if self.__pool_factory is None:
+          raise SqlError(f"sync datasource '{self.name}' has no pool after fork")
+        self.__pool = self.__pool_factory()
+      return self.__pool
+
+  def reset_after_fork(self):
+    """同 DataSource.reset_after_fork, 继承的连接和父进程共用 socket, 只保留引用不关闭"""
+    if self.__pool is not None:
+      _inherited_pools_list.append(self.__pool)
+    self.__pool = None
+    self.__lock = threading.Lock()
+
+  def connection(self):
+    return self.pool.connection(shareable=False)
+
+  def on_commit(self, key, callback):
+    """同步数据源没有事务, 同 DataSource.on_commit"""
+
+  def close(self):
+    if self.__pool is not None:
+      self.__pool.close()
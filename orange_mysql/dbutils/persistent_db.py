@@ -56,9 +56,11 @@ by creating an instance of PersistentDB, passing the following parameters:
         is not adequate for the used database module
     ping: an optional flag controlling when connections are checked
         with the ping() method if such a method is available
-        (0 = None = never, 1 = default = whenever it is requested,
+        (0 = None = never, 1 = whenever it is requested,
         2 = when a cursor is created, 4 = when a query is executed,
-        7 = always, and all other bit combinations of these values)
+        7 = always, and all other bit combinations of these values),
+        by default (IdlePing) only when requested after being idle
+        for longer than a threshold learnt from lost connections
     closeable: if this is set to true, then closing connections will
         be allowed, but by default this will be silently ignored
     threadlocal: an optional class for representing thread-local data
@@ -126,7 +128,7 @@ Licensed under the MIT license.
 """
 
 from . import __version__
-from .steady_db import connect
+from .steady_db import connect, IdlePing
 
 try:
     # Prefer the pure Python version of threading.local.
@@ -157,7 +159,7 @@ class PersistentDB:
 
     def __init__(
             self, creator,
-            maxusage=None, setsession=None, failures=None, ping=1,
+            maxusage=None, setsession=None, failures=None, ping=IdlePing,
             closeable=False, threadlocal=None, *args, **kwargs):
         """Set up the persistent DB-API 2 connection generator.
 
@@ -173,9 +175,12 @@ class PersistentDB:
             if the default (OperationalError, InterfaceError, InternalError)
             is not adequate for the used database module
         ping: determines when the connection should be checked with ping()
-            (0 = None = never, 1 = default = whenever it is requested,
+            (0 = None = never, 1 = whenever it is requested,
             2 = when a cursor is created, 4 = when a query is executed,
             7 = always, and all other bit combinations of these values)
+            IdlePing = default = when requested after being idle longer
+            than a threshold learnt from lost connections, the generator
+            gets its own IdlePing instance, pass one to tune it
         closeable: if this is set to true, then closing connections will
             be allowed, but by default this will be silently ignored
         threadlocal: an optional class for representing thread-local data
@@ -200,6 +205,8 @@ class PersistentDB:
         self._maxusage = maxusage
         self._setsession = setsession
         self._failures = failures
+        if ping is IdlePing:  # one adaptive policy per generator
+            ping = IdlePing()
         self._ping = ping
         self._closeable = closeable
         self._args, self._kwargs = args, kwargs
@@ -61,9 +61,11 @@ an instance of PooledDB, passing the following parameters:
         is not adequate for the used database module
     ping: an optional flag controlling when connections are checked
         with the ping() method if such a method is available
-        (0 = None = never, 1 = default = whenever fetched from the pool,
+        (0 = None = never, 1 = whenever fetched from the pool,
         2 = when a cursor is created, 4 = when a query is executed,
-        7 = always, and all other bit combinations of these values)
+        7 = always, and all other bit combinations of these values),
+        by default (IdlePing) only when fetched from the pool after being
+        idle for longer than a threshold learnt from lost connections
 
     The creator function or the connect function of the DB-API 2 compliant
     database module specified as the creator will receive any additional
@@ -146,10 +148,12 @@ Copyright, credits and license:
 Licensed under the MIT license.
 """
 
-from threading import Condition
+from queue import Empty, SimpleQueue
+from threading import Condition, local
+import weakref
 
 from . import __version__
-from .steady_db import connect
+from .steady_db import connect, IdlePing
 
 
 class PooledDBError(Exception):
@@ -168,6 +172,22 @@ class TooManyConnections(PooledDBError):
     """Too many database connections were opened."""
 
 
+class _SlotOwner:
+    """Thread local owner of the thread slot of a fast mode pool, the slot
+    is dropped when the thread ends and its owner is collected."""
+
+    __slots__ = ('slot', '__weakref__')
+
+    def __init__(self, slot):
+        self.slot = slot
+
+
+def _drop_slot(pool_ref, slot):
+    pool = pool_ref()
+    if pool is not None:
+        pool._drop_slot(slot)
+
+
 class PooledDB:
     """Pool for DB-API 2 connections.
 
@@ -181,7 +201,7 @@ class PooledDB:
             self, creator, min_cached=0, max_cached=0,
             max_shared=0, max_connections=0, blocking=False,
             max_usage=None, set_session=None, reset=True,
-            failures=None, ping=1,
+            failures=None, ping=IdlePing, fast=False,
             *args, **kwargs):
         """Set up the DB-API 2 connection pool.
 
@@ -229,10 +249,23 @@ class PooledDB:
         ping: determines when the connection should be checked with ping()
             确定何时应使用ping（）检查连接
             (0 = None = never,
-            1 = default = whenever fetched from the pool,
+            1 = whenever fetched from the pool,
             2 = when a cursor is created,
             4 = when a query is executed,
             7 = always, and all other bit combinations of these values)
+            IdlePing = default = when fetched from the pool after being idle
+            longer than a threshold learnt from lost connections, the pool
+            gets its own IdlePing instance, pass one to tune it
+            默认只在空闲超过阈值的连接取出时 ping, 阈值根据断开的连接学习
+        fast: contention reduced mode for many threads, dedicated
+            connections only (max_shared is ignored)
+            减少多线程锁竞争的模式, 只用专用连接
+            Each thread keeps the last connection it gave back and takes
+            it again without locking, the other idle connections are kept
+            in a queue.SimpleQueue, the lock is only taken to open a new
+            connection or to wait at max_connections.
+            每个线程缓存自己上次归还的连接, 再次获取不加锁, 其他空闲连接放在
+            queue.SimpleQueue, 只有新建连接或者连接数到上限等待时才加锁
         args, kwargs: the parameters that shall be passed to the creator
             function or the connection constructor of the DB-API 2 module
             应传递给DB-API 2模块的创建者函数或连接构造函数的参数
@@ -256,6 +289,8 @@ class PooledDB:
         self._set_session = set_session
         self._reset = reset
         self._failures = failures
+        if ping is IdlePing:  # one adaptive policy per pool
+            ping = IdlePing()
         self._ping = ping
 
         # ===初始化参数
@@ -288,6 +323,18 @@ class PooledDB:
         # the actual pool of idle connections
         self._lock = Condition()
         self._connections = 0
+        self._fast = bool(fast)
+        if self._fast:
+            self._max_shared = 0
+            # idle connections which are not cached by a thread
+            self._idle_queue = SimpleQueue()
+            # per thread slot of one idle connection, as a list so that
+            # another thread can take it with an atomic pop(), dropped
+            # when the thread ends
+            self._local = local()
+            self._slots = []
+            self._opened = 0
+            self._waiting = 0
 
     def init(self):
 
@@ -344,6 +391,8 @@ class PooledDB:
                 self._shared_cache.append(con)
                 self._lock.notify()
             con = PooledSharedDBConnection(self, con)
+        elif self._fast:
+            con = PooledDedicatedDBConnection(self, self._fast_take())
         else:  # try to get a dedicated connection
             with self._lock:
                 while (self._max_connections
@@ -381,8 +430,135 @@ class PooledDB:
         if not shared:  # connection has become idle,
             self.cache(con.con)  # so add it to the idle cache
 
+    def _thread_slot(self):
+        try:
+            return self._local.owner.slot
+        except AttributeError:
+            slot = []
+            owner = self._local.owner = _SlotOwner(slot)
+            with self._lock:
+                self._slots.append(slot)
+            weakref.finalize(owner, _drop_slot, weakref.ref(self), slot)
+            return slot
+
+    def _drop_slot(self, slot):
+        """The thread of ``slot`` ended, its connection goes to the queue."""
+        with self._lock:
+            for i, other in enumerate(self._slots):
+                if other is slot:
+                    del self._slots[i]
+                    break
+            while slot:
+                try:
+                    self._idle_queue.put(slot.pop())
+                except IndexError:
+                    break
+            self._lock.notify()
+
+    def _take_from_slots(self):
+        for slot in list(self._slots):
+            try:
+                return slot.pop()
+            except IndexError:
+                pass
+        return None
+
+    def _take_idle(self):
+        """Take an idle connection without locking, None if there is none.
+
+        The connection cached by this thread comes first, then the idle
+        queue, then the connections cached by the other threads.
+        """
+        try:
+            return self._thread_slot().pop()
+        except IndexError:
+            pass
+        try:
+            return self._idle_queue.get_nowait()
+        except Empty:
+            pass
+        return self._take_from_slots()
+
+    def _fast_take(self):
+        """Get a dedicated steady connection in fast mode."""
+        con = self._take_idle()
+        if con is None:
+            con = self._fast_open_or_wait()
+            if con is None:
+                # connect outside of the lock
+                try:
+                    return self.steady_connection()
+                except BaseException:
+                    with self._lock:
+                        self._opened -= 1
+                        self._lock.notify()
+                    raise
+        con._ping_check()
+        return con
+
+    def _fast_open_or_wait(self):
+        """Reserve a new connection and return None, or wait at
+        max_connections for a given back connection and return it."""
+        with self._lock:
+            waiting = False
+            try:
+                while True:
+                    if (not self._max_connections
+                            or self._opened < self._max_connections):
+                        self._opened += 1
+                        return None
+                    if not waiting:
+                        if not self._blocking:
+                            raise TooManyConnections
+                        waiting = True
+                        self._waiting += 1
+                        # connections given back from now on go to the
+                        # queue, see _fast_cache, take the ones already
+                        # cached by the threads once
+                        con = self._take_from_slots()
+                        if con is not None:
+                            return con
+                    try:
+                        return self._idle_queue.get_nowait()
+                    except Empty:
+                        pass
+                    # woken up by a given back or a closed connection
+                    self._wait_lock()
+            finally:
+                if waiting:
+                    self._waiting -= 1
+
+    def _fast_cache(self, con):
+        """Give back a dedicated steady connection in fast mode."""
+        con._reset(force=self._reset)  # rollback possible transaction
+        slot = self._thread_slot()
+        if not slot:
+            slot.append(con)
+            # checked after the append: a thread which starts waiting
+            # later sees the connection in the slot, see _fast_open_or_wait
+            if not self._waiting:
+                return
+            try:
+                con = slot.pop()
+            except IndexError:  # already taken by another thread
+                return
+        if (self._waiting or not self._max_cached
+                or self._idle_queue.qsize() < self._max_cached):
+            self._idle_queue.put(con)
+            if self._waiting:
+                with self._lock:
+                    self._lock.notify()
+        else:
+            con.close()
+            with self._lock:
+                self._opened -= 1
+                self._lock.notify()
+
     def cache(self, con):
         """Put a dedicated connection back into the idle cache."""
+        if self._fast:
+            self._fast_cache(con)
+            return
         with self._lock:
             if not self._max_cached or len(self._idle_cache) < self._max_cached:
                 con._reset(force=self._reset)  # rollback possible transaction
@@ -393,9 +569,46 @@ class PooledDB:
             self._connections -= 1
             self._lock.notify()
 
+    def discard(self, con):
+        """Close a dedicated connection instead of putting it back.
+
+        For connections left in an unknown state, for instance with
+        the rest of an unbuffered result still unread.
+        """
+        con.close()
+        with self._lock:
+            if self._fast:
+                self._opened -= 1
+            else:
+                self._connections -= 1
+            self._lock.notify()
+
     def close(self):
         """Close all connections in the pool."""
         with self._lock:
+            if self._fast:  # close the idle connections of the queue
+                idle = self._slots[:]  # and of the thread slots
+                while True:
+                    try:
+                        con = self._idle_queue.get_nowait()
+                    except Empty:
+                        break
+                    self._opened -= 1
+                    try:
+                        con.close()
+                    except Exception:
+                        pass
+                for slot in idle:
+                    while slot:
+                        try:
+                            con = slot.pop()
+                        except IndexError:
+                            break
+                        self._opened -= 1
+                        try:
+                            con.close()
+                        except Exception:
+                            pass
             while self._idle_cache:  # close all idle connections
                 con = self._idle_cache.pop(0)
                 try:
@@ -453,6 +666,12 @@ class PooledDedicatedDBConnection:
             self._pool.cache(self._con)
             self._con = None
 
+    def discard(self):
+        """Close the underlying connection instead of returning it."""
+        if self._con:
+            self._pool.discard(self._con)
+            self._con = None
+
     def __getattr__(self, name):
         """Proxy all members of the class."""
         if self._con:
@@ -112,6 +112,7 @@ Licensed under the MIT license.
 """
 
 import sys
+import time
 
 from . import __version__
 
@@ -124,6 +125,53 @@ class InvalidCursor(SteadyDBError):
     """Database cursor is invalid."""
 
 
+class IdlePing:
+    """Adaptive ping policy shared by the connections of a pool.
+
+    Instead of pinging whenever a connection is requested, ping only
+    connections which have been idle for at least ``idle_timeout``
+    seconds.  The threshold is learnt from the connections found lost
+    (e.g. closed by the server after ``wait_timeout``): it goes down to
+    ``margin`` times the idle time after which a connection was lost and
+    up to the idle time after which a ping found a connection alive,
+    within ``min_idle_timeout`` and ``max_idle_timeout``.
+
+    Hot connections are used without a round trip and the connections
+    lost while idle are still caught, a loss missed by the ping is
+    transparently handled by the reconnection of the tough methods and
+    lowers the threshold.
+    """
+
+    def __init__(self, max_idle_timeout=60.0, min_idle_timeout=1.0,
+                 margin=0.5, clock=time.monotonic):
+        if not 0 < min_idle_timeout <= max_idle_timeout:
+            raise ValueError("idle timeouts should satisfy "
+                             "0 < min_idle_timeout <= max_idle_timeout")
+        self._max_idle_timeout = max_idle_timeout
+        self._min_idle_timeout = min_idle_timeout
+        self._margin = margin
+        self._idle_timeout = max_idle_timeout
+        self.clock = clock
+
+    @property
+    def idle_timeout(self):
+        """The current threshold in seconds."""
+        return self._idle_timeout
+
+    def should_ping(self, idle):
+        return idle >= self._idle_timeout
+
+    def alive_after(self, idle):
+        """A ping found a connection alive after ``idle`` seconds."""
+        if idle > self._idle_timeout:
+            self._idle_timeout = min(self._max_idle_timeout, idle)
+
+    def lost_after(self, idle):
+        """A connection was found lost after ``idle`` seconds."""
+        self._idle_timeout = max(self._min_idle_timeout,
+                                 min(self._idle_timeout, idle * self._margin))
+
+
 def connect(
         creator, maxusage=None, setsession=None,
         failures=None, ping=1, closeable=True, *args, **kwargs):
@@ -145,6 +193,8 @@ def connect(
         (0 = None = never, 1 = default = when _ping_check() is called,
         2 = whenever a cursor is created, 4 = when a query is executed,
         7 = always, and all other bit combinations of these values)
+        or an IdlePing instance to ping when _ping_check() is called
+        on a connection idle for longer than its learnt threshold
     closeable: if this is set to false, then closing the connection will
         be silently ignored, but by default the connection can be closed
     args, kwargs: the parameters that shall be passed to the creator
@@ -206,7 +256,12 @@ class SteadyDBConnection:
                 failures, tuple) and not issubclass(failures, Exception):
             raise TypeError("'failures' must be a tuple of exceptions.")
         self._failures = failures
-        self._ping = ping if isinstance(ping, int) else 0
+        if isinstance(ping, IdlePing):
+            self._ping_policy = ping
+            self._ping = 1
+        else:
+            self._ping_policy = None
+            self._ping = ping if isinstance(ping, int) else 0
         self._closeable = closeable
         self._args, self._kwargs = args, kwargs
         self._store(self._create())
@@ -335,6 +390,16 @@ class SteadyDBConnection:
         self._transaction = False
         self._closed = False
         self._usage = 0
+        self._touch()
+
+    def _touch(self):
+        """Remember the last exchange with the server for the ping policy."""
+        if self._ping_policy is not None:
+            self._last_used = self._ping_policy.clock()
+
+    def _idle(self):
+        """Seconds since the last exchange with the server."""
+        return self._ping_policy.clock() - self._last_used
 
     def _close(self):
         """Close the tough connection.
@@ -369,6 +434,11 @@ class SteadyDBConnection:
         unless the connection is currently inside a transaction.
         """
         if ping & self._ping:
+            policy = self._ping_policy
+            if policy is not None:
+                idle = self._idle()
+                if not policy.should_ping(idle):
+                    return None
             try:  # if possible, ping the connection
                 try:  # pass a reconnect=False flag if this is supported
                     alive = self._con.ping(False)
@@ -385,6 +455,12 @@ class SteadyDBConnection:
                     alive = True
                 if alive:
                     reconnect = False
+            if policy is not None and self._ping:
+                if alive:
+                    policy.alive_after(idle)
+                    self._touch()
+                else:
+                    policy.lost_after(idle)
             if reconnect and not self._transaction:
                 try:  # try to reopen the connection
                     con = self._create()
@@ -451,6 +527,7 @@ class SteadyDBConnection:
         self._transaction = False
         try:
             self._con.commit()
+            self._touch()
         except self._failures as error:  # cannot commit
             try:  # try to reopen the connection
                 con = self._create()
@@ -466,6 +543,7 @@ class SteadyDBConnection:
         self._transaction = False
         try:
             self._con.rollback()
+            self._touch()
         except self._failures as error:  # cannot rollback
             try:  # try to reopen the connection
                 con = self._create()
@@ -620,6 +698,8 @@ class SteadyDBCursor:
             execute = name.startswith('execute')
             con = self._con
             transaction = con._transaction
+            if con._ping_policy is not None:
+                idle = con._idle()
             if not transaction:
                 con._ping_check(4)
             try:
@@ -654,6 +734,7 @@ class SteadyDBCursor:
                             self.close()
                             self._cursor = cursor2
                             con._usage += 1
+                            con._touch()
                             return result
                         try:
                             cursor2.close()
@@ -693,6 +774,9 @@ class SteadyDBCursor:
                         else:
                             use2 = True
                         if use2:
+                            if con._ping_policy is not None:
+                                # the connection had to be reopened
+                                con._ping_policy.lost_after(idle)
                             self.close()
                             con._close()
                             con._store(con2)
@@ -714,6 +798,7 @@ class SteadyDBCursor:
                 raise error  # re-raise the original error again
             else:
                 con._usage += 1
+                con._touch()
                 return result
         return tough_method
 
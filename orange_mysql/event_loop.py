@@ -0,0 +1,39 @@
+"""
+事件循环, 装了 uvloop 的时候可以换成 uvloop, 没装就用 asyncio 自带的循环
+
+策略要在创建事件循环之前设置, 例如启动时:
+  install_uvloop()
+  asyncio.run(main())
+"""
+import asyncio
+
+try:
+  import uvloop
+except ImportError:
+  uvloop = None
+
+
+def uvloop_available() -> bool:
+  return uvloop is not None
+
+
+def install_uvloop() -> bool:
+  """有 uvloop 就把事件循环策略换成 uvloop, 返回是否换成了 uvloop"""
+  if uvloop is None:
+    return False
+  asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+  return True
+
+
+def new_event_loop(prefer_uvloop=True) -> asyncio.AbstractEventLoop:
+  """创建事件循环, 用于工作线程自己的循环, prefer_uvloop 时有 uvloop 就用 uvloop"""
+  if prefer_uvloop and uvloop is not None:
+    return uvloop.new_event_loop()
+  return asyncio.new_event_loop()
+
+
+def loop_name(loop: asyncio.AbstractEventLoop) -> str:
+  """事件循环的实现, uvloop 或者 asyncio"""
+  if uvloop is not None and isinstance(loop, uvloop.Loop):
+    return "uvloop"
+  return "asyncio"
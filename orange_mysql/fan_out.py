@@ -0,0 +1,91 @@
+"""
+同步查询并行执行, 互不依赖的多个查询放到线程池里同时跑, 每个查询用自己的连接池连接
+12 个互不相关的统计查询总耗时接近最慢的那个, 而不是全部加起来
+
+  with SyncFanOut(max_workers=8) as fan_out:
+    user_count, order_count = fan_out.run([
+      user_repo.query().count,
+      order_repo.query().eq("state", 1).count,
+    ], timeout=5)
+
+线程数不要超过连接池的 maxsize, 多出来的线程只会等连接
+"""
+import concurrent.futures
+import threading
+import time
+
+from .sync_repo import SyncMySqlQuery
+
+
+class SyncFanOut:
+
+  __slots__ = ("__executor",)
+
+  def __init__(self, max_workers=8):
+    self.__executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers, thread_name_prefix="orange_mysql_fan_out")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.shutdown()
+
+  def shutdown(self, wait=True):
+    self.__executor.shutdown(wait, cancel_futures=True)
+
+  def as_completed(self, call_list, timeout=None):
+    """
+    按完成的顺序返回 (序号, 结果), 出错的结果是异常对象
+    :param call_list: 无参数的函数, 例如 repo.query().count, 或者 SyncMySqlQuery (执行 get_list)
+    :param timeout: 每个查询开始执行之后最多等待的秒数, 超时的结果是 TimeoutError,
+      线程里的查询不会被中断, 执行完才归还连接
+    """
+    started = {}
+    lock = threading.Lock()
+
+    def run(index, call):
+      with lock:
+        started[index] = time.monotonic()
+      if isinstance(call, SyncMySqlQuery):
+        return call.get_list()
+      return call()
+
+    future_dict = {self.__executor.submit(run, index, call): index
+                   for index, call in enumerate(call_list)}
+    pending = set(future_dict)
+    try:
+      while pending:
+        wait = None
+        if timeout is not None:
+          now = time.monotonic()
+          with lock:
+            start_list = [(f, started.get(future_dict[f])) for f in pending]
+          for f, start in start_list:
+            if start is not None and now - start >= timeout:
+              pending.discard(f)
+              f.cancel()
+              yield future_dict[f], TimeoutError(f"query {future_dict[f]} timeout after {timeout}s")
+          if not pending:
+            break
+          # 最早超时的查询到期时醒来, 还没开始执行的查询每隔 timeout 检查一次
+          wait = min([start + timeout - now for _, start in start_list
+                      if start is not None and now - start < timeout] or [timeout])
+        done, pending = concurrent.futures.wait(
+          pending, wait, concurrent.futures.FIRST_COMPLETED)
+        for f in done:
+          error = f.exception()
+          yield future_dict[f], f.result() if error is None else error
+    finally:
+      # 调用方提前结束时, 还没开始的查询不再执行
+      for f in pending:
+        f.cancel()
+
+  def run(self, call_list, timeout=None) -> list:
+    """按 call_list 的顺序返回结果, 有查询出错或超时的时候抛出第一个异常, 参数同 as_completed"""
+    result_list = [None] * len(call_list)
+    for index, result in self.as_completed(call_list, timeout):
+      if isinstance(result, BaseException):
+        raise result
+      result_list[index] = result
+    return result_list
@@ -1,13 +1,20 @@
 import asyncio
+import functools
+import os
 
 from orange_kit.model import VoBase, VoField, DtoField
 
 from .aiomysql import create_pool
 from .aiomysql.pool import Pool
-from .utils import orange_sql_log, config_debug_log
+from .aiomysql.overload import AdaptiveLimiter, CircuitBreaker
+from .aiomysql.budget import ConnectionBudget, ProcessConnectionBudget
+from .datasource import DataSource, SyncDataSource
+from .dbutils.pooled_db import PooledDB
+from . import pymysql
+from .event_loop import loop_name
+from .utils import orange_sql_log, config_debug_log, SqlError
 
 
-# todo 可以初始化多个数据, 多数据可进行命名, 在定义rope的时候可以根据名字选择数据库
 # todo 做一个脱离api 可执行的方式
 # todo api 里面统一配置
 # todo 像 spring boot 一样yml 自动配置, 生成yml schema
@@ -20,49 +27,254 @@ class OrangeMySqlConfig(VoBase):
   user:str       = DtoField("用户名",require=True)
   password:str   = DtoField("密码",require=True)
   db:str         = DtoField("数据库",require=True)
+  minsize: int   = VoField("连接池最小连接数", default=1)
+  maxsize: int   = VoField("连接池最大连接数", default=16)
+  max_connections: int = VoField("多个事件循环(线程)各有一个连接池时, 每个库所有连接池加起来的最大连接数, 不设置不限制", default=None)
+  budget_dir: str = VoField("多进程(prefork)共用 max_connections 时放连接预算锁文件的目录, 同一台机器的进程用同一个目录, 不设置只限制当前进程", default=None)
   enable_debug_info_show: bool = VoField("输出开发信息",default=False)
+  acquire_timeout: float = VoField("获取连接的超时秒数, 超时抛出 PoolExhaustedError, 不设置则一直等待, 设置了 max_connections 时默认 30 秒",default=None)
+  partitions: dict = VoField("连接池分区 {名字: [最小保留连接数, 最大连接数]} 例如 {'api': [4, 16], 'batch': [0, 4]}",default=None)
+  limiter: dict = VoField("自适应并发限制参数 例如 {'initial_limit': 20, 'max_limit': 200}, 超出限制抛出 PoolOverloadedError, 不设置不启用",default=None)
+  breaker: dict = VoField("熔断参数 例如 {'failure_threshold': 5, 'reset_timeout': 10}, 熔断时抛出 CircuitOpenError, 不设置不启用",default=None)
+  replicas: list = VoField("从库列表 例如 [{'host': '192.168.1.51'}, {'host': '192.168.1.52', 'port': 3307}], 没写的 port user password 沿用主库",default=None)
+  idle_timeout: float = VoField("空闲超过多少秒的连接关闭 (保留 minsize 个), 不设置不关闭, 设置了 max_connections 时默认 60 秒",default=None)
+  read_after_write: float = VoField("同一上下文写入后多少秒内的读查询走主库, 保证读到自己写的数据, 0 不启用",default=0)
 
 
   def get_conn_str(self):
     return f"mysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.db}?charset=uft8"
 
 
-sql_pool = None
+DEFAULT_DATASOURCE = "default"
 
-def orange_mysql_init_func_factory(config: OrangeMySqlConfig):
+# 已初始化的数据源 名字 -> DataSource
+datasource_dict: dict[str, DataSource] = {}
+# 已初始化的同步数据源 名字 -> SyncDataSource
+sync_datasource_dict: dict[str, SyncDataSource] = {}
 
-  config_debug_log(config.enable_debug_info_show)
+
+def _pool_kwargs(config: OrangeMySqlConfig, loop, endpoint: dict = None, budget=None):
+  """根据配置生成连接池参数, endpoint 里的 host port user password 覆盖主库配置, 用于从库"""
+  endpoint = endpoint or {}
+  return {
+    "loop": loop,
+    "autocommit": True,
+    "minsize": config.minsize,
+    "maxsize": config.maxsize,
+    "echo": False,       # 输出Sql 语句
+    "pool_recycle": -1,  # 连接被回收的秒数，有助于处理池中的陈旧连接，默认值为 -1，表示禁用回收逻辑。,
+    "acquire_timeout": config.acquire_timeout,
+    "partitions": config.partitions,
+    # 限流和熔断每个连接池单独计算
+    "limiter": None if config.limiter is None else AdaptiveLimiter(**config.limiter),
+    "breaker": None if config.breaker is None else CircuitBreaker(**config.breaker),
+    "budget": budget,
+    "idle_timeout": config.idle_timeout,
+    "host": endpoint.get("host", config.host),
+    "port": endpoint.get("port", config.port),
+    "user": endpoint.get("user", config.user),
+    "password": endpoint.get("password", config.password),
+    "db": config.db,
+  }
+
+
+async def _create_config_pool(pool_kwargs: dict):
+  host = pool_kwargs["host"]
+  port = pool_kwargs["port"]
+  orange_sql_log.debug(f"orange mysql connect to {host}:{port}")
+  pool = await create_pool(**pool_kwargs)
+  orange_sql_log.debug(f"orange mysql {host}:{port} ok")
+  return pool
+
+
+def _create_budget(name, index, config: OrangeMySqlConfig):
+  if config.max_connections is None:
+    return None
+  if config.budget_dir is None:
+    return ConnectionBudget(config.max_connections)
+  # 主库和每个从库各一个锁文件
+  path = os.path.join(config.budget_dir, f"orange_mysql_{name}_{index}.budget")
+  return ProcessConnectionBudget.shared(path, config.max_connections)
+
+
+async def _create_datasource(name, config: OrangeMySqlConfig, loop) -> DataSource:
+  endpoint_list = [None] + list(config.replicas or [])
+  # 每个库一个连接预算, 所有事件循环的连接池共用
+  budget_list = [_create_budget(name, i, config) for i in range(len(endpoint_list))]
+
+  def pool_factory(other_loop):
+    # 在其他事件循环里第一次使用时创建该循环的连接池, 最小连接在第一次获取连接时建立
+    pool_list = [Pool(**_pool_kwargs(config, other_loop, endpoint, budget))
+                 for endpoint, budget in zip(endpoint_list, budget_list)]
+    return pool_list[0], pool_list[1:]
+
+  if config.max_connections is not None and config.budget_dir is not None:
+    # 多进程共用连接预算时, prefork 的 master 初始化之后就 fork, 不预先建立连接,
+    # master 拿着的预算要到 master 退出才释放, 工作进程用不上
+    pool_list = [Pool(**_pool_kwargs(config, loop, endpoint, budget))
+                 for endpoint, budget in zip(endpoint_list, budget_list)]
+  else:
+    pool_list = await asyncio.gather(
+      *[_create_config_pool(_pool_kwargs(config, loop, endpoint, budget))
+        for endpoint, budget in zip(endpoint_list, budget_list)],
+      return_exceptions=True)
+  for pool in pool_list:
+    if isinstance(pool, BaseException):
+      for created in pool_list:
+        if isinstance(created, Pool):
+          created.close()
+      raise pool
+  return DataSource(name, pool_list[0], pool_list[1:], config.read_after_write, pool_factory)
+
+
+def orange_mysql_init_func_factory(config):
+  """
+  :param config: OrangeMySqlConfig 初始化名为 default 的数据源,
+    或者 dict 名字 -> OrangeMySqlConfig 初始化多个命名数据源, repo 通过 datasource 参数选择
+  """
+  if isinstance(config, OrangeMySqlConfig):
+    config_dict = {DEFAULT_DATASOURCE: config}
+  else:
+    config_dict = dict(config)
+
+  config_debug_log(any(c.enable_debug_info_show for c in config_dict.values()))
 
   async def init_func():
-    global sql_pool
     loop = asyncio.get_running_loop()
-    _config = {
-      "loop": loop,
-      "autocommit": True,
-      "minsize": 1,
-      "maxsize": 16,
-      "echo": False,       # 输出Sql 语句
-      "pool_recycle": -1,  # 连接被回收的秒数，有助于处理池中的陈旧连接，默认值为 -1，表示禁用回收逻辑。,
-      "host": config.host,
-      "port": config.port,
-      "user": config.user,
-      "password": config.password,
-      "db": config.db,
-    }
-    orange_sql_log.debug.print(f"orange mysql connect to {config.host}:{config.port}", end=" ")
-
-    pool = await create_pool(**_config)
-    orange_sql_log.debug("ok")
-    sql_pool = pool
+    orange_sql_log.debug(f"orange mysql event loop {loop_name(loop)}")
+    name_list = list(config_dict.keys())
+    result_list = await asyncio.gather(
+      *[_create_datasource(name, config_dict[name], loop) for name in name_list],
+      return_exceptions=True)
+
+    ds_list = [ds for ds in result_list if isinstance(ds, DataSource)]
+    for ds in result_list:
+      if isinstance(ds, BaseException):
+        # 有一个失败就全部关闭, 不留下半初始化的状态
+        for created in ds_list:
+          created.close()
+        raise ds
+
+    for ds in ds_list:
+      datasource_dict[ds.name] = ds
 
     def close_pool():
-      pool.close()
+      for created in ds_list:
+        created.close()
+        if datasource_dict.get(created.name) is created:
+          datasource_dict.pop(created.name)
 
     return close_pool
 
   return init_func
 
-def get_sql_pool()->Pool:
-  return sql_pool
+def orange_mysql_worker_init_func_factory():
+  """
+  prefork 部署时工作进程的初始化
+  master 用 orange_mysql_init_func_factory 初始化后 fork 出工作进程, 工作进程不会使用继承来的连接,
+  在自己的事件循环里调用返回的 init_func 建立最小连接数, 不调用也会在第一次使用时建立
+  设置了 budget_dir 时 master 不要在 fork 之前执行查询, master 的连接占用的预算工作进程用不上
+  """
+
+  async def init_func():
+    ds_list = list(datasource_dict.values())
+    await asyncio.gather(*[ds.fill() for ds in ds_list])
+
+    def close_pool():
+      for ds in ds_list:
+        ds.close()
+
+    return close_pool
+
+  return init_func
+
+
+def _after_fork_in_child():
+  # 父进程的连接不能在子进程使用也不能关闭, 子进程按需重新建立连接池
+  for ds in datasource_dict.values():
+    ds.reset_after_fork()
+  for ds in sync_datasource_dict.values():
+    ds.reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _create_sync_pool(c: OrangeMySqlConfig) -> PooledDB:
+  return PooledDB(
+    creator=pymysql,
+    min_cached=c.minsize,
+    max_connections=c.maxsize,
+    blocking=True,
+    # 每个线程缓存自己的连接, 减少多线程时的锁竞争
+    fast=True,
+    host=c.host,
+    port=c.port,
+    user=c.user,
+    password=c.password,
+    database=c.db,
+    autocommit=True,
+    # 和异步连接一样允许一次发送多条语句, 分页的 PAGE_MULTI_STATEMENT 模式使用
+    client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS,
+  )
+
+
+def orange_mysql_sync_init(config):
+  """
+  初始化同步数据源, 给 SyncBaseRepo 使用, 不需要事件循环
+  :param config: 同 orange_mysql_init_func_factory, 从库配置不使用, 同步查询都走主库
+  :return: 关闭连接池的函数
+  """
+  if isinstance(config, OrangeMySqlConfig):
+    config_dict = {DEFAULT_DATASOURCE: config}
+  else:
+    config_dict = dict(config)
+
+  config_debug_log(any(c.enable_debug_info_show for c in config_dict.values()))
+
+  ds_list = []
+  try:
+    for name, c in config_dict.items():
+      orange_sql_log.debug(f"orange mysql sync connect to {c.host}:{c.port}")
+      pool_factory = functools.partial(_create_sync_pool, c)
+      ds_list.append(SyncDataSource(name, pool_factory(), pool_factory))
+  except BaseException:
+    for created in ds_list:
+      created.close()
+    raise
+
+  for ds in ds_list:
+    sync_datasource_dict[ds.name] = ds
+
+  def close_pool():
+    for created in ds_list:
+      created.close()
+      if sync_datasource_dict.get(created.name) is created:
+        sync_datasource_dict.pop(created.name)
+
+  return close_pool
+
+
+def get_sync_datasource(name=DEFAULT_DATASOURCE) -> SyncDataSource:
+  ds = sync_datasource_dict.get(name)
+  if ds is None:
+    raise SqlError(f"sync datasource '{name}' not init")
+  return ds
+
+
+def get_datasource(name=DEFAULT_DATASOURCE) -> DataSource:
+  ds = datasource_dict.get(name)
+  if ds is None:
+    raise SqlError(f"datasource '{name}' not init")
+  return ds
 
+def get_datasource_metrics() -> dict:
+  """所有数据源的连接池统计信息"""
+  return {name: ds.metrics() for name, ds in datasource_dict.items()}
 
+def get_sql_pool(name=DEFAULT_DATASOURCE)->Pool:
+  """主库连接池"""
+  ds = datasource_dict.get(name)
+  if ds is None: return None
+  return ds.primary
@@ -5,10 +5,11 @@ from . import err
 #: Regular expression for :meth:`Cursor.executemany`.
 #: executemany only supports simple bulk insert.
 #: You can use it to load large dataset.
+#: The MySQL 8 row alias ``AS new ON DUPLICATE ...`` is kept in the postfix.
 RE_INSERT_VALUES = re.compile(
     r"\s*((?:INSERT|REPLACE)\b.+\bVALUES?\s*)"
     + r"(\(\s*(?:%s|%\(.+\)s)\s*(?:,\s*(?:%s|%\(.+\)s)\s*)*\))"
-    + r"(\s*(?:ON DUPLICATE.*)?);?\s*\Z",
+    + r"(\s*(?:(?:AS\s+\w+\s+)?ON DUPLICATE.*)?);?\s*\Z",
     re.IGNORECASE | re.DOTALL,
 )
 
@@ -39,6 +40,9 @@ class Cursor:
         self._executed = None
         self._result = None
         self._rows = None
+        #: ``(lastrowid, rowcount)`` of every statement sent by the last
+        #: batched executemany(), in order.
+        self.batch_results = []
 
     def close(self):
         """
@@ -160,7 +164,12 @@ class Cursor:
         This method improves performance on multiple-row INSERT and
         REPLACE. Otherwise it is equivalent to looping over args with
         execute().
+
+        ``batch_results`` gets the ``(lastrowid, rowcount)`` of every
+        statement sent, a multiple rows INSERT gets ``lastrowid`` for its
+        first row.
         """
+        self.batch_results = []
         if not args:
             return
 
@@ -179,7 +188,11 @@ class Cursor:
                 self._get_db().encoding,
             )
 
-        self.rowcount = sum(self.execute(query, arg) for arg in args)
+        rows = 0
+        for arg in args:
+            rows += self.execute(query, arg)
+            self.batch_results.append((self.lastrowid, self.rowcount))
+        self.rowcount = rows
         return self.rowcount
 
     def _do_execute_many(
@@ -203,12 +216,16 @@ class Cursor:
             if isinstance(v, str):
                 v = v.encode(encoding, "surrogateescape")
             if len(sql) + len(v) + len(postfix) + 1 > max_stmt_length:
-                rows += self.execute(sql + postfix)
+                r = self.execute(sql + postfix)
+                rows += r
+                self.batch_results.append((self.lastrowid, r))
                 sql = bytearray(prefix)
             else:
                 sql += b","
             sql += v
-        rows += self.execute(sql + postfix)
+        r = self.execute(sql + postfix)
+        rows += r
+        self.batch_results.append((self.lastrowid, r))
         self.rowcount = rows
         return rows
 
@@ -1,10 +1,23 @@
+import asyncio
+import base64
 import datetime
+import decimal
+import heapq
+import itertools
+import json
+import threading
+import time
 from orange_kit.model import VoBase
 from orange_kit.json import json_dumps,json_loads
 from .field.sql_field import SqlField
 
-from .aiomysql.pool import Pool
-from .init import get_sql_pool
+from .aiomysql.cursors import SSCursor
+from .aiomysql.pool import PRIORITY_NORMAL
+from .pymysql.constants import ER
+from .pymysql.err import MySQLError
+from .datasource import DataSource
+from .init import get_datasource, DEFAULT_DATASOURCE
+from .shard import ShardRouter
 from .utils import get_values_placeholder, orange_sql_log, SqlError
 
 
@@ -13,6 +26,36 @@ from .utils import get_values_placeholder, orange_sql_log, SqlError
 # todo 或者, 一开始就有 连接池这个对应, 只是没有连接, 任何时候实例化都不会出问题
 # 刚觉第二种更实用 这要优化sql orm 时候来做
 
+# 分页查询统计总数和查询这一页的方式
+# 先 count 再查询这一页, 两次往返
+PAGE_SEQUENTIAL = "sequential"
+# count 和这一页的查询拼成一条多语句一次发送, 一次往返
+PAGE_MULTI_STATEMENT = "multi_statement"
+# 查询这一页时用 COUNT(*) OVER() 带出总数, 一次往返一次扫描, 需要 mysql 8
+PAGE_WINDOW = "window"
+# count 和这一页的查询各用一个连接同时执行, 事务里退化为 PAGE_SEQUENTIAL, 只用于异步查询
+PAGE_CONCURRENT = "concurrent"
+
+# count 的方式
+# 精确的 SELECT count(*)
+COUNT_EXACT = "exact"
+# 估算, 没有条件时取 information_schema.TABLES 的行数, 有条件时取 EXPLAIN 估计的行数, 不扫描表
+COUNT_ESTIMATED = "estimated"
+# 精确 count 的结果按 (表, 条件结构, 参数) 缓存, 见 count_cache
+COUNT_CACHED = "cached"
+
+
+# update_many 里没有设置的字段
+_MISSING = object()
+
+
+def _item_value(item, name, default=None):
+  """对象或者 dict 的字段值"""
+  if isinstance(item, dict):
+    return item.get(name, default)
+  return item.__dict__.get(name, default)
+
+
 def get_val_from_db_return(field: SqlField, val):
   if val is None: return val
   if field.map_json is True:
@@ -21,94 +64,329 @@ def get_val_from_db_return(field: SqlField, val):
   return field.type_converter(val)
 
 
+def _render_where(shape):
+  """条件结构渲染成 sql 片段"""
+  if isinstance(shape, str):
+    # AND OR 连接符, 或者 where_sql 直接写的 sql
+    return shape
+  op, field, arity = shape
+  if op == "in":
+    return f" ((({field}) in ({get_values_placeholder(arity)})))"
+  if op == "like":
+    return f"({field} like %s) "
+  return f"({field} {op} %s)"
+
+
+def _keyset_condition(column_list, desc, after_null):
+  """
+  get_page_after 的翻页条件, 只比较排序字段和 id, 可以直接用索引定位到上一页的最后一条
+  :param column_list: [排序字段, id字段] 或者只按 id 排序时 [id字段]
+  :param after_null: 上一页最后一条的排序字段是 NULL, mysql 里 NULL 最小, 正序排在最前, 倒序排在最后
+  """
+  op = "<" if desc else ">"
+  if len(column_list) == 1:
+    return f"({column_list[0]} {op} %s)"
+  column, id_column = column_list
+  if after_null is True:
+    if desc:
+      return f"({column} IS NULL AND {id_column} < %s)"
+    return f"(({column} IS NULL AND {id_column} > %s) OR {column} IS NOT NULL)"
+  sql = f"({column} {op} %s OR ({column} = %s AND {id_column} {op} %s)"
+  if desc:
+    sql += f" OR {column} IS NULL"
+  return sql + ")"
+
+
+def _keyset_params(value_list):
+  """_keyset_condition 的参数, value_list 是上一页最后一条的 [排序字段值, id]"""
+  if len(value_list) == 1 or value_list[0] is None:
+    return [value_list[-1]]
+  return [value_list[0], value_list[0], value_list[1]]
+
+
+def _encode_cursor_value(value):
+  if isinstance(value, datetime.datetime):
+    return {"dt": value.isoformat()}
+  if isinstance(value, datetime.date):
+    return {"d": value.isoformat()}
+  if isinstance(value, decimal.Decimal):
+    return {"dec": str(value)}
+  return value
+
+
+def _decode_cursor_value(value):
+  if isinstance(value, dict):
+    if "dt" in value: return datetime.datetime.fromisoformat(value["dt"])
+    if "d" in value: return datetime.date.fromisoformat(value["d"])
+    if "dec" in value: return decimal.Decimal(value["dec"])
+  return value
+
+
+def _encode_page_cursor(field_list, desc, value_list) -> str:
+  """翻页游标, 记录排序方式和上一页最后一条的排序字段值, 对调用方不透明"""
+  data = [field_list, desc, [_encode_cursor_value(v) for v in value_list]]
+  try:
+    raw = json.dumps(data, separators=(",", ":"))
+  except TypeError as e:
+    raise SqlError(f"get_page_after order field value not support: {e}")
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_page_cursor(cursor, field_list, desc) -> list:
+  """解析翻页游标, 游标和查询的排序不一致时抛出 SqlError"""
+  try:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    cursor_field_list, cursor_desc, value_list = json.loads(raw)
+  except (ValueError, TypeError) as e:
+    raise SqlError(f"page cursor error: {e}")
+  if cursor_field_list != field_list or cursor_desc != desc or len(value_list) != len(field_list):
+    raise SqlError("page cursor not match query order")
+  return [_decode_cursor_value(v) for v in value_list]
+
+
 class SqlWhereBuilder:
 
-  __slots__ = ("_where_sql_list","_where_param_list")
+  __slots__ = ("_where_shape_list","_where_param_list",
+               "_where_value_dict","_where_has_or")
 
   def __init__(self):
-    self._where_sql_list = []
+    # where 条件的结构, (操作符, 字段, 参数个数) 或者 sql 字符串, 生成 sql 时才渲染, 也用作 sql 缓存的键
+    self._where_shape_list = []
     self._where_param_list = []
+    # eq in_ 条件的取值, 用于分片路由
+    self._where_value_dict = {}
+    self._where_has_or = False
 
   def where_sql(self,sql, value_list=None, enable=True):
     if enable is True:
-      self._where_sql_list.append(sql)
+      self._where_shape_list.append(sql)
       if value_list is not None:
         self._where_param_list.extend(value_list)
 
   def eq(self,field, value, enable=True):
     """等于"""
     if enable is True:
-      self._where_sql_list.append(f"({field} = %s)")
+      self._where_shape_list.append(("=", field, 1))
       self.__after_add_where(value)
+      self._where_value_dict.setdefault(field, [value])
     return self
 
   def ne(self, field, value, enable=True):
     """不等于"""
     if enable is True:
-      self._where_sql_list.append(f"({field} != %s)")
+      self._where_shape_list.append(("!=", field, 1))
       self.__after_add_where(value)
     return self
 
   def gt(self,field, value, enable=True):
     """等于"""
     if enable is True:
-      self._where_sql_list.append(f"({field} > %s)")
+      self._where_shape_list.append((">", field, 1))
       self.__after_add_where(value)
     return self
 
   def lt(self,field, value, enable=True):
     """小于"""
     if enable is True:
-      self._where_sql_list.append(f"({field} < %s)")
+      self._where_shape_list.append(("<", field, 1))
       self.__after_add_where(value)
     return self
 
   def like(self, field, value, enable=True):
     """模糊查询"""
     if enable is True:
-      self._where_sql_list.append(f"({field} like '%%{value}%%') ")
-      self._where_sql_list.append("AND")
-      # self.__after_add_where(value)
+      self._where_shape_list.append(("like", field, 1))
+      self.__after_add_where(f"%{value}%")
     return self
 
   def in_(self, field, value_range, enable=True):
     if enable:
-      placeholder = get_values_placeholder(len(value_range))
-      sql = f" ((({field}) in ({placeholder})))"
-      self._where_sql_list.append(sql)
-      self._where_sql_list.append("AND")
+      self._where_shape_list.append(("in", field, len(value_range)))
+      self._where_shape_list.append("AND")
       self._where_param_list.extend(value_range)
+      self._where_value_dict.setdefault(field, list(value_range))
     return self
 
   def or_(self):
     """或"""
-    self._where_sql_list.pop()
-    self._where_param_list.append("OR")
+    self._where_shape_list.pop()
+    self._where_shape_list.append("OR")
+    self._where_has_or = True
     return self
 
+  def _where_values(self, field):
+    """where 条件限定的字段取值列表, 没有限定或者有 or 条件时返回 None"""
+    if self._where_has_or: return None
+    return self._where_value_dict.get(field)
+
+  def _where_shape(self) -> tuple:
+    """where 条件的结构, 参数不同结构相同的查询 sql 一样"""
+    return tuple(self._where_shape_list)
+
   def __after_add_where(self, value):
     self._where_param_list.append(value)
-    self._where_sql_list.append("AND")
+    self._where_shape_list.append("AND")
 
   def _build_where(self):
-    return  " ".join(self._where_sql_list[:-1])
+    return  " ".join([_render_where(shape) for shape in self._where_shape_list[:-1]])
+
+
+class _StatementCache:
+  """
+  编译好的 sql 语句缓存, 键是查询的结构 (表, 查询字段, 条件结构, 排序, 语句类型),
+  重复的查询不再拼接 sql, 只绑定参数, 满了就清空重新缓存
+  """
+
+  __slots__ = ("__statement_dict", "__max_size")
+
+  def __init__(self, max_size=4096):
+    self.__statement_dict = {}
+    self.__max_size = max_size
+
+  def get(self, key):
+    return self.__statement_dict.get(key)
+
+  def put(self, key, statement):
+    if len(self.__statement_dict) >= self.__max_size:
+      self.__statement_dict.clear()
+    self.__statement_dict[key] = statement
+
+  def clear(self):
+    self.__statement_dict.clear()
+
+
+statement_cache = _StatementCache()
+
+
+class _CountCache:
+  """
+  COUNT_CACHED 的 count 结果缓存, 按表存放, 过期时间 ttl 秒,
+  通过 BaseRepo.insert MysqlUpdate.execute 写入一个表时清空这个表的缓存, 事务里的写入在提交之后再清空一次,
+  其他途径 (其他进程, 直接执行的 sql) 的写入要等缓存过期, 缓存只在当前进程有效
+  """
+
+  __slots__ = ("ttl", "__max_size", "__table_dict", "__version_dict", "__size", "__lock")
+
+  def __init__(self, ttl=60, max_size=4096):
+    self.ttl = ttl
+    self.__max_size = max_size
+    self.__table_dict = {}
+    # 每次写入加一, count 执行期间有写入时不缓存这次的结果
+    self.__version_dict = {}
+    self.__size = 0
+    self.__lock = threading.Lock()
+
+  def version(self, table) -> int:
+    return self.__version_dict.get(table, 0)
+
+  def get(self, table, key):
+    entry = self.__table_dict.get(table, {}).get(key)
+    if entry is None or entry[0] < time.monotonic():
+      return None
+    return entry[1]
+
+  def put(self, table, key, total, version):
+    with self.__lock:
+      if self.__version_dict.get(table, 0) != version:
+        return
+      if self.__size >= self.__max_size:
+        self.__table_dict.clear()
+        self.__size = 0
+      entry_dict = self.__table_dict.setdefault(table, {})
+      if key not in entry_dict:
+        self.__size += 1
+      entry_dict[key] = (time.monotonic() + self.ttl, total)
+
+  def invalidate(self, table):
+    with self.__lock:
+      self.__version_dict[table] = self.__version_dict.get(table, 0) + 1
+      self.__size -= len(self.__table_dict.pop(table, {}))
+
+  def clear(self):
+    with self.__lock:
+      self.__table_dict.clear()
+      self.__size = 0
+
+
+count_cache = _CountCache()
+
+
+def _invalidate_count(table_name, datasource_list):
+  """
+  写入之后清空表的 count 缓存, 在事务里时提交之后再清空一次,
+  提交之前并发执行的统计读到的是提交前的总数, 不能留在缓存里
+  """
+  count_cache.invalidate(table_name)
+  for ds in datasource_list:
+    ds.on_commit(("count", table_name), lambda: count_cache.invalidate(table_name))
+
+
+async def _execute_targets(target_list, execute_on, sql, param_list) -> int:
+  """
+  在每个数据源上执行写入语句, 返回影响的总行数
+  只有一个数据源时直接执行, 多个分片用 gather 同时执行, 子任务的上下文是复制的,
+  写入时间要记在调用方的上下文里, 之后的读才会走主库 (read_after_write)
+  """
+  if len(target_list) == 1:
+    return await execute_on(target_list[0], sql, param_list)
+  for ds in target_list:
+    ds.mark_write()
+  affected_list = await asyncio.gather(*[execute_on(ds, sql, param_list) for ds in target_list])
+  return sum(affected_list)
+
+
+def _estimated_rows(description, data) -> int:
+  """COUNT_ESTIMATED 的查询结果换算成行数, EXPLAIN 的结果按 rows * filtered% 估算"""
+  if data is None:
+    return 0
+  name_list = [d[0].lower() for d in description]
+  if "rows" not in name_list:
+    return int(data[0] or 0)
+  rows = data[name_list.index("rows")] or 0
+  filtered = data[name_list.index("filtered")] if "filtered" in name_list else None
+  if filtered is None:
+    return int(rows)
+  return int(rows * float(filtered) / 100)
 
 class MySqlQuery(SqlWhereBuilder):
 
   __slots__ = (
-    "__pool", "__table_name", "__all_select_str",
+    "__datasource", "__table_name", "__all_select_str",
     "__select_str", "__order_str", "__select_field_list",
-    "__entity"
+    "__entity", "__acquire_kw", "__shard",
+    "__order_field", "__order_desc", "__sort_index", "__hidden_count"
   )
-  def __init__(self, table_name,all_fields_str,pool,entity):
+  def __init__(self, table_name,all_fields_str,datasource,entity,acquire_kw=None,shard=None):
     super().__init__()
-    self.__pool:Pool = pool
+    self.__datasource: DataSource = datasource
+    self.__acquire_kw = dict(acquire_kw or {})
     self.__table_name = table_name
     self.__all_select_str = all_fields_str
     self.__select_str = None
     self.__order_str = None
     self.__select_field_list = None
     self.__entity: VoBase = entity
+    self.__shard: ShardRouter = shard
+    self.__order_field = None
+    self.__order_desc = False
+    # 分片合并排序用的列位置, 和为了排序额外查询的列数
+    self.__sort_index = None
+    self.__hidden_count = 0
+
+  def priority(self, priority):
+    """获取连接的优先级, 值越小越先拿到连接, 默认用repo的优先级"""
+    self.__acquire_kw["priority"] = priority
+    return self
+
+  def partition(self, name):
+    """使用连接池的哪个分区, 默认用repo的分区"""
+    self.__acquire_kw["partition"] = name
+    return self
+
+  def use_primary(self):
+    """查询走主库, 不走从库"""
+    self.__acquire_kw["primary"] = True
+    return self
 
 
   # 联表查询 结果映射  # def left_join(self,sql):  #   pass
@@ -131,6 +409,8 @@ class MySqlQuery(SqlWhereBuilder):
   def order(self,field):
     """正序"""
     self.__order_str = f"ORDER BY `{field}`"
+    self.__order_field = field
+    self.__order_desc = False
     return self
 
   def order_desc(self,field):
@@ -138,15 +418,26 @@ class MySqlQuery(SqlWhereBuilder):
     # todo 多条条件排序优化
     # args = [f"`{field}`" for field in args]
     self.__order_str = f"ORDER BY `{field}` DESC, id DESC"
+    self.__order_field = field
+    self.__order_desc = True
     return self
 
-  def __build_sql(self):
+  def _build_sql(self, scatter=False):
+    """
+    :param scatter: 分片查询, 需要在各分片结果合并时排序, 排序字段没有被选择的时候额外查询出来
+    """
     sql = []
     if self.__select_str is not None:
-      sql.append(f"SELECT {self.__select_str}")
+      select_str = self.__select_str
     else:
-      sql.append(f"SELECT {self.__all_select_str}")
+      select_str = self.__all_select_str
       self.__select_field_list = self.__entity.__field_list__
+    if scatter is True and self.__order_field is not None:
+      sort_field_list = [self.__order_field]
+      if self.__order_desc is True:
+        sort_field_list.append("id")
+      select_str = self.__add_sort_columns(select_str, sort_field_list)
+    sql.append(f"SELECT {select_str}")
     sql.append(f"FROM {self.__table_name}")
     where_str = self._build_where()
     if where_str.strip() != "":
@@ -155,8 +446,190 @@ class MySqlQuery(SqlWhereBuilder):
       sql.append(self.__order_str)
     return sql
 
-  def __build_count_sql(self):
-    # todo 只构建一次 where 字符串
+  def __add_sort_columns(self, select_str, sort_field_list):
+    name_list = [field.name for field in self.__select_field_list]
+    hidden_list = [name for name in sort_field_list if name not in name_list]
+    name_list.extend(hidden_list)
+    self.__sort_index = [name_list.index(name) for name in sort_field_list]
+    self.__hidden_count = len(hidden_list)
+    if len(hidden_list) == 0:
+      return select_str
+    return select_str + "," + ",".join(hidden_list)
+
+  def _statement(self, kind, scatter=False):
+    """
+    缓存的 sql, 结构相同的查询只在第一次拼接 sql
+    :param kind: list 查询, count 统计, page 分页 (limit 用参数, 见 _page_params),
+      ("after", 条件形式) get_page_after 翻页, 见 _after_params,
+      page_id 延迟关联分页只查 id, ("rows", id 个数) 按 id 查这一页的数据, estimate 估算行数,
+      ("window", page 或 page_id) 最后加一列 COUNT(*) OVER() 总数
+    """
+    key = (kind, scatter, self.__table_name, self.__all_select_str, self.__select_str,
+           self.__order_str, self._where_shape())
+    statement = statement_cache.get(key)
+    if statement is None:
+      statement = self.__compile(kind, scatter)
+      statement_cache.put(key, statement)
+    sql, self.__sort_index, self.__hidden_count = statement
+    if self.__select_str is None:
+      self.__select_field_list = self.__entity.__field_list__
+    return sql
+
+  def __compile(self, kind, scatter):
+    self.__sort_index = None
+    self.__hidden_count = 0
+    if kind == "count":
+      return self._build_count_sql(), None, 0
+    if kind == "estimate":
+      if self._build_where().strip() != "":
+        return "EXPLAIN " + self._build_count_sql(), None, 0
+      return ("SELECT TABLE_ROWS FROM information_schema.TABLES\n"
+              "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"), None, 0
+    if kind == "page_id":
+      return self.__compile_page_id(scatter), self.__sort_index, 0
+    if isinstance(kind, tuple):
+      if kind[0] == "window":
+        sql, sort_index, hidden_count = self.__compile(kind[1], scatter)
+        # 第一行是 SELECT 的列, 总数放在最后一列, 由 _page_result 取出
+        select_line, rest = sql.split("\n", 1)
+        return f"{select_line},COUNT(*) OVER()\n{rest}", sort_index, hidden_count
+      if kind[0] == "rows":
+        return self.__compile_rows(kind[1]), self.__sort_index, self.__hidden_count
+      return self.__compile_after(kind[1]), self.__sort_index, self.__hidden_count
+    sql = self._build_sql(scatter)
+    if kind == "page":
+      sql.append("limit %s" if scatter is True else "limit %s,%s")
+    return "\n".join(sql), self.__sort_index, self.__hidden_count
+
+  def __compile_page_id(self, scatter):
+    """延迟关联分页的第一步, 只查 id (分片查询时加上排序字段), 排序和翻页可以只走索引"""
+    name_list = ["id"]
+    if scatter is True and self.__order_field is not None:
+      sort_field_list = [self.__order_field]
+      if self.__order_desc is True:
+        sort_field_list.append("id")
+      name_list.extend(name for name in sort_field_list if name not in name_list)
+      self.__sort_index = [name_list.index(name) for name in sort_field_list]
+    sql = [f"SELECT {','.join(name_list)}", f"FROM {self.__table_name}"]
+    where_str = self._build_where()
+    if where_str.strip() != "":
+      sql.append(f"WHERE {where_str}")
+    if self.__order_str is not None:
+      sql.append(self.__order_str)
+    sql.append("limit %s" if scatter is True else "limit %s,%s")
+    return "\n".join(sql)
+
+  def __compile_rows(self, id_count):
+    """延迟关联分页的第二步, 按 id 查整行, id 没有被选择的时候额外查询出来, 用来恢复顺序"""
+    if self.__select_str is not None:
+      select_str = self.__select_str
+    else:
+      select_str = self.__all_select_str
+      self.__select_field_list = self.__entity.__field_list__
+    select_str = self.__add_sort_columns(select_str, ["id"])
+    return "\n".join([f"SELECT {select_str}", f"FROM {self.__table_name}",
+                      f"WHERE id in ({get_values_placeholder(id_count)})"])
+
+  def _deferred_ids(self, result_list, index: int, size: int):
+    """
+    合并延迟关联分页第一步各分片的 (id 数据, 总数)
+    :return: (这一页的 id 列表, {分片序号: 这个分片上的 id 列表}, 总数)
+    """
+    if len(result_list) == 1:
+      r, total = result_list[0]
+    else:
+      r, total = self._merge_page(result_list, index, size)
+    id_list = [data[0] for data in r]
+    owner_dict = {}
+    for target_index, (data_list, _) in enumerate(result_list):
+      for data in data_list:
+        owner_dict[data[0]] = target_index
+    id_group = {}
+    for id_ in id_list:
+      id_group.setdefault(owner_dict[id_], []).append(id_)
+    return id_list, id_group, total
+
+  def _deferred_rows(self, data_list_list, id_list):
+    """按第一步的 id 顺序排列第二步查出的整行, 两步之间被删除的行跳过"""
+    id_index = self.__sort_index[0]
+    data_dict = {data[id_index]: data for data_list in data_list_list for data in data_list}
+    return self.__strip_hidden([data_dict[id_] for id_ in id_list if id_ in data_dict])
+
+  def __keyset_fields(self):
+    """get_page_after 的排序字段, 排序字段加上 id 保证顺序唯一"""
+    if self.__order_field is None or self.__order_field == "id":
+      return ["id"]
+    return [self.__order_field, "id"]
+
+  def __compile_after(self, form):
+    """
+    get_page_after 的 sql, 排序字段和 id 没有被选择的时候额外查询出来, 用来生成下一页的游标
+    :param form: None 第一页, "value" "null" 上一页最后一条的排序字段有值或者是 NULL
+    """
+    if self.__select_str is not None:
+      select_str = self.__select_str
+    else:
+      select_str = self.__all_select_str
+      self.__select_field_list = self.__entity.__field_list__
+    sort_field_list = self.__keyset_fields()
+    select_str = self.__add_sort_columns(select_str, sort_field_list)
+    sql = [f"SELECT {select_str}", f"FROM {self.__table_name}"]
+    where_list = []
+    where_str = self._build_where()
+    if where_str.strip() != "":
+      where_list.append(f"({where_str})")
+    column_list = [f"`{name}`" for name in sort_field_list]
+    if form is not None:
+      where_list.append(_keyset_condition(column_list, self.__order_desc, form == "null"))
+    if len(where_list) > 0:
+      sql.append(f"WHERE {' AND '.join(where_list)}")
+    direction = " DESC" if self.__order_desc is True else ""
+    sql.append("ORDER BY " + ", ".join(f"{column}{direction}" for column in column_list))
+    sql.append("limit %s")
+    return "\n".join(sql)
+
+  def _after_params(self, cursor, size: int):
+    """get_page_after 的 (语句类型, 参数), 多查一条判断是否还有下一页"""
+    if cursor is None:
+      return ("after", None), self._where_param_list + [size + 1]
+    value_list = _decode_page_cursor(cursor, self.__keyset_fields(), self.__order_desc)
+    form = "null" if len(value_list) > 1 and value_list[0] is None else "value"
+    return ("after", form), self._where_param_list + _keyset_params(value_list) + [size + 1]
+
+  def _merge_after(self, data_list_list, size: int):
+    """合并 get_page_after 各分片的结果, 返回 (这一页的数据, 下一页的游标), 没有下一页时游标是 None"""
+    merged = self.__merge_sorted(data_list_list)
+    next_cursor = None
+    if len(merged) > size:
+      merged = merged[:size]
+      last = merged[-1]
+      next_cursor = _encode_page_cursor(self.__keyset_fields(), self.__order_desc,
+                                        [last[i] for i in self.__sort_index])
+    return self.__strip_hidden(merged), next_cursor
+
+  def _estimate_params(self):
+    if self._build_where().strip() != "":
+      return self._where_param_list
+    return [self.__table_name]
+
+  def _count_cache_get(self):
+    """
+    COUNT_CACHED 的缓存
+    :return: (缓存的总数, 没有时是 None; 写回缓存用的 (键, 版本), 条件参数不能做键时是 None)
+    """
+    key = (self._where_shape(), tuple(self._where_param_list),
+           tuple(ds.name for ds in self._target_list()))
+    try:
+      hash(key)
+    except TypeError:
+      return None, None
+    return count_cache.get(self.__table_name, key), (key, count_cache.version(self.__table_name))
+
+  def _count_cache_put(self, slot, total):
+    if slot is not None:
+      count_cache.put(self.__table_name, slot[0], total, slot[1])
+
+  def _build_count_sql(self):
     sql = [
       f"SELECT  count(*)",
       f"FROM {self.__table_name}"
@@ -167,9 +640,71 @@ class MySqlQuery(SqlWhereBuilder):
     sql = "\n".join(sql)
     return sql
 
+  def _target_list(self) -> list[DataSource]:
+    """查询要访问的数据源, 分片表根据分片键条件路由, 没有分片键条件就访问所有分片"""
+    if self.__shard is None:
+      return [self.__datasource]
+    return self.__shard.route(self._where_values(self.__shard.shard_key))
+
+  def _merge(self, data_list_list):
+    """合并多个分片的结果, 有排序时按排序归并, 并去掉为了排序额外查询的列"""
+    return self.__strip_hidden(self.__merge_sorted(data_list_list))
+
+  def __merge_sorted(self, data_list_list):
+    if len(data_list_list) == 1:
+      return list(data_list_list[0])
+    sort_index = self.__sort_index
+    if sort_index is None:
+      return list(itertools.chain.from_iterable(data_list_list))
+    def sort_key(data):
+      # mysql 里 NULL 最小
+      return [(data[i] is not None, data[i]) for i in sort_index]
+    return list(heapq.merge(*data_list_list, key=sort_key, reverse=self.__order_desc))
+
+  def __strip_hidden(self, data_list):
+    hidden_count = self.__hidden_count
+    if hidden_count > 0:
+      return [data[:-hidden_count] for data in data_list]
+    return data_list
+
+  def _merge_first(self, r_list):
+    """合并多个分片的第一条"""
+    r_list = self._merge([[r] for r in r_list if r is not None])
+    return r_list[0] if len(r_list) > 0 else None
+
+  def _page_params(self, index: int, size: int, scatter=False):
+    """
+    分页 sql 的参数, 分片查询时每个分片取前 index*size 条, 归并之后由 _merge_page 截取这一页
+    """
+    if scatter is True:
+      return self._where_param_list + [size*index]
+    # todo 分页优化
+    return self._where_param_list + [size*(index-1), size]
+
+  def _page_kind(self, kind, mode):
+    """分页 sql 的语句类型, PAGE_WINDOW 模式加上总数列"""
+    if mode == PAGE_WINDOW:
+      return "window", kind
+    if mode not in (PAGE_SEQUENTIAL, PAGE_MULTI_STATEMENT, PAGE_CONCURRENT):
+      raise SqlError(f"page mode '{mode}' not support")
+    return kind
+
+  @staticmethod
+  def _page_result(r):
+    """PAGE_WINDOW 模式查询结果去掉最后的总数列, 返回 (数据, 总数), 没有数据时总数是 None"""
+    if len(r) == 0:
+      return [],None
+    return [data[:-1] for data in r],r[0][-1]
+
+  def _merge_page(self, result_list, index: int, size: int):
+    """合并多个分片的 (数据, 总数)"""
+    total = sum(t for _, t in result_list)
+    r = self._merge([r for r, _ in result_list])[size*(index-1):size*index]
+    return r,total
+
 
   # 创建输出对象
-  def __create_out_obj(self, data, out_type):
+  def _create_out_obj(self, data, out_type):
     out = out_type()
     for index, field in enumerate(self.__select_field_list):
       val = data[index]
@@ -177,7 +712,7 @@ class MySqlQuery(SqlWhereBuilder):
       object.__setattr__(out,field.name,val)
     return out
 
-  def __create_out_dict(self, data):
+  def _create_out_dict(self, data):
     out = dict()
     for index, field in enumerate(self.__select_field_list):
       val = data[index]
@@ -185,27 +720,48 @@ class MySqlQuery(SqlWhereBuilder):
       out[field.name] = val
     return out
 
+  async def __fetch(self, datasource: DataSource, sql, fetch_one=False, param_list=None):
+    async with datasource.acquire_read(**self.__acquire_kw) as conn:
+      async with conn.cursor() as cur:
+        await cur.execute(sql, self._where_param_list if param_list is None else param_list)
+        if fetch_one is True:
+          return await cur.fetchone()
+        return await cur.fetchall()
+
+  @staticmethod
+  async def __fetch_on(pool, acquire_kw, sql, param_list, fetch_one=False):
+    async with pool.acquire(**acquire_kw) as conn:
+      async with conn.cursor() as cur:
+        await cur.execute(sql, param_list)
+        if fetch_one is True:
+          return await cur.fetchone()
+        return await cur.fetchall()
+
   async def __get_first(self):
     orange_sql_log.debug.print_split()
-    sql = self.__build_sql()
-    sql = "\n".join(sql)
-    async with self.__pool.acquire() as conn:
-      async with conn.cursor() as cur:
-        await cur.execute(sql, self._where_param_list)
-        r = await cur.fetchone()
-        orange_sql_log.debug(r)
-        return r
+    target_list = self._target_list()
+    if len(target_list) == 1:
+      sql = self._statement("list")
+      r = await self.__fetch(target_list[0], sql, True)
+    else:
+      sql = self._statement("list", True)
+      r_list = await asyncio.gather(*[self.__fetch(ds, sql, True) for ds in target_list])
+      r = self._merge_first(r_list)
+    orange_sql_log.debug(r)
+    return r
 
   async def __get_list(self):
     orange_sql_log.debug.print_split()
-    sql = self.__build_sql()
-    sql = "\n".join(sql)
-    async with self.__pool.acquire() as conn:
-      async with conn.cursor() as cur:
-        await cur.execute(sql, self._where_param_list)
-        r = await cur.fetchall()
-        orange_sql_log.debug.list(r)
-        return r
+    target_list = self._target_list()
+    if len(target_list) == 1:
+      sql = self._statement("list")
+      r = await self.__fetch(target_list[0], sql)
+    else:
+      sql = self._statement("list", True)
+      r_list = await asyncio.gather(*[self.__fetch(ds, sql) for ds in target_list])
+      r = self._merge(r_list)
+    orange_sql_log.debug.list(r)
+    return r
 
   def __select_from_dto(self,dto_type):
     out_fields = dto_type.__field_name_list__
@@ -214,7 +770,7 @@ class MySqlQuery(SqlWhereBuilder):
                   if field in self.__entity.__field_name_list__]
     self.select(*out_fields)
 
-  def __handler_out_type(self,out_type):
+  def _handler_out_type(self,out_type):
     if out_type is None:
       out_type = self.__entity
     elif issubclass(out_type, VoBase):
@@ -222,84 +778,290 @@ class MySqlQuery(SqlWhereBuilder):
     return out_type
 
   async def get_first(self,out_type=None):
-    out_type = self.__handler_out_type(out_type)
+    out_type = self._handler_out_type(out_type)
     data = await self.__get_first()
     if data is None: return
     elif out_type == tuple:
       return data
     elif out_type == dict:
-      return self.__create_out_dict(data)
+      return self._create_out_dict(data)
     else:
-      return self.__create_out_obj(data,out_type)
+      return self._create_out_obj(data,out_type)
 
-  def __out__list(self,data_list,out_type):
+  def _out_list(self,data_list,out_type):
     if out_type == tuple:
       return data_list
     elif out_type == dict:
-      return [self.__create_out_dict(data) for data in data_list]
+      return [self._create_out_dict(data) for data in data_list]
     else:
-      return [self.__create_out_obj(data, out_type) for data in data_list]
+      return [self._create_out_obj(data, out_type) for data in data_list]
 
   async def get_list(self,out_type=None):
-    out_type = self.__handler_out_type(out_type)
+    out_type = self._handler_out_type(out_type)
     data_list = await self.__get_list()
-    return self.__out__list(data_list,out_type)
-
-  async def count(self):
-    # orange_sql_log.debug.print_split()
-    count_sql = self.__build_count_sql()
-    async with self.__pool.acquire() as conn:
+    return self._out_list(data_list,out_type)
+
+  def _stream_pick(self, head_list):
+    """多个分片的流按排序归并, head_list 是每个分片当前的第一行, 返回下一行所在的位置"""
+    sort_index = self.__sort_index
+    if sort_index is None:
+      return 0
+    def sort_key(i):
+      # mysql 里 NULL 最小
+      return [(head_list[i][j] is not None, head_list[i][j]) for j in sort_index]
+    return (max if self.__order_desc is True else min)(range(len(head_list)), key=sort_key)
+
+  def _stream_out(self, data_list, out_type):
+    """流式查询的一批数据, 去掉为了排序额外查询的列, 转换成输出类型"""
+    return self._out_list(self.__strip_hidden(data_list), out_type)
+
+  @staticmethod
+  async def __next_batch(stream):
+    try:
+      return await stream.__anext__()
+    except StopAsyncIteration:
+      return None
+
+  async def __stream_on(self, datasource: DataSource, sql, batch_size):
+    async with datasource.acquire_read(**self.__acquire_kw) as conn:
+      cur = await conn.cursor(SSCursor)
+      finished = False
+      try:
+        await cur.execute(sql, self._where_param_list)
+        while True:
+          data_list = await cur.fetchmany(batch_size)
+          if len(data_list) == 0:
+            break
+          yield data_list
+        finished = True
+      finally:
+        if finished is True:
+          await cur.close()
+        else:
+          # 提前结束时断开连接, 不用读完剩下的数据, 连接池会丢掉断开的连接
+          conn.close()
+
+  async def __stream_merge(self, stream_list, batch_size):
+    """按排序归并多个分片的流, 每个分片只缓存一批"""
+    buffer_list = []
+    for stream in stream_list:
+      data_list = await self.__next_batch(stream)
+      if data_list is not None:
+        buffer_list.append([data_list, 0, stream])
+    out = []
+    while len(buffer_list) > 0:
+      index = self._stream_pick([data_list[pos] for data_list, pos, _ in buffer_list])
+      buffer = buffer_list[index]
+      out.append(buffer[0][buffer[1]])
+      buffer[1] += 1
+      if buffer[1] == len(buffer[0]):
+        data_list = await self.__next_batch(buffer[2])
+        if data_list is None:
+          buffer_list.pop(index)
+        else:
+          buffer[0], buffer[1] = data_list, 0
+      if len(out) == batch_size:
+        yield out
+        out = []
+    if len(out) > 0:
+      yield out
+
+  async def stream(self, out_type=None, batch_size=1000):
+    """
+    流式查询, 用非缓冲游标每次从连接读取 batch_size 行转换后返回, 内存只和 batch_size 有关, 适合导出大表
+      async with contextlib.aclosing(repo.query().stream(batch_size=500)) as stream:
+        async for user in stream:
+          ...
+    遍历期间一直占用连接, 遍历结束释放, 提前 break 时用 aclosing 及时释放连接
+    分片表同时读取所有分片, 有排序时按排序归并
+    不能在事务里使用, 遍历期间事务的连接被占用, 循环里用这个事务执行的语句会一直等待
+    """
+    out_type = self._handler_out_type(out_type)
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    for ds in target_list:
+      if ds.pinned_conn() is not None:
+        raise SqlError("stream can not run in a transaction")
+    if len(target_list) == 1:
+      stream_list = [self.__stream_on(target_list[0], self._statement("list"), batch_size)]
+      data_stream = stream_list[0]
+    else:
+      sql = self._statement("list", True)
+      stream_list = [self.__stream_on(ds, sql, batch_size) for ds in target_list]
+      data_stream = self.__stream_merge(stream_list, batch_size)
+    try:
+      async for data_list in data_stream:
+        for out in self._stream_out(data_list, out_type):
+          yield out
+    finally:
+      await data_stream.aclose()
+      for s in stream_list:
+        await s.aclose()
+
+  async def __estimate_on(self, datasource: DataSource, sql, param_list):
+    async with datasource.acquire_read(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
-        await cur.execute(count_sql, self._where_param_list)
-        r = await cur.fetchone()
-        orange_sql_log.debug(r)
-        return r[0]
+        await cur.execute(sql, param_list)
+        return _estimated_rows(cur.description, await cur.fetchone())
 
-  async def __page(self, index:int, size: int):
-    orange_sql_log.debug.print_split()
-    count_sql = self.__build_count_sql()
-    async with self.__pool.acquire() as conn:
+  async def count(self, strategy=COUNT_EXACT):
+    """
+    :param strategy: COUNT_EXACT 精确统计, COUNT_ESTIMATED 估算, COUNT_CACHED 缓存精确统计的结果
+    """
+    # orange_sql_log.debug.print_split()
+    if strategy == COUNT_ESTIMATED:
+      sql = self._statement("estimate")
+      r_list = await asyncio.gather(
+        *[self.__estimate_on(ds, sql, self._estimate_params()) for ds in self._target_list()])
+      orange_sql_log.debug(r_list)
+      return sum(r_list)
+    slot = None
+    if strategy == COUNT_CACHED:
+      total, slot = self._count_cache_get()
+      if total is not None:
+        return total
+    elif strategy != COUNT_EXACT:
+      raise SqlError(f"count strategy '{strategy}' not support")
+    count_sql = self._statement("count")
+    r_list = await asyncio.gather(
+      *[self.__fetch(ds, count_sql, True) for ds in self._target_list()])
+    orange_sql_log.debug(r_list)
+    total = sum(r[0] for r in r_list)
+    self._count_cache_put(slot, total)
+    return total
+
+  async def __page_on(self, datasource: DataSource, sql, count_sql, param_list, mode=PAGE_SEQUENTIAL):
+    if count_sql is None:
+      # 总数已经按 count_strategy 得到
+      return await self.__fetch(datasource, sql, False, param_list),0
+    if mode == PAGE_CONCURRENT and datasource.pinned_conn() is None:
+      # 两个连接从同一个库获取, 总数和数据是同一个复制位置的
+      acquire_kw = dict(self.__acquire_kw)
+      pool = datasource.read_pool(acquire_kw.pop("primary", False))
+      count_r,r = await asyncio.gather(self.__fetch_on(pool, acquire_kw, count_sql, self._where_param_list, True),
+                                       self.__fetch_on(pool, acquire_kw, sql, param_list))
+      orange_sql_log.debug("total", count_r[0])
+      return r,count_r[0]
+    async with datasource.acquire_read(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
+        if mode == PAGE_WINDOW:
+          await cur.execute(sql, param_list)
+          r,total = self._page_result(await cur.fetchall())
+          if total is None:
+            # 这一页没有数据时不知道总数, 再查一次
+            await cur.execute(count_sql, self._where_param_list)
+            total = (await cur.fetchone())[0]
+          orange_sql_log.debug("total", total)
+          return r,total
+        elif mode == PAGE_MULTI_STATEMENT:
+          await cur.execute(f"{count_sql};\n{sql}", self._where_param_list + param_list)
+          total = (await cur.fetchone())[0]
+          await cur.nextset()
+          r = await cur.fetchall()
+          orange_sql_log.debug("total", total)
+          return r,total
         await cur.execute(count_sql, self._where_param_list)
         r = await cur.fetchone()
         total = r[0]
         orange_sql_log.debug("total", total)
         if total == 0:
           return [],0
-        # todo 分页优化
         orange_sql_log.debug.print_split()
-        sql = self.__build_sql()
-        sql.append(f"limit {size*(index-1)},{size}")
-        # sql.append("limit 1 10")
-        sql = "\n".join(sql)
-        await cur.execute(sql, self._where_param_list)
+        await cur.execute(sql, param_list)
         r = await cur.fetchall()
-        orange_sql_log.debug.print_split()
-        orange_sql_log.debug.list(r)
         return r,total
 
-  async def get_page(self, index:int, size:int, out_type=None):
-    """分页查询"""
-    out_type = self.__handler_out_type(out_type)
-    raw_list,total = await self.__page(index,size)
-    if total != 0:
-      out_list = self.__out__list(raw_list, out_type)
+  async def __page(self, index:int, size: int, mode, count_sql):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    kind = self._page_kind("page", mode)
+    if len(target_list) == 1:
+      sql = self._statement(kind)
+      r,total = await self.__page_on(target_list[0], sql, count_sql, self._page_params(index, size), mode)
+    else:
+      sql = self._statement(kind, True)
+      param_list = self._page_params(index, size, True)
+      result_list = await asyncio.gather(
+        *[self.__page_on(ds, sql, count_sql, param_list, mode) for ds in target_list])
+      r,total = self._merge_page(result_list, index, size)
+    orange_sql_log.debug.print_split()
+    orange_sql_log.debug.list(r)
+    return r,total
+
+  async def __deferred_page(self, index: int, size: int, mode, count_sql):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    scatter = len(target_list) > 1
+    sql = self._statement(self._page_kind("page_id", mode), scatter)
+    param_list = self._page_params(index, size, scatter)
+    result_list = await asyncio.gather(
+      *[self.__page_on(ds, sql, count_sql, param_list, mode) for ds in target_list])
+    id_list, id_group, total = self._deferred_ids(result_list, index, size)
+    if len(id_list) == 0:
+      return [],total
+    orange_sql_log.debug.print_split()
+    fetch_list = [self.__fetch(target_list[target_index], self._statement(("rows", len(ids))), False, ids)
+                  for target_index, ids in id_group.items()]
+    r = self._deferred_rows(await asyncio.gather(*fetch_list), id_list)
+    orange_sql_log.debug.list(r)
+    return r,total
+
+  async def get_page(self, index:int, size:int, out_type=None, deferred=False, mode=PAGE_SEQUENTIAL,
+                     count_strategy=COUNT_EXACT):
+    """
+    分页查询
+    :param deferred: 延迟关联, 先按排序和翻页只查出这一页的 id, 再按 id 查整行,
+      排序字段有索引时翻到很后面的页也不用读取前面的整行, 适合需要随机跳页的深分页
+    :param mode: 统计总数和查询这一页的方式 PAGE_SEQUENTIAL PAGE_MULTI_STATEMENT PAGE_WINDOW PAGE_CONCURRENT
+    :param count_strategy: 总数的统计方式, 同 count, 不是 COUNT_EXACT 时先取总数再查询这一页, mode 不起作用
+    """
+    out_type = self._handler_out_type(out_type)
+    if count_strategy == COUNT_EXACT:
+      count_sql, known_total = self._statement("count"), None
+    else:
+      count_sql, known_total, mode = None, await self.count(count_strategy), PAGE_SEQUENTIAL
+    if deferred is True:
+      raw_list,total = await self.__deferred_page(index,size,mode,count_sql)
+    else:
+      raw_list,total = await self.__page(index,size,mode,count_sql)
+    if known_total is not None:
+      # 估算的总数可能是 0, 这一页的数据照样返回
+      total = known_total
+    if total != 0 or len(raw_list) > 0:
+      out_list = self._out_list(raw_list, out_type)
       return out_list,total
     else:
       return [],0
 
-  def get_page_sync(self):
-    pass
+  async def get_page_after(self, cursor, size: int, out_type=None):
+    """
+    按游标翻页, 用当前的 order / order_desc 字段加上 id 定位, 不管翻到第几页都和第一页一样快
+      out_list, cursor = await query.order_desc("ct").get_page_after(None, 20)
+      out_list, cursor = await query.order_desc("ct").get_page_after(cursor, 20)
+    :param cursor: 上一页返回的游标, 第一页传 None, 游标要用在排序相同的查询上
+    :return: (这一页的数据, 下一页的游标), 没有下一页时游标是 None
+    """
+    out_type = self._handler_out_type(out_type)
+    orange_sql_log.debug.print_split()
+    kind, param_list = self._after_params(cursor, size)
+    sql = self._statement(kind)
+    r_list = await asyncio.gather(
+      *[self.__fetch(ds, sql, False, param_list) for ds in self._target_list()])
+    r, next_cursor = self._merge_after(r_list, size)
+    orange_sql_log.debug.list(r)
+    return self._out_list(r, out_type), next_cursor
 
 class MysqlUpdate(SqlWhereBuilder):
 
-  __slots__ = ("__pool","__table_name","__entity",
+  __slots__ = ("__datasource","__table_name","__entity",
                "__update_sql_list","__update_param_list",
-               "__fill_time","__field_dict")
+               "__fill_time","__field_dict","__acquire_kw","__shard")
 
-  def __init__(self, table_name, pool, entity, fill_time):
+  def __init__(self, table_name, datasource, entity, fill_time, acquire_kw=None, shard=None):
     super().__init__()
-    self.__pool: Pool = pool
+    self.__datasource: DataSource = datasource
+    self.__shard: ShardRouter = shard
+    self.__acquire_kw = dict(acquire_kw or {})
     self.__table_name = table_name
     self.__entity: VoBase = entity
     self.__field_dict:dict[str,SqlField] = entity.__field_dict__
@@ -308,6 +1070,16 @@ class MysqlUpdate(SqlWhereBuilder):
     self.__update_sql_list = []
     self.__update_param_list = []
 
+  def priority(self, priority):
+    """获取连接的优先级, 值越小越先拿到连接"""
+    self.__acquire_kw["priority"] = priority
+    return self
+
+  def partition(self, name):
+    """使用连接池的哪个分区"""
+    self.__acquire_kw["partition"] = name
+    return self
+
   def set(self,field,value,enable=True):
     """
     UPDATE `test_song` SET `title` = ?p_0, `singer` = ?p_1, `ct` = now(3)
@@ -333,7 +1105,7 @@ class MysqlUpdate(SqlWhereBuilder):
   def app_params(self,*args):
     self.__update_param_list.extend(args)
 
-  def __build_sql_str(self):
+  def _build_sql_str(self):
 
     if self.__fill_time is True:
       self.set("ut",datetime.datetime.now())
@@ -354,34 +1126,223 @@ class MysqlUpdate(SqlWhereBuilder):
 
     return sql,param_list
 
+  async def __execute_on(self, datasource: DataSource, sql, param_list):
+    async with datasource.acquire_write(**self.__acquire_kw) as conn:
+      async with conn.cursor() as cur:
+        await cur.execute(sql, param_list)
+        return cur.rowcount
+
+  def _target_list(self) -> list[DataSource]:
+    if self.__shard is None:
+      return [self.__datasource]
+    # 有分片键条件只更新对应分片, 否则更新所有分片
+    return self.__shard.route(self._where_values(self.__shard.shard_key))
+
   async def execute(self)->int:
     orange_sql_log.debug.print_split()
-    sql,param_list = self.__build_sql_str()
-    async with self.__pool.acquire() as conn:
+    sql,param_list = self._build_sql_str()
+    affected_num = await _execute_targets(self._target_list(), self.__execute_on, sql, param_list)
+    self._invalidate_count()
+    orange_sql_log.debug("affected_num", affected_num)
+    return affected_num
+
+  def _invalidate_count(self):
+    """写入之后清空这个表的 count 缓存"""
+    _invalidate_count(self.__table_name, self._target_list())
+
+class MysqlDelete(SqlWhereBuilder):
+  """
+  删除, 条件写法同 MysqlUpdate, 没有 where 条件时不执行
+    await repo.delete().eq("id", 1).execute()
+  大范围删除用 chunked, 按主键范围分成小事务删除, 避免长时间锁住大范围的数据和从库延迟
+    await repo.delete().lt("ct", time).chunked(1000, pause=0.1, max_replica_lag=5)
+  """
+
+  __slots__ = ("__datasource","__table_name","__acquire_kw","__shard")
+
+  def __init__(self, table_name, datasource, acquire_kw=None, shard=None):
+    super().__init__()
+    self.__datasource: DataSource = datasource
+    self.__shard: ShardRouter = shard
+    self.__acquire_kw = dict(acquire_kw or {})
+    self.__table_name = table_name
+
+  def priority(self, priority):
+    """获取连接的优先级, 值越小越先拿到连接"""
+    self.__acquire_kw["priority"] = priority
+    return self
+
+  def partition(self, name):
+    """使用连接池的哪个分区"""
+    self.__acquire_kw["partition"] = name
+    return self
+
+  def __where_str(self):
+    where_str = self._build_where()
+    if where_str.strip() == "":
+      raise AttributeError("没有where条件 删除不安全")
+    return where_str
+
+  def _build_sql_str(self):
+    sql = f"DELETE FROM `{self.__table_name}`\nWHERE {self.__where_str()}"
+    return sql,list(self._where_param_list)
+
+  def _build_chunk_sql(self):
+    """
+    分批删除的 sql
+    :return: (第一批取 id, 之后每批从上一批最后的 id 往后取 id, 按 id 范围删除), 参数都是 where 参数加 id 范围和条数
+    """
+    where_str = f"({self.__where_str()})"
+    select = f"SELECT id FROM `{self.__table_name}`\nWHERE {where_str}"
+    return (f"{select}\nORDER BY id\nlimit %s",
+            f"{select} AND id > %s\nORDER BY id\nlimit %s",
+            f"DELETE FROM `{self.__table_name}`\nWHERE {where_str} AND id >= %s AND id <= %s")
+
+  def _target_list(self) -> list[DataSource]:
+    if self.__shard is None:
+      return [self.__datasource]
+    # 有分片键条件只删除对应分片, 否则删除所有分片
+    return self.__shard.route(self._where_values(self.__shard.shard_key))
+
+  def _invalidate_count(self):
+    _invalidate_count(self.__table_name, self._target_list())
+
+  def _chunk_params(self, last_id, batch_size):
+    """取下一批 id 的 sql 参数, last_id 是上一批最后的 id, 第一批是 None"""
+    if last_id is None:
+      return self._where_param_list + [batch_size]
+    return self._where_param_list + [last_id, batch_size]
+
+  async def __execute_on(self, datasource: DataSource, sql, param_list):
+    async with datasource.acquire_write(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
         await cur.execute(sql, param_list)
-        await conn.commit()
-        affected_num = cur.rowcount
-        orange_sql_log.debug("affected_num", affected_num)
-        return affected_num
+        return cur.rowcount
+
+  async def execute(self) -> int:
+    orange_sql_log.debug.print_split()
+    sql,param_list = self._build_sql_str()
+    affected_num = await _execute_targets(self._target_list(), self.__execute_on, sql, param_list)
+    self._invalidate_count()
+    orange_sql_log.debug("affected_num", affected_num)
+    return affected_num
+
+  async def __replica_lag(self, datasource: DataSource):
+    """从库中最大的复制延迟秒数, 没有从库或者取不到时返回 None"""
+    lag = None
+    for pool in datasource.replica_list:
+      async with pool.acquire(**self.__acquire_kw) as conn:
+        async with conn.cursor() as cur:
+          try:
+            await cur.execute("SHOW REPLICA STATUS")
+          except MySQLError as e:
+            # mysql 8.0.22 之前没有这个语法, 其他错误 (例如没有权限) 直接抛出
+            if e.args[0] != ER.PARSE_ERROR:
+              raise
+            await cur.execute("SHOW SLAVE STATUS")
+          data = await cur.fetchone()
+          if data is None: continue
+          name_list = [d[0] for d in cur.description]
+          for name in ("Seconds_Behind_Source", "Seconds_Behind_Master"):
+            if name in name_list and data[name_list.index(name)] is not None:
+              lag = max(lag or 0, data[name_list.index(name)])
+    return lag
+
+  async def __chunked_on(self, datasource: DataSource, chunk_sql, batch_size, pause, max_replica_lag,
+                         progress, deleted):
+    first_sql, next_sql, delete_sql = chunk_sql
+    last_id = None
+    while True:
+      if max_replica_lag is not None:
+        lag = await self.__replica_lag(datasource)
+        while lag is not None and lag > max_replica_lag:
+          orange_sql_log.debug("delete wait replica lag", lag)
+          await asyncio.sleep(max(pause, 1))
+          lag = await self.__replica_lag(datasource)
+      async with datasource.acquire_write(**self.__acquire_kw) as conn:
+        async with conn.cursor() as cur:
+          await cur.execute(first_sql if last_id is None else next_sql, self._chunk_params(last_id, batch_size))
+          id_list = [data[0] for data in await cur.fetchall()]
+          if len(id_list) == 0:
+            return deleted
+          # 每批一条语句, 自动提交, 只锁这一批的主键范围
+          await cur.execute(delete_sql, self._where_param_list + [id_list[0], id_list[-1]])
+          deleted += cur.rowcount
+      last_id = id_list[-1]
+      self._invalidate_count()
+      if progress is not None:
+        progress(deleted, last_id)
+      if len(id_list) < batch_size:
+        return deleted
+      if pause > 0:
+        await asyncio.sleep(pause)
+
+  async def chunked(self, batch_size=1000, pause=0.0, max_replica_lag=None, progress=None) -> int:
+    """
+    分批删除, 每批按条件取出主键最小的 batch_size 个 id, 再删除这个主键范围内满足条件的行, 每批一个小事务, 不能在事务里执行
+    :param pause: 每批之间暂停的秒数
+    :param max_replica_lag: 从库复制延迟超过这个秒数时暂停删除, 直到延迟降下来, 只检查数据源配置的从库
+    :param progress: 每批删除后调用 progress(已删除行数, 这一批最后的 id)
+    :return: 删除的行数
+    """
+    orange_sql_log.debug.print_split()
+    chunk_sql = self._build_chunk_sql()
+    target_list = self._target_list()
+    for ds in target_list:
+      if ds.pinned_conn() is not None:
+        # 事务里所有批次都在一个大事务里, 锁一直到提交才释放
+        raise SqlError("chunked delete can not run in a transaction")
+    deleted = 0
+    # 分片依次删除, 不同时给所有分片加压
+    for ds in target_list:
+      deleted = await self.__chunked_on(ds, chunk_sql, batch_size, pause, max_replica_lag, progress, deleted)
+    orange_sql_log.debug("affected_num", deleted)
+    return deleted
 
 class BaseRepo:
 
   _instance = None
+  # 查询和更新的类型, 取数据源的函数, 同步的 SyncBaseRepo 替换成同步的版本
+  _query_type = MySqlQuery
+  _update_type = MysqlUpdate
+  _delete_type = MysqlDelete
+  _resolve_datasource = staticmethod(get_datasource)
+
   def __new__(cls, *args, **kwargs):
     if cls._instance is None:
       cls._instance = super().__new__(cls)
     return cls._instance
 
   __slots__ = (
-    "__table_name","__pool",
+    "__table_name","__datasource_name",
     "__entity","__all_fields_str",
-    "__insert_sql","__field_list_no_id",
+    "__insert_sql","__field_list_no_id","__acquire_kw",
+    "__shard",
   )
 
-  def __init__(self, table_name,entity):
+  def __init__(self, table_name,entity,priority=PRIORITY_NORMAL,partition=None,
+               datasource=DEFAULT_DATASOURCE,shard_key=None,shard_func=None,shards=None):
+    """
+    :param priority: 该repo获取连接的优先级, 值越小越先拿到连接,
+      接口查询用 PRIORITY_HIGH, 报表一类的后台查询用 PRIORITY_LOW
+    :param partition: 该repo使用的连接池分区, 例如 "api" "batch" "report",
+      分区在 OrangeMySqlConfig.partitions 里定义
+    :param datasource: 使用的数据源名字, 使用时才去取数据源, 所以repo可以在数据库初始化之前创建
+    :param shard_key: 分片键字段名, 和 shard_func shards 一起设置后表按分片存储, datasource 不再使用
+    :param shard_func: 分片函数 值 -> 分片序号, 例如 HashShard(4) RangeShard([...])
+    :param shards: 按分片序号排列的数据源名字列表
+      分片键是 id 的时候, id 要在 insert 之前由应用生成
+    """
     self.__table_name = table_name
-    self.__pool = get_sql_pool()
+    self.__datasource_name = datasource
+    self.__acquire_kw = {"priority": priority, "partition": partition}
+    self.__shard = None
+    if shards is not None:
+      if shard_key is None or shard_func is None:
+        raise ValueError("shard_key and shard_func are required with shards")
+      if shard_key not in entity.__field_dict__:
+        raise ValueError(f"shard key '{shard_key}' not entity field")
+      self.__shard = ShardRouter(shard_key, shard_func, shards, self._resolve_datasource)
     self.__entity: VoBase = entity
     # 生成insert sql 语句
     self.__build_insert_sql()
@@ -391,44 +1352,333 @@ class BaseRepo:
     self.__all_fields_str = ','.join(self.__entity.__field_name_list__)
 
   def __build_insert_sql(self):
-    field_name_list = [i for i in self.__entity.__field_name_list__ if i != "id"]
+    # 按 id 分片时 id 由应用生成, 需要插入
+    with_id = self.__shard is not None and self.__shard.shard_key == "id"
+    field_name_list = [i for i in self.__entity.__field_name_list__ if i != "id" or with_id]
     placeholder = get_values_placeholder(field_name_list.__len__())
     # noinspection SqlNoDataSourceInspection
-    self.__insert_sql = f"insert into {self.__table_name} ({','.join(field_name_list)}) VALUES({placeholder})"
-    self.__field_list_no_id: list[SqlField] = [i for i in self.__entity.__field_list__ if i.name != "id"]
-
-  async def insert(self,obj,fill_time=True):
+    # VALUES 后面的空格让 executemany 能识别出来, 批量插入时合并成多行 VALUES
+    self.__insert_sql = f"insert into {self.__table_name} ({','.join(field_name_list)}) VALUES ({placeholder})"
+    self.__field_list_no_id: list[SqlField] = [i for i in self.__entity.__field_list__
+                                               if i.name != "id" or with_id]
+
+  def _get_datasource(self, obj=None):
+    """分片表根据对象 (或 dict) 的分片键选择分片"""
+    if self.__shard is None:
+      return self._resolve_datasource(self.__datasource_name)
+    if isinstance(obj, dict):
+      return self.__shard.get_datasource(obj.get(self.__shard.shard_key))
+    return self.__shard.get_datasource(getattr(obj, self.__shard.shard_key, None))
+
+  @staticmethod
+  def __insert_params(obj, field_list, fill_time, fill_ct=True):
+    now = None
     if fill_time is True:
       now = datetime.datetime.now()
       obj.ut = now
-      obj.ct = now
+      if fill_ct is True:
+        obj.ct = now
+    d_dict = obj.__dict__
+    d_list = []
+    for field in field_list:
+      if now is not None and fill_ct is False and field.name == "ct":
+        # 创建时间只用在插入的参数里, 不写回对象
+        d_list.append(now)
+        continue
+      d = d_dict.get(field.name,None)
+      # print(field.name,d,field.db_map_json)
+      if field.map_json is True:
+        d = json_dumps(d)
+      d_list.append(d)
+    return d_list
+
+  def _build_insert(self, obj, fill_time):
+    """返回 (数据源, insert sql, 参数列表)"""
+    d_list = self.__insert_params(obj, self.__field_list_no_id, fill_time)
+    return self._get_datasource(obj), self.__insert_sql, d_list
+
+  def _insert_need_id(self):
+    """插入后是否回填 id, 按 id 分片时 id 由应用生成"""
+    return self.__shard is None or self.__shard.shard_key != "id"
+
+  def _set_insert_id(self, obj, lastrowid):
+    if self._insert_need_id():
+      obj.id = lastrowid
+
+  def _build_insert_many(self, obj_list, fill_time, field_list=None, fill_ct=True):
+    """
+    批量插入的参数按数据源分组, 返回 [(数据源, 对象列表, 参数列表)]
+    :param field_list: 插入的字段, 默认同 insert
+    :param fill_ct: fill_time 时是否把创建时间写回对象
+    """
+    field_list = field_list or self.__field_list_no_id
+    group_dict = {}
+    for obj in obj_list:
+      d_list = self.__insert_params(obj, field_list, fill_time, fill_ct)
+      datasource = self._get_datasource(obj)
+      group = group_dict.get(datasource)
+      if group is None:
+        group = group_dict[datasource] = (datasource, [], [])
+      group[1].append(obj)
+      group[2].append(d_list)
+    return list(group_dict.values())
+
+  def _set_insert_id_many(self, obj_list, batch_results, increment):
+    """
+    按 executemany 每条多行 insert 的 (第一行 id, 行数) 回填 id,
+    一条多行 insert 的自增 id 按 auto_increment_increment 连续分配
+    """
+    if sum(rowcount for _, rowcount in batch_results) != len(obj_list):
+      raise SqlError(f"insert_many can not fill id, {len(obj_list)} rows sent "
+                     f"but batch results {batch_results}")
+    index = 0
+    for first_id, rowcount in batch_results:
+      for i in range(rowcount):
+        obj_list[index].id = first_id + i * increment
+        index += 1
+
+  def _build_upsert_sql(self, update_fields, conflict_key, row_alias, fill_time):
+    """返回 (upsert sql, 插入的字段列表, 冲突时更新的字段列表)"""
+    if isinstance(conflict_key, str):
+      conflict_key = [conflict_key]
+    conflict_key = list(conflict_key or [])
+    field_dict = self.__entity.__field_dict__
+    for name in conflict_key + list(update_fields or []):
+      if name not in field_dict:
+        raise SqlError(f"upsert field '{name}' not entity field")
+    field_list = list(self.__field_list_no_id)
+    if "id" in conflict_key and "id" not in [field.name for field in field_list]:
+      field_list.insert(0, field_dict["id"])
+    name_list = [field.name for field in field_list]
+    if update_fields is None:
+      # 冲突键和创建时间不更新
+      update_fields = [name for name in name_list if name not in conflict_key and name not in ("id", "ct")]
+    else:
+      update_fields = list(update_fields)
+      if fill_time is True and "ut" in name_list and "ut" not in update_fields:
+        update_fields.append("ut")
+    for name in update_fields:
+      if name not in name_list:
+        raise SqlError(f"upsert update field '{name}' not inserted")
+    if len(update_fields) == 0:
+      raise SqlError("upsert no update field")
+    placeholder = get_values_placeholder(len(name_list))
+    sql = f"insert into {self.__table_name} ({','.join(name_list)}) VALUES ({placeholder})"
+    if row_alias is not None:
+      update_str = ", ".join(f"`{name}`={row_alias}.`{name}`" for name in update_fields)
+      sql = f"{sql} AS {row_alias} ON DUPLICATE KEY UPDATE {update_str}"
+    else:
+      update_str = ", ".join(f"`{name}`=VALUES(`{name}`)" for name in update_fields)
+      sql = f"{sql} ON DUPLICATE KEY UPDATE {update_str}"
+    return sql, field_list, update_fields
+
+  def _build_update_many(self, item_list, fields, chunk_size, fill_time):
+    """
+    批量更新的 sql, 每 chunk_size 条一个 UPDATE ... SET col = CASE id WHEN ... END WHERE id in (...)
+    :return: 按数据源分组 [(数据源, [(sql, 参数列表)])]
+    """
+    field_dict = self.__entity.__field_dict__
+    if fields is None:
+      first = item_list[0]
+      name_list = list(first.keys()) if isinstance(first, dict) else self.__entity.__field_name_list__
+      fields = [name for name in name_list if name not in ("id", "ct")]
+    fields = [name for name in fields if not (fill_time is True and name == "ut")]
+    for name in fields:
+      if name == "id" or name not in field_dict:
+        raise SqlError(f"update_many field '{name}' not entity field")
+    now = datetime.datetime.now() if fill_time is True and "ut" in field_dict else None
+    group_dict = {}
+    for item in item_list:
+      if _item_value(item, "id") is None:
+        raise SqlError("update_many item without id")
+      group_dict.setdefault(self._get_datasource(item), []).append(item)
+    group_list = []
+    for datasource, group in group_dict.items():
+      statement_list = [self.__update_chunk_sql(group[start:start + chunk_size], fields, now)
+                        for start in range(0, len(group), chunk_size)]
+      group_list.append((datasource, [st for st in statement_list if st is not None]))
+    return group_list
+
+  def __update_chunk_sql(self, item_list, fields, now):
+    field_dict = self.__entity.__field_dict__
+    id_list = [_item_value(item, "id") for item in item_list]
+    set_list = []
+    param_list = []
+    for name in fields:
+      map_json = field_dict[name].map_json
+      when_list = []
+      for id_, item in zip(id_list, item_list):
+        value = _item_value(item, name, _MISSING)
+        # 没有设置的字段保持原值
+        if value is _MISSING: continue
+        if map_json is True:
+          value = json_dumps(value)
+        when_list.append("WHEN %s THEN %s")
+        param_list.extend((id_, value))
+      if len(when_list) > 0:
+        set_list.append(f"`{name}` = CASE id {' '.join(when_list)} ELSE `{name}` END")
+    if len(set_list) == 0:
+      return None
+    if now is not None:
+      set_list.append("`ut`=%s")
+      param_list.append(now)
+    sql = "\n".join([
+      f"UPDATE `{self.__table_name}`",
+      f"SET {', '.join(set_list)}",
+      f"WHERE id in ({get_values_placeholder(len(id_list))})",
+    ])
+    return sql, param_list + id_list
+
+  @staticmethod
+  async def __execute_statements(conn, statement_list):
+    row_count = 0
+    async with conn.cursor() as cur:
+      for sql, param_list in statement_list:
+        await cur.execute(sql, param_list)
+        row_count += cur.rowcount
+    return row_count
+
+  async def __insert_batches(self, conn, sql, obj_list, d_list_list, batch_size, fill_id):
+    async with conn.cursor() as cur:
+      increment = None
+      if fill_id is True:
+        await cur.execute("SELECT @@auto_increment_increment")
+        increment = (await cur.fetchone())[0]
+      row_count = 0
+      for start in range(0, len(d_list_list), batch_size):
+        await cur.executemany(sql, d_list_list[start:start + batch_size])
+        row_count += cur.rowcount
+        if increment is not None:
+          self._set_insert_id_many(obj_list[start:start + batch_size], cur.batch_results, increment)
+      return row_count
+
+  async def __write_in_transaction(self, datasource: DataSource, write):
+    """write(conn) 在一个事务里执行, 已经在事务里时用外层的事务"""
+    if datasource.pinned_conn() is not None:
+      # 在事务里, 由外层的事务提交
+      async with datasource.acquire_write(**self.__acquire_kw) as conn:
+        return await write(conn)
+    async with datasource.acquire_write(**self.__acquire_kw) as conn:
+      await conn.begin()
+      try:
+        r = await write(conn)
+        await conn.commit()
+      except BaseException:
+        await conn.rollback()
+        raise
+      return r
+
+  async def __insert_many_on(self, datasource: DataSource, sql, obj_list, d_list_list, batch_size, fill_id):
+    return await self.__write_in_transaction(
+      datasource, lambda conn: self.__insert_batches(conn, sql, obj_list, d_list_list, batch_size, fill_id))
+
+  async def insert(self,obj,fill_time=True):
+    datasource, sql, d_list = self._build_insert(obj, fill_time)
     orange_sql_log.debug.print_split()
-    async with self.__pool.acquire() as conn:
+    async with datasource.acquire_write(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
-        d_dict = obj.__dict__
-        d_list = []
-        for field in self.__field_list_no_id:
-          d = d_dict.get(field.name,None)
-          # print(field.name,d,field.db_map_json)
-          if field.map_json is True:
-            d = json_dumps(d)
-          d_list.append(d)
-        await cur.execute(self.__insert_sql,d_list)
-        obj.id = cur.lastrowid
-        await conn.commit()
+        await cur.execute(sql,d_list)
+        self._set_insert_id(obj, cur.lastrowid)
+    self._invalidate_count()
+
+  async def insert_many(self, obj_list, batch_size=1000, fill_time=True) -> int:
+    """
+    批量插入, 每 batch_size 个对象合并成多行 VALUES 的 insert (超过 max_stmt_length 时再拆分),
+    同一个数据源的所有批次在一个事务里执行, 已经在事务里时用外层的事务,
+    插入后回填每个对象的 id, 分片表每个分片各自一个事务
+    :return: 插入的行数
+    """
+    orange_sql_log.debug.print_split()
+    row_count = 0
+    try:
+      for datasource, group_obj_list, d_list_list in self._build_insert_many(obj_list, fill_time):
+        row_count += await self.__insert_many_on(datasource, self.__insert_sql, group_obj_list, d_list_list,
+                                                 batch_size, self._insert_need_id())
+    finally:
+      self._invalidate_count()
+    orange_sql_log.debug("insert_num", row_count)
+    return row_count
+
+  async def upsert_many(self, obj_list, update_fields=None, conflict_key=None, batch_size=1000,
+                        fill_time=True, row_alias=None) -> int:
+    """
+    批量插入或更新, INSERT ... ON DUPLICATE KEY UPDATE, 分批和事务同 insert_many, 不回填 id,
+    fill_time 时对象的 ut 设为当前时间, ct 只在插入时写入, 不知道每一行是插入还是更新, 不写回对象
+    (update_fields 包含 ct 时才写回)
+    :param update_fields: 主键或唯一索引冲突时更新的字段, 默认除冲突键 id ct 以外插入的所有字段,
+      fill_time 时总是更新 ut
+    :param conflict_key: 判断冲突的唯一索引字段 (mysql 按表上所有的主键和唯一索引判断), 这些字段不更新,
+      包含 id 时 id 也插入
+    :param row_alias: mysql 8.0.19 以上用行别名 VALUES (...) AS new ... col=new.col 代替废弃的 VALUES(col)
+    :return: mysql 的影响行数, 插入的行计 1, 更新的行计 2, 没有变化的行计 0
+    """
+    orange_sql_log.debug.print_split()
+    sql, field_list, update_fields = self._build_upsert_sql(update_fields, conflict_key, row_alias, fill_time)
+    row_count = 0
+    try:
+      for datasource, group_obj_list, d_list_list in self._build_insert_many(obj_list, fill_time, field_list,
+                                                                             "ct" in update_fields):
+        row_count += await self.__insert_many_on(datasource, sql, group_obj_list, d_list_list,
+                                                 batch_size, False)
+    finally:
+      self._invalidate_count()
+    orange_sql_log.debug("affected_num", row_count)
+    return row_count
+
+  async def update_many(self, item_list, fields=None, chunk_size=500, fill_time=True) -> int:
+    """
+    按 id 批量更新, 每行的值可以不同, 每 chunk_size 条生成一条
+      UPDATE ... SET col = CASE id WHEN ... THEN ... ELSE col END WHERE id in (...)
+    同一个数据源的所有语句在一个事务里执行, 已经在事务里时用外层的事务, 分片表每个分片各自一个事务
+    :param item_list: 实体对象或者 dict, 都要有 id, dict 没有的键不更新
+    :param fields: 更新的字段, 默认是第一条的所有字段 (除 id ct), 对象默认会更新所有字段, 只改部分字段时要指定
+    :param fill_time: 同 update, 自动更新 ut
+    :return: 影响行数
+    """
+    if len(item_list) == 0:
+      return 0
+    orange_sql_log.debug.print_split()
+    row_count = 0
+    try:
+      for datasource, statement_list in self._build_update_many(item_list, fields, chunk_size, fill_time):
+        row_count += await self.__write_in_transaction(
+          datasource, lambda conn, statement_list=statement_list: self.__execute_statements(conn, statement_list))
+    finally:
+      self._invalidate_count()
+    orange_sql_log.debug("affected_num", row_count)
+    return row_count
+
+  def _invalidate_count(self):
+    """写入之后清空这个表的 count 缓存"""
+    _invalidate_count(self.__table_name,
+                      [self._get_datasource()] if self.__shard is None else self.__shard.all())
+
+  def _insert_sql(self):
+    return self.__insert_sql
 
   def query(self)->MySqlQuery:
-    return MySqlQuery(self.__table_name,
-                      self.__all_fields_str,
-                      self.__pool,
-                      self.__entity)
+    return self._query_type(self.__table_name,
+                            self.__all_fields_str,
+                            None if self.__shard is not None else self._get_datasource(),
+                            self.__entity,
+                            self.__acquire_kw,
+                            self.__shard)
 
   def update(self,fill_time=True)->MysqlUpdate:
-    return MysqlUpdate(
+    return self._update_type(
       self.__table_name,
-      self.__pool,
+      None if self.__shard is not None else self._get_datasource(),
       self.__entity,
-      fill_time)
+      fill_time,
+      self.__acquire_kw,
+      self.__shard)
+
+  def delete(self)->MysqlDelete:
+    return self._delete_type(
+      self.__table_name,
+      None if self.__shard is not None else self._get_datasource(),
+      self.__acquire_kw,
+      self.__shard)
 
 
 
@@ -451,27 +1701,62 @@ class JoinItem:
 class LeftJoinQuery(SqlWhereBuilder):
 
   __slots__ = ("__entity_list", "__prefix_sql",
-               "__from_str","__order_str","__pool")
+               "__from_str","__order_str","__datasource","__acquire_kw",
+               "__column_list","__id_column","__order_field","__order_desc",
+               "__main_from_str","__main_alias")
 
-  def __init__(self,entity_list,prefix_sql,from_str,pool):
+  def __init__(self,entity_list,prefix_sql,from_str,datasource,acquire_kw=None,
+               column_list=None,id_column=None,main_from_str=None,main_alias=None):
+    """
+    :param column_list: 查询的列名列表 (别名.字段), get_page_after 用来找排序字段的位置
+    :param id_column: 主表的 id 列, get_page_after 排序用
+    :param main_from_str: 只有主表的 FROM, 延迟关联分页的条件和排序只用到主表时, 统计和查 id 不联表
+    :param main_alias: 主表的别名
+    """
     super().__init__()
+    self.__acquire_kw = dict(acquire_kw or {})
     self.__entity_list = entity_list
     self.__prefix_sql = prefix_sql
     self.__order_str = None
+    self.__column_list = column_list
+    self.__id_column = id_column
+    self.__order_field = None
+    self.__order_desc = False
     self.__from_str = from_str
-    self.__pool = pool
+    self.__main_from_str = main_from_str
+    self.__main_alias = main_alias
+    self.__datasource: DataSource = datasource
+
+  def priority(self, priority):
+    """获取连接的优先级, 值越小越先拿到连接"""
+    self.__acquire_kw["priority"] = priority
+    return self
+
+  def partition(self, name):
+    """使用连接池的哪个分区"""
+    self.__acquire_kw["partition"] = name
+    return self
+
+  def use_primary(self):
+    """查询走主库, 不走从库"""
+    self.__acquire_kw["primary"] = True
+    return self
 
   def order(self,field):
     """正序"""
     # args = ", ".join([f"{field}" for field in args])
     # 这样是不行的, 要执行多次 生成一个列表, 然后合成
     self.__order_str = f"ORDER BY {field}"
+    self.__order_field = field
+    self.__order_desc = False
     return self
 
   def order_desc(self,field):
     """倒叙"""
     # args = ", ".join([f"{field} DESC" for field in args])
     self.__order_str = f"ORDER BY {field} DESC"
+    self.__order_field = field
+    self.__order_desc = True
     return self
 
   def __build_sql(self):
@@ -488,7 +1773,7 @@ class LeftJoinQuery(SqlWhereBuilder):
     sql = self.__build_sql()
     sql = "\n".join(sql)
     orange_sql_log.debug.print_split()
-    async with self.__pool.acquire() as conn:
+    async with self.__datasource.acquire_read(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
         await cur.execute(sql, self._where_param_list)
         r = await cur.fetchall()
@@ -515,10 +1800,23 @@ class LeftJoinQuery(SqlWhereBuilder):
     data_list = await self.__get_list()
     return self.__out__list(data_list)
 
-  def __build_count_sql(self):
+  def __main_table_only(self):
+    """条件和排序是否只用到主表的字段, where_sql 写的条件不能判断, 当作用到了关联表"""
+    if self.__main_from_str is None:
+      return False
+    prefix = f"{self.__main_alias}."
+    for shape in self._where_shape_list:
+      if isinstance(shape, str):
+        if shape not in ("AND", "OR"):
+          return False
+      elif not shape[1].startswith(prefix):
+        return False
+    return self.__order_field is None or self.__order_field.startswith(prefix)
+
+  def __build_count_sql(self, from_str=None):
     sql = [
       f"SELECT  count(*)",
-      self.__from_str
+      self.__from_str if from_str is None else from_str
     ]
     where_str = self._build_where()
     if where_str.strip() != "":
@@ -529,7 +1827,7 @@ class LeftJoinQuery(SqlWhereBuilder):
   async def count(self):
     orange_sql_log.debug.split_line()
     count_sql = self.__build_count_sql()
-    async with self.__pool.acquire() as conn:
+    async with self.__datasource.acquire_read(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
         await cur.execute(count_sql, self._where_param_list)
         r = await cur.fetchone()
@@ -539,7 +1837,7 @@ class LeftJoinQuery(SqlWhereBuilder):
   async def __page(self, index: int, size: int):
     orange_sql_log.debug.print_split()
     count_sql = self.__build_count_sql()
-    async with self.__pool.acquire() as conn:
+    async with self.__datasource.acquire_read(**self.__acquire_kw) as conn:
       async with conn.cursor() as cur:
         await cur.execute(count_sql, self._where_param_list)
         r = await cur.fetchone()
@@ -559,26 +1857,120 @@ class LeftJoinQuery(SqlWhereBuilder):
         orange_sql_log.debug.list(r)
         return r, total
 
-  async def get_page(self, index: int, size: int):
-    """分页查询"""
-    raw_list, total = await self.__page(index, size)
+  async def __deferred_page(self, index: int, size: int):
+    if self.__id_column is None or self.__column_list is None:
+      raise SqlError("deferred page need main table id column")
+    orange_sql_log.debug.print_split()
+    # 关联的表最多对应一条记录, 条件和排序只用到主表时联表不影响总数和 id 的顺序,
+    # 统计和查 id 只查主表, 只有这一页的 id 做联表查询
+    from_str = self.__main_from_str if self.__main_table_only() else self.__from_str
+    count_sql = self.__build_count_sql(from_str)
+    async with self.__datasource.acquire_read(**self.__acquire_kw) as conn:
+      async with conn.cursor() as cur:
+        await cur.execute(count_sql, self._where_param_list)
+        r = await cur.fetchone()
+        total = r[0]
+        orange_sql_log.debug("total", total)
+        if total == 0:
+          return [], 0
+        orange_sql_log.debug.print_split()
+        sql = [f"SELECT {self.__id_column}", from_str]
+        where_str = self._build_where()
+        if where_str.strip() != "":
+          sql.append(f"WHERE {where_str}")
+        if self.__order_str is not None:
+          sql.append(self.__order_str)
+        sql.append("limit %s,%s")
+        await cur.execute("\n".join(sql), self._where_param_list + [size * (index - 1), size])
+        # 一条主表记录只关联一条记录时 id 不会重复, 重复时保留第一次出现的位置
+        id_list = list(dict.fromkeys(data[0] for data in await cur.fetchall()))
+        if len(id_list) == 0:
+          return [], total
+        orange_sql_log.debug.print_split()
+        sql = f"{self.__prefix_sql}\nWHERE {self.__id_column} in ({get_values_placeholder(len(id_list))})"
+        await cur.execute(sql, id_list)
+        data_list = await cur.fetchall()
+    id_index = self.__column_list.index(self.__id_column)
+    data_dict = {}
+    for data in data_list:
+      data_dict.setdefault(data[id_index], []).append(data)
+    r = [data for id_ in id_list for data in data_dict.get(id_, [])]
+    orange_sql_log.debug.list(r)
+    return r, total
+
+  async def get_page(self, index: int, size: int, deferred=False):
+    """
+    分页查询
+    :param deferred: 延迟关联, 先查出这一页主表的 id, 再只对这些 id 做联表查询,
+      关联的表要是一条主表记录最多对应一条记录, 否则一页的条数会变,
+      条件和排序只用到主表字段 (主表别名.字段) 时查 id 不联表, 否则查 id 时还是要联表
+    """
+    if deferred is True:
+      raw_list, total = await self.__deferred_page(index, size)
+    else:
+      raw_list, total = await self.__page(index, size)
     if total != 0:
       out_list = self.__out__list(raw_list)
       return out_list, total
     else:
       return [], 0
 
+  def __keyset_columns(self):
+    if self.__id_column is None or self.__column_list is None:
+      raise SqlError("get_page_after need main table id column")
+    if self.__order_field is None or self.__order_field == self.__id_column:
+      return [self.__id_column]
+    if self.__order_field not in self.__column_list:
+      raise SqlError(f"get_page_after order field '{self.__order_field}' not in select columns")
+    return [self.__order_field, self.__id_column]
+
+  async def get_page_after(self, cursor, size: int):
+    """按游标翻页, 排序字段要写成 别名.字段, 用法同 MySqlQuery.get_page_after"""
+    orange_sql_log.debug.print_split()
+    column_list = self.__keyset_columns()
+    desc = self.__order_desc
+    sql = [self.__prefix_sql]
+    param_list = list(self._where_param_list)
+    where_list = []
+    where_str = self._build_where()
+    if where_str.strip() != "":
+      where_list.append(f"({where_str})")
+    if cursor is not None:
+      value_list = _decode_page_cursor(cursor, column_list, desc)
+      where_list.append(_keyset_condition(column_list, desc, len(value_list) > 1 and value_list[0] is None))
+      param_list.extend(_keyset_params(value_list))
+    if len(where_list) > 0:
+      sql.append(f"WHERE {' AND '.join(where_list)}")
+    direction = " DESC" if desc is True else ""
+    sql.append("ORDER BY " + ", ".join(f"{column}{direction}" for column in column_list))
+    sql.append("limit %s")
+    param_list.append(size + 1)
+    async with self.__datasource.acquire_read(**self.__acquire_kw) as conn:
+      async with conn.cursor() as cur:
+        await cur.execute("\n".join(sql), param_list)
+        r = await cur.fetchall()
+    next_cursor = None
+    if len(r) > size:
+      r = r[:size]
+      index_list = [self.__column_list.index(column) for column in column_list]
+      next_cursor = _encode_page_cursor(column_list, desc, [r[-1][i] for i in index_list])
+    orange_sql_log.debug.list(r)
+    return self.__out__list(r), next_cursor
+
 class LeftJoinRepo:
 
   __slots__ = ("__entity_list","__prefix_sql",
-               "__from_str", "__pool")
+               "__from_str", "__datasource_name", "__acquire_kw",
+               "__column_list", "__id_column", "__main_from_str", "__main_alias")
 
-  def __init__(self, join_define_list: list[JoinItem]):
+  def __init__(self, join_define_list: list[JoinItem], priority=PRIORITY_NORMAL, partition=None,
+               datasource=DEFAULT_DATASOURCE):
 
     select_list = []
     alias_list = []
     entity_list = []
     join_str_list = []
+    column_list = []
 
     for item in join_define_list:
       alias = item.alias
@@ -587,6 +1979,7 @@ class LeftJoinRepo:
       alias_list.append(alias)
       entity_list.append(item.entity)
       select_list.append(item.get_select_fields_str())
+      column_list.extend(f'{alias}.{name}' for name in item.entity.__field_name_list__)
       join_str_list.append(f'LEFT JOIN {item.table_name} {alias} ON {item.on}')
 
     mt = join_define_list[0] # main_table
@@ -602,10 +1995,17 @@ class LeftJoinRepo:
 
     self.__entity_list = entity_list
     self.__prefix_sql = '\n'.join(sql_list)
-    self.__pool = get_sql_pool()
+    self.__datasource_name = datasource
+    self.__acquire_kw = {"priority": priority, "partition": partition}
+    self.__column_list = column_list
+    self.__id_column = f'{mt.alias}.id' if "id" in mt.entity.__field_dict__ else None
+    self.__main_from_str = f'FROM {mt.table_name} {mt.alias}'
+    self.__main_alias = mt.alias
 
 
   def query(self):
     return LeftJoinQuery(self.__entity_list, self.__prefix_sql,
-                         self.__from_str, self.__pool)
+                         self.__from_str, get_datasource(self.__datasource_name),
+                         self.__acquire_kw, self.__column_list, self.__id_column,
+                         self.__main_from_str, self.__main_alias)
 
@@ -0,0 +1,86 @@
+"""
+水平分片
+
+每个分片是一个命名数据源, 分片函数把分片键的值映射成分片序号
+本地测试可以在同一个 mysql 上建多个库, 每个库初始化成一个数据源当作一个分片
+"""
+import bisect
+import zlib
+
+from .datasource import DataSource
+from .init import get_datasource
+from .utils import SqlError
+
+
+class HashShard:
+  """按值哈希分片, 整数直接取模, 其他类型用 crc32 取模, 保证不同进程结果一致"""
+
+  __slots__ = ("count",)
+
+  def __init__(self, count: int):
+    if count < 1:
+      raise ValueError("shard count should be at least 1")
+    self.count = count
+
+  def __call__(self, value) -> int:
+    if isinstance(value, int):
+      return value % self.count
+    return zlib.crc32(str(value).encode("utf-8")) % self.count
+
+
+class RangeShard:
+  """
+  按范围分片, boundaries 是升序的分界值, 可以是 id 也可以是时间 ct
+  小于 boundaries[0] 的在 0 号分片, [boundaries[0], boundaries[1]) 在 1 号分片, 以此类推
+  """
+
+  __slots__ = ("boundaries",)
+
+  def __init__(self, boundaries: list):
+    if list(boundaries) != sorted(boundaries):
+      raise ValueError("shard boundaries should be ascending")
+    self.boundaries = list(boundaries)
+
+  def __call__(self, value) -> int:
+    return bisect.bisect_right(self.boundaries, value)
+
+
+class ShardRouter:
+
+  __slots__ = ("shard_key", "shard_func", "datasource_name_list", "resolve")
+
+  def __init__(self, shard_key: str, shard_func, datasource_name_list: list[str], resolve=get_datasource):
+    """
+    :param shard_key: 分片键字段名
+    :param shard_func: 分片函数 值 -> 分片序号, 例如 HashShard(4) RangeShard([...])
+    :param datasource_name_list: 按分片序号排列的数据源名字
+    :param resolve: 数据源名字 -> 数据源, 同步 repo 用 get_sync_datasource
+    """
+    if len(datasource_name_list) == 0:
+      raise ValueError("shard datasource list is empty")
+    self.shard_key = shard_key
+    self.shard_func = shard_func
+    self.datasource_name_list = list(datasource_name_list)
+    self.resolve = resolve
+
+  def get_datasource(self, value) -> DataSource:
+    if value is None:
+      raise SqlError(f"shard key '{self.shard_key}' value is None")
+    index = self.shard_func(value)
+    if not 0 <= index < len(self.datasource_name_list):
+      raise SqlError(f"shard key '{self.shard_key}' value {value!r} map to shard {index} out of range")
+    return self.resolve(self.datasource_name_list[index])
+
+  def route(self, value_list=None) -> list[DataSource]:
+    """分片键的取值列表对应的分片, 没有取值的时候返回全部分片"""
+    if value_list is None:
+      return self.all()
+    ds_list = []
+    for value in value_list:
+      ds = self.get_datasource(value)
+      if ds not in ds_list:
+        ds_list.append(ds)
+    return ds_list
+
+  def all(self) -> list[DataSource]:
+    return [self.resolve(name) for name in self.datasource_name_list]
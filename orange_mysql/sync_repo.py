@@ -0,0 +1,438 @@
+"""
+同步 repo, 和 BaseRepo 用法一样, 通过 PooledDB 执行, 给线程里运行的同步代码使用 (例如 celery 一类的 worker)
+
+  close_pool = orange_mysql_sync_init(config)
+
+  class UserRepo(SyncBaseRepo):
+    def __init__(self):
+      super().__init__("user", User)
+
+  user_list = UserRepo().query().eq("name", "a").get_list()
+
+sql 生成和结果映射和异步版本共用, 多个分片依次查询
+"""
+import time
+
+from .datasource import SyncDataSource
+from .init import get_sync_datasource
+from .pymysql.cursors import SSCursor
+from .repo import MySqlQuery, MysqlUpdate, MysqlDelete, BaseRepo, PAGE_SEQUENTIAL, PAGE_WINDOW, PAGE_MULTI_STATEMENT, PAGE_CONCURRENT
+from .repo import COUNT_EXACT, COUNT_ESTIMATED, COUNT_CACHED, _estimated_rows
+from .utils import orange_sql_log, SqlError
+
+
+def _fetch(datasource: SyncDataSource, sql, param_list, fetch_one=False):
+  with datasource.connection() as conn:
+    with conn.cursor() as cur:
+      cur.execute(sql, param_list)
+      if fetch_one is True:
+        return cur.fetchone()
+      return cur.fetchall()
+
+
+class SyncMySqlQuery(MySqlQuery):
+
+  __slots__ = ()
+
+  def __get_first(self):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    if len(target_list) == 1:
+      sql = self._statement("list")
+      r = _fetch(target_list[0], sql, self._where_param_list, True)
+    else:
+      sql = self._statement("list", True)
+      r = self._merge_first([_fetch(ds, sql, self._where_param_list, True) for ds in target_list])
+    orange_sql_log.debug(r)
+    return r
+
+  def __get_list(self):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    if len(target_list) == 1:
+      sql = self._statement("list")
+      r = _fetch(target_list[0], sql, self._where_param_list)
+    else:
+      sql = self._statement("list", True)
+      r = self._merge([_fetch(ds, sql, self._where_param_list) for ds in target_list])
+    orange_sql_log.debug.list(r)
+    return r
+
+  def get_first(self, out_type=None):
+    out_type = self._handler_out_type(out_type)
+    data = self.__get_first()
+    if data is None: return
+    elif out_type == tuple:
+      return data
+    elif out_type == dict:
+      return self._create_out_dict(data)
+    else:
+      return self._create_out_obj(data, out_type)
+
+  def get_list(self, out_type=None):
+    out_type = self._handler_out_type(out_type)
+    return self._out_list(self.__get_list(), out_type)
+
+  @staticmethod
+  def __stream_on(datasource: SyncDataSource, sql, param_list, batch_size):
+    with datasource.connection() as conn:
+      cur = conn.cursor(SSCursor)
+      finished = False
+      try:
+        cur.execute(sql, param_list)
+        while True:
+          data_list = cur.fetchmany(batch_size)
+          if len(data_list) == 0:
+            break
+          yield data_list
+        finished = True
+      finally:
+        if finished is True:
+          cur.close()
+        else:
+          # 提前结束时断开连接, 不用读完剩下的数据, 连接不放回连接池
+          conn.discard()
+
+  def __stream_merge(self, stream_list, batch_size):
+    buffer_list = []
+    for stream in stream_list:
+      data_list = next(stream, None)
+      if data_list is not None:
+        buffer_list.append([data_list, 0, stream])
+    out = []
+    while len(buffer_list) > 0:
+      index = self._stream_pick([data_list[pos] for data_list, pos, _ in buffer_list])
+      buffer = buffer_list[index]
+      out.append(buffer[0][buffer[1]])
+      buffer[1] += 1
+      if buffer[1] == len(buffer[0]):
+        data_list = next(buffer[2], None)
+        if data_list is None:
+          buffer_list.pop(index)
+        else:
+          buffer[0], buffer[1] = data_list, 0
+      if len(out) == batch_size:
+        yield out
+        out = []
+    if len(out) > 0:
+      yield out
+
+  def stream(self, out_type=None, batch_size=1000):
+    """流式查询, 用法同 MySqlQuery.stream, 提前 break 时用 contextlib.closing 及时释放连接"""
+    out_type = self._handler_out_type(out_type)
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    if len(target_list) == 1:
+      stream_list = [self.__stream_on(target_list[0], self._statement("list"), self._where_param_list, batch_size)]
+      data_stream = stream_list[0]
+    else:
+      sql = self._statement("list", True)
+      stream_list = [self.__stream_on(ds, sql, self._where_param_list, batch_size) for ds in target_list]
+      data_stream = self.__stream_merge(stream_list, batch_size)
+    try:
+      for data_list in data_stream:
+        yield from self._stream_out(data_list, out_type)
+    finally:
+      data_stream.close()
+      for s in stream_list:
+        s.close()
+
+  @staticmethod
+  def __estimate_on(datasource: SyncDataSource, sql, param_list):
+    with datasource.connection() as conn:
+      with conn.cursor() as cur:
+        cur.execute(sql, param_list)
+        return _estimated_rows(cur.description, cur.fetchone())
+
+  def count(self, strategy=COUNT_EXACT):
+    """参数同 MySqlQuery.count"""
+    if strategy == COUNT_ESTIMATED:
+      sql = self._statement("estimate")
+      r_list = [self.__estimate_on(ds, sql, self._estimate_params()) for ds in self._target_list()]
+      orange_sql_log.debug(r_list)
+      return sum(r_list)
+    slot = None
+    if strategy == COUNT_CACHED:
+      total, slot = self._count_cache_get()
+      if total is not None:
+        return total
+    elif strategy != COUNT_EXACT:
+      raise SqlError(f"count strategy '{strategy}' not support")
+    count_sql = self._statement("count")
+    r_list = [_fetch(ds, count_sql, self._where_param_list, True) for ds in self._target_list()]
+    orange_sql_log.debug(r_list)
+    total = sum(r[0] for r in r_list)
+    self._count_cache_put(slot, total)
+    return total
+
+  def __page_on(self, datasource: SyncDataSource, sql, count_sql, param_list, mode=PAGE_SEQUENTIAL):
+    if count_sql is None:
+      # 总数已经按 count_strategy 得到
+      return _fetch(datasource, sql, param_list),0
+    with datasource.connection() as conn:
+      with conn.cursor() as cur:
+        if mode == PAGE_WINDOW:
+          cur.execute(sql, param_list)
+          r,total = self._page_result(cur.fetchall())
+          if total is None:
+            # 这一页没有数据时不知道总数, 再查一次
+            cur.execute(count_sql, self._where_param_list)
+            total = cur.fetchone()[0]
+          orange_sql_log.debug("total", total)
+          return r,total
+        elif mode == PAGE_MULTI_STATEMENT:
+          cur.execute(f"{count_sql};\n{sql}", self._where_param_list + param_list)
+          total = cur.fetchone()[0]
+          cur.nextset()
+          r = cur.fetchall()
+          orange_sql_log.debug("total", total)
+          return r,total
+        cur.execute(count_sql, self._where_param_list)
+        total = cur.fetchone()[0]
+        orange_sql_log.debug("total", total)
+        if total == 0:
+          return [],0
+        orange_sql_log.debug.print_split()
+        cur.execute(sql, param_list)
+        return cur.fetchall(),total
+
+  def __page(self, index: int, size: int, mode, count_sql):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    kind = self._page_kind("page", mode)
+    if len(target_list) == 1:
+      r,total = self.__page_on(target_list[0], self._statement(kind), count_sql,
+                               self._page_params(index, size), mode)
+    else:
+      sql = self._statement(kind, True)
+      param_list = self._page_params(index, size, True)
+      r,total = self._merge_page([self.__page_on(ds, sql, count_sql, param_list, mode) for ds in target_list],
+                                 index, size)
+    orange_sql_log.debug.print_split()
+    orange_sql_log.debug.list(r)
+    return r,total
+
+  def __deferred_page(self, index: int, size: int, mode, count_sql):
+    orange_sql_log.debug.print_split()
+    target_list = self._target_list()
+    scatter = len(target_list) > 1
+    sql = self._statement(self._page_kind("page_id", mode), scatter)
+    param_list = self._page_params(index, size, scatter)
+    result_list = [self.__page_on(ds, sql, count_sql, param_list, mode) for ds in target_list]
+    id_list, id_group, total = self._deferred_ids(result_list, index, size)
+    if len(id_list) == 0:
+      return [],total
+    orange_sql_log.debug.print_split()
+    r = self._deferred_rows([_fetch(target_list[target_index], self._statement(("rows", len(ids))), ids)
+                             for target_index, ids in id_group.items()], id_list)
+    orange_sql_log.debug.list(r)
+    return r,total
+
+  def get_page(self, index: int, size: int, out_type=None, deferred=False, mode=PAGE_SEQUENTIAL,
+               count_strategy=COUNT_EXACT):
+    """分页查询, 参数同 MySqlQuery.get_page, 同步查询不支持 PAGE_CONCURRENT"""
+    if mode == PAGE_CONCURRENT:
+      raise SqlError("sync query not support PAGE_CONCURRENT")
+    out_type = self._handler_out_type(out_type)
+    if count_strategy == COUNT_EXACT:
+      count_sql, known_total = self._statement("count"), None
+    else:
+      count_sql, known_total, mode = None, self.count(count_strategy), PAGE_SEQUENTIAL
+    if deferred is True:
+      raw_list,total = self.__deferred_page(index, size, mode, count_sql)
+    else:
+      raw_list,total = self.__page(index, size, mode, count_sql)
+    if known_total is not None:
+      total = known_total
+    if total != 0 or len(raw_list) > 0:
+      return self._out_list(raw_list, out_type),total
+    else:
+      return [],0
+
+  def get_page_after(self, cursor, size: int, out_type=None):
+    """按游标翻页, 用法同 MySqlQuery.get_page_after"""
+    out_type = self._handler_out_type(out_type)
+    orange_sql_log.debug.print_split()
+    kind, param_list = self._after_params(cursor, size)
+    sql = self._statement(kind)
+    r, next_cursor = self._merge_after([_fetch(ds, sql, param_list) for ds in self._target_list()], size)
+    orange_sql_log.debug.list(r)
+    return self._out_list(r, out_type), next_cursor
+
+
+class SyncMysqlUpdate(MysqlUpdate):
+
+  __slots__ = ()
+
+  def execute(self) -> int:
+    orange_sql_log.debug.print_split()
+    sql,param_list = self._build_sql_str()
+    affected_num = 0
+    for ds in self._target_list():
+      with ds.connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, param_list)
+          affected_num += cur.rowcount
+    self._invalidate_count()
+    orange_sql_log.debug("affected_num", affected_num)
+    return affected_num
+
+
+class SyncMysqlDelete(MysqlDelete):
+  """同步的删除, 同步数据源没有从库, chunked 的 max_replica_lag 不生效"""
+
+  __slots__ = ()
+
+  def execute(self) -> int:
+    orange_sql_log.debug.print_split()
+    sql,param_list = self._build_sql_str()
+    affected_num = 0
+    for ds in self._target_list():
+      with ds.connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, param_list)
+          affected_num += cur.rowcount
+    self._invalidate_count()
+    orange_sql_log.debug("affected_num", affected_num)
+    return affected_num
+
+  def __chunked_on(self, datasource: SyncDataSource, chunk_sql, batch_size, pause, progress, deleted):
+    first_sql, next_sql, delete_sql = chunk_sql
+    last_id = None
+    while True:
+      with datasource.connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(first_sql if last_id is None else next_sql, self._chunk_params(last_id, batch_size))
+          id_list = [data[0] for data in cur.fetchall()]
+          if len(id_list) == 0:
+            return deleted
+          cur.execute(delete_sql, self._where_param_list + [id_list[0], id_list[-1]])
+          deleted += cur.rowcount
+      last_id = id_list[-1]
+      self._invalidate_count()
+      if progress is not None:
+        progress(deleted, last_id)
+      if len(id_list) < batch_size:
+        return deleted
+      if pause > 0:
+        time.sleep(pause)
+
+  def chunked(self, batch_size=1000, pause=0.0, max_replica_lag=None, progress=None) -> int:
+    """分批删除, 参数同 MysqlDelete.chunked"""
+    orange_sql_log.debug.print_split()
+    chunk_sql = self._build_chunk_sql()
+    deleted = 0
+    for ds in self._target_list():
+      deleted = self.__chunked_on(ds, chunk_sql, batch_size, pause, progress, deleted)
+    orange_sql_log.debug("affected_num", deleted)
+    return deleted
+
+
+class SyncBaseRepo(BaseRepo):
+  """同步的 BaseRepo, 参数一样, priority partition 只对异步连接池有效"""
+
+  __slots__ = ()
+
+  _query_type = SyncMySqlQuery
+  _update_type = SyncMysqlUpdate
+  _delete_type = SyncMysqlDelete
+  _resolve_datasource = staticmethod(get_sync_datasource)
+
+  def insert(self, obj, fill_time=True):
+    datasource, sql, d_list = self._build_insert(obj, fill_time)
+    orange_sql_log.debug.print_split()
+    with datasource.connection() as conn:
+      with conn.cursor() as cur:
+        cur.execute(sql, d_list)
+        self._set_insert_id(obj, cur.lastrowid)
+    self._invalidate_count()
+
+  @staticmethod
+  def __write_in_transaction(datasource: SyncDataSource, write):
+    """write(conn) 在一个事务里执行"""
+    with datasource.connection() as conn:
+      conn.begin()
+      try:
+        r = write(conn)
+        conn.commit()
+      except BaseException:
+        conn.rollback()
+        raise
+      return r
+
+  def __insert_batches(self, conn, sql, obj_list, d_list_list, batch_size, fill_id):
+    with conn.cursor() as cur:
+      increment = None
+      if fill_id is True:
+        cur.execute("SELECT @@auto_increment_increment")
+        increment = cur.fetchone()[0]
+      row_count = 0
+      for start in range(0, len(d_list_list), batch_size):
+        cur.executemany(sql, d_list_list[start:start + batch_size])
+        row_count += cur.rowcount
+        if increment is not None:
+          self._set_insert_id_many(obj_list[start:start + batch_size], cur.batch_results, increment)
+      return row_count
+
+  def __execute_batches(self, sql, group_list, batch_size, fill_id):
+    """按数据源分组批量执行, 每个数据源一个事务, 返回影响行数"""
+    row_count = 0
+    try:
+      for datasource, obj_list, d_list_list in group_list:
+        row_count += self.__write_in_transaction(
+          datasource, lambda conn: self.__insert_batches(conn, sql, obj_list, d_list_list, batch_size, fill_id))
+    finally:
+      self._invalidate_count()
+    return row_count
+
+  def insert_many(self, obj_list, batch_size=1000, fill_time=True) -> int:
+    """批量插入, 参数同 BaseRepo.insert_many, 每个数据源一个事务"""
+    orange_sql_log.debug.print_split()
+    row_count = self.__execute_batches(self._insert_sql(), self._build_insert_many(obj_list, fill_time),
+                                       batch_size, self._insert_need_id())
+    orange_sql_log.debug("insert_num", row_count)
+    return row_count
+
+  def upsert_many(self, obj_list, update_fields=None, conflict_key=None, batch_size=1000,
+                  fill_time=True, row_alias=None) -> int:
+    """批量插入或更新, 参数同 BaseRepo.upsert_many"""
+    orange_sql_log.debug.print_split()
+    sql, field_list, update_fields = self._build_upsert_sql(update_fields, conflict_key, row_alias, fill_time)
+    row_count = self.__execute_batches(sql, self._build_insert_many(obj_list, fill_time, field_list,
+                                                                    "ct" in update_fields),
+                                       batch_size, False)
+    orange_sql_log.debug("affected_num", row_count)
+    return row_count
+
+  @staticmethod
+  def __execute_statements(conn, statement_list):
+    row_count = 0
+    with conn.cursor() as cur:
+      for sql, param_list in statement_list:
+        cur.execute(sql, param_list)
+        row_count += cur.rowcount
+    return row_count
+
+  def update_many(self, item_list, fields=None, chunk_size=500, fill_time=True) -> int:
+    """按 id 批量更新, 参数同 BaseRepo.update_many"""
+    if len(item_list) == 0:
+      return 0
+    orange_sql_log.debug.print_split()
+    row_count = 0
+    try:
+      for datasource, statement_list in self._build_update_many(item_list, fields, chunk_size, fill_time):
+        row_count += self.__write_in_transaction(
+          datasource, lambda conn: self.__execute_statements(conn, statement_list))
+    finally:
+      self._invalidate_count()
+    orange_sql_log.debug("affected_num", row_count)
+    return row_count
+
+  def query(self) -> SyncMySqlQuery:
+    return super().query()
+
+  def update(self, fill_time=True) -> SyncMysqlUpdate:
+    return super().update(fill_time)
+
+  def delete(self) -> SyncMysqlDelete:
+    return super().delete()
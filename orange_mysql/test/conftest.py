@@ -0,0 +1,33 @@
+import pytest
+
+from orange_mysql.aiomysql import pool as aiomysql_pool
+from .fakes import FakePoolConnection
+
+
+class Clock:
+  """手动拨动的时钟, 代替 time.monotonic"""
+
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def clock():
+  return Clock()
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+  """aiomysql 连接池打开的连接换成 FakePoolConnection, 返回打开过的连接列表"""
+  conn_list = []
+
+  async def connect(**kwargs):
+    conn = FakePoolConnection()
+    conn_list.append(conn)
+    return conn
+
+  monkeypatch.setattr(aiomysql_pool, "connect", connect)
+  return conn_list
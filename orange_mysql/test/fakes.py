@@ -0,0 +1,442 @@
+"""
+测试用的假连接池和连接, 不需要数据库
+执行的 sql 记录在 FakeConnection.executed, 查询结果由 handler(sql, 参数) 返回
+(行列表, 影响行数), 后面可以再加 lastrowid 和列名列表 (cursor.description 的第一项)
+"""
+import asyncio
+import datetime
+import os
+
+from orange_kit.model import VoBase
+
+from orange_mysql import SqlField, BaseRepo
+from orange_mysql.aiomysql.cursors import Cursor
+from orange_mysql.datasource import DataSource, SyncDataSource
+from orange_mysql.pymysql.converters import escape_item
+from orange_mysql.repo import MySqlQuery
+
+
+class Item(VoBase):
+  id: int = SqlField("id")
+  k: int = SqlField("k")
+  n: str = SqlField("n")
+  ct: datetime.datetime = SqlField("ct")
+  ut: datetime.datetime = SqlField("ut")
+
+
+def new_query():
+  return MySqlQuery("item", "id,k,n", None, Item)
+
+
+# (id, k, n), k 有 NULL 也有重复
+ROW_LIST = [(1, 3, "a"), (2, None, "b"), (3, 1, "c"), (4, 3, "d"),
+            (5, None, "e"), (6, 2, "f"), (7, 1, "g"), (8, None, "h")]
+
+
+def mysql_sorted(row_list, desc):
+  """mysql 按 k 排序的结果, NULL 最小, 倒序时相同的值按 id 倒序 (order_desc 的 ORDER BY k DESC, id DESC)"""
+  def key(row):
+    return (row[1] is not None, row[1] if row[1] is not None else 0), row[0]
+  if desc:
+    return sorted(row_list, key=key, reverse=True)
+  return sorted(row_list, key=lambda row: key(row)[0])
+
+
+class FakeCursor:
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.rowcount = -1
+    self.lastrowid = None
+    self.description = None
+    self.__row_list = []
+    self.__result_list = []
+
+  async def execute(self, sql, param_list=None):
+    self.__result_list = _handle(self.conn, sql, param_list)
+    self.__next_result()
+    return self.rowcount
+
+  async def nextset(self):
+    if len(self.__result_list) == 0:
+      return None
+    self.__next_result()
+    return True
+
+  def __next_result(self):
+    self.__row_list, self.rowcount, self.lastrowid, self.description = self.__result_list.pop(0)
+
+  async def fetchone(self):
+    return self.__row_list.pop(0) if len(self.__row_list) > 0 else None
+
+  async def fetchall(self):
+    row_list, self.__row_list = self.__row_list, []
+    return row_list
+
+  async def fetchmany(self, size):
+    row_list, self.__row_list = self.__row_list[:size], self.__row_list[size:]
+    return row_list
+
+  async def close(self):
+    pass
+
+
+def _handle(conn, sql, param_list):
+  """
+  执行一次, 记录在 executed, ";\n" 分开的多条语句按 %s 的个数分配参数, 每条语句分别交给 handler
+  :return: 每条语句的 (行列表, 影响行数, lastrowid, description)
+  """
+  param_list = list(param_list or [])
+  conn.executed.append((sql, list(param_list)))
+  result_list = []
+  for statement in sql.split(";\n"):
+    count = statement.count("%s")
+    r = conn.handler(statement, param_list[:count])
+    param_list = param_list[count:]
+    lastrowid = r[2] if len(r) > 2 else None
+    description = [(name,) for name in r[3]] if len(r) > 3 else None
+    result_list.append((list(r[0]), r[1], lastrowid, description))
+  return result_list
+
+
+class _CursorContext:
+  """同 aiomysql 的 conn.cursor(), 可以 await 也可以 async with"""
+
+  def __init__(self, cursor):
+    self.__cursor = cursor
+
+  def __await__(self):
+    return self.__aenter__().__await__()
+
+  async def __aenter__(self):
+    return self.__cursor
+
+  async def __aexit__(self, *exc):
+    await self.__cursor.close()
+
+
+def _no_result(sql, param_list):
+  return [], 1
+
+
+class FakeConnection:
+
+  def __init__(self, handler=None, executed=None):
+    self.handler = handler or _no_result
+    self.executed = executed if executed is not None else []
+    self.closed = False
+
+  def cursor(self, *cursor_type):
+    return _CursorContext(FakeCursor(self))
+
+  def close(self):
+    self.closed = True
+
+
+class _WireResult:
+  """aiomysql 的 MySQLResult, 一条语句的结果"""
+
+  def __init__(self, row_list, rowcount, lastrowid, has_next):
+    self.affected_rows = rowcount
+    self.insert_id = lastrowid
+    self.rows = tuple(row_list) if len(row_list) > 0 else None
+    self.description = None
+    self.warning_count = 0
+    self.has_next = has_next
+
+
+class FakeWireConnection:
+  """
+  aiomysql.Connection 和 Cursor 之间的接口, cursor() 返回真正的 aiomysql Cursor, 参数由 Cursor 拼进 sql,
+  每次发送的 sql 记录在 executed (参数是空列表), ";" 分开的多条语句分别交给 handler(sql, [])
+  """
+
+  encoding = "utf8"
+
+  def __init__(self, handler=None, executed=None):
+    self.loop = asyncio.get_running_loop()
+    self.handler = handler or _no_result
+    self.executed = executed if executed is not None else []
+    self.closed = False
+    self._result = None
+    self.__statement_list = []
+
+  def escape(self, obj):
+    return escape_item(obj, self.encoding)
+
+  def cursor(self, *cursor_type):
+    return _CursorContext(Cursor(self))
+
+  async def query(self, sql):
+    if isinstance(sql, (bytes, bytearray)):
+      sql = sql.decode(self.encoding)
+    self.executed.append((sql, []))
+    self.__statement_list = sql.split(";")
+    await self.next_result()
+
+  async def next_result(self):
+    # 同数据库, 读到一条语句的结果时才执行它, 出错的语句在这里抛出异常
+    statement = self.__statement_list.pop(0)
+    r = self.handler(statement, [])
+    self._result = _WireResult(r[0], r[1], r[2] if len(r) > 2 else None, len(self.__statement_list) > 0)
+
+  async def begin(self):
+    self.executed.append(("BEGIN", []))
+
+  async def commit(self):
+    self.executed.append(("COMMIT", []))
+
+  async def rollback(self):
+    self.executed.append(("ROLLBACK", []))
+
+  def close(self):
+    self.closed = True
+
+
+class FakeSyncCursor:
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.rowcount = -1
+    self.lastrowid = None
+    self.description = None
+    self.closed = False
+    self.__row_list = []
+    self.__result_list = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def execute(self, sql, param_list=None):
+    self.__result_list = _handle(self.conn, sql, param_list)
+    self.__next_result()
+    return self.rowcount
+
+  def nextset(self):
+    if len(self.__result_list) == 0:
+      return None
+    self.__next_result()
+    return True
+
+  def __next_result(self):
+    self.__row_list, self.rowcount, self.lastrowid, self.description = self.__result_list.pop(0)
+
+  def fetchone(self):
+    return self.__row_list.pop(0) if len(self.__row_list) > 0 else None
+
+  def fetchall(self):
+    row_list, self.__row_list = self.__row_list, []
+    return row_list
+
+  def fetchmany(self, size):
+    row_list, self.__row_list = self.__row_list[:size], self.__row_list[size:]
+    return row_list
+
+  def close(self):
+    self.closed = True
+
+
+class FakeSyncConnection(FakeConnection):
+  """PooledDB 取到的连接, with 结束时放回连接池"""
+
+  def __init__(self, handler=None, executed=None):
+    super().__init__(handler, executed)
+    self.cursor_list = []
+    self.discarded = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+  def cursor(self, *cursor_type):
+    cursor = FakeSyncCursor(self)
+    self.cursor_list.append(cursor)
+    return cursor
+
+  def begin(self):
+    self.executed.append(("BEGIN", []))
+
+  def commit(self):
+    self.executed.append(("COMMIT", []))
+
+  def rollback(self):
+    self.executed.append(("ROLLBACK", []))
+
+  def discard(self):
+    """同 PooledDedicatedDBConnection.discard, 断开连接不放回连接池"""
+    self.discarded = True
+    self.close()
+
+
+class FakeSyncPool:
+  """SyncDataSource 用到的 PooledDB 接口, 每次都拿到同一个连接"""
+
+  def __init__(self, handler=None, executed=None):
+    self.conn = FakeSyncConnection(handler, executed)
+    self.closed = False
+
+  def connection(self, shareable=False):
+    return self.conn
+
+  def close(self):
+    self.closed = True
+
+
+class _AcquireContext:
+
+  def __init__(self, pool):
+    self.__pool = pool
+
+  async def __aenter__(self):
+    return self.__pool.conn
+
+  async def __aexit__(self, *exc):
+    pass
+
+
+class FakePool:
+  """DataSource 用到的 Pool 接口, 每次都拿到同一个连接, 在事件循环里创建"""
+
+  def __init__(self, name, handler=None, executed=None, conn_type=None):
+    self.name = name
+    self.loop = asyncio.get_running_loop()
+    self.conn = (conn_type or FakeConnection)(handler, executed)
+    self.closed = False
+    self.circuit_open = False
+    self.size = 0
+    self.freesize = 0
+
+  def acquire(self, **kwargs):
+    return _AcquireContext(self)
+
+
+class _FakeReader:
+
+  eof_received = False
+
+  def at_eof(self):
+    return False
+
+  def exception(self):
+    return None
+
+
+class FakeWriter:
+  """连接关闭后 socket 在下一轮事件循环真正关闭, hold 为 True 时一直到 finish 才关闭"""
+
+  def __init__(self):
+    self.hold = False
+    self.__closed = asyncio.Event()
+
+  def finish(self):
+    self.__closed.set()
+
+  async def wait_closed(self):
+    if not self.hold:
+      await asyncio.sleep(0)
+      self.__closed.set()
+    await self.__closed.wait()
+
+
+class FakePoolConnection:
+  """aiomysql.Pool 用到的 Connection 接口, 由 conftest 的 fake_connect 换掉连接池的 connect"""
+
+  def __init__(self):
+    self._reader = _FakeReader()
+    self._writer = FakeWriter()
+    # close 之后 _writer 是 None, 测试用 writer 控制 socket 什么时候关闭
+    self.writer = self._writer
+    self._last_usage = 0.0
+    self.closed = False
+    self.query_count = 0
+    self.query_time = 0.0
+
+  @property
+  def last_usage(self):
+    return self._last_usage
+
+  def run_query(self, seconds):
+    """模拟执行了一条耗时 seconds 的语句"""
+    self.query_count += 1
+    self.query_time += seconds
+
+  def get_transaction_status(self):
+    return False
+
+  def close(self):
+    self.closed = True
+    self._writer = None
+
+  async def ensure_closed(self):
+    self.close()
+
+
+def fake_datasource(name, handler=None, replica=True, read_after_write=0, wire=False):
+  """
+  主库和一个从库的数据源, 在事件循环里创建
+  :param wire: 连接用 FakeWireConnection, 执行真正的 aiomysql Cursor
+  :return: (数据源, 执行过的 (sql, 参数) 列表, 主库从库共用)
+  """
+  executed = []
+  conn_type = FakeWireConnection if wire else FakeConnection
+  primary = FakePool(f"{name}-primary", handler, executed, conn_type)
+  replica_list = [FakePool(f"{name}-replica", handler, executed, conn_type)] if replica else []
+  return DataSource(name, primary, replica_list, read_after_write=read_after_write), executed
+
+
+def fake_sync_datasource(name, handler=None):
+  """
+  同步数据源, fork 之后重新创建的连接池也用同一个 handler
+  :return: (数据源, 执行过的 (sql, 参数) 列表)
+  """
+  executed = []
+  factory = lambda: FakeSyncPool(handler, executed)
+  return SyncDataSource(name, factory(), factory), executed
+
+
+def repo_type(datasource_dict, base=BaseRepo, **shard_kw):
+  """
+  使用 datasource_dict 里的数据源的 Item 表 repo
+  :param base: BaseRepo 或者 SyncBaseRepo
+  :param shard_kw: shard_key shard_func shards, 不传时用 "default" 数据源
+  """
+  class ItemRepo(base):
+    _resolve_datasource = staticmethod(datasource_dict.__getitem__)
+
+    def __init__(self):
+      super().__init__("item", Item, **shard_kw)
+
+  return ItemRepo
+
+
+class Child:
+  """fork 出的子进程执行 func, 把结果写回父进程, 然后等到 exit 才退出"""
+
+  def __init__(self, func):
+    result_read, result_write = os.pipe()
+    exit_read, self.__exit_write = os.pipe()
+    self.pid = os.fork()
+    if self.pid == 0:
+      try:
+        os.close(result_read)
+        os.close(self.__exit_write)
+        os.write(result_write, repr(func()).encode() + b"\n")
+        os.read(exit_read, 1)
+      finally:
+        os._exit(0)
+    os.close(result_write)
+    os.close(exit_read)
+    self.__result = os.fdopen(result_read)
+
+  def result(self):
+    return self.__result.readline().strip()
+
+  def exit(self):
+    os.close(self.__exit_write)
+    os.waitpid(self.pid, 0)
+    self.__result.close()
@@ -0,0 +1,92 @@
+"""
+多个连接池共用的连接预算, 用假的连接 (conftest 的 fake_connect), 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.aiomysql.budget import ConnectionBudget
+from orange_mysql.aiomysql.pool import create_pool, PoolExhaustedError
+
+
+async def settle():
+  """让 call_soon 和新建的任务跑完"""
+  for _ in range(5):
+    await asyncio.sleep(0)
+
+
+def test_budget_follows_pool_size(fake_connect):
+  async def main():
+    budget = ConnectionBudget(3)
+    pool = await create_pool(minsize=1, maxsize=3, budget=budget)
+    assert budget.used == 1
+    conn_list = [await pool.acquire() for _ in range(3)]
+    assert budget.used == 3
+    for conn in conn_list:
+      pool.release(conn)
+    assert budget.used == 3
+    pool.close()
+    await pool.wait_closed()
+    assert budget.used == 0
+  asyncio.run(main())
+
+
+def test_budget_reclaims_idle_units(fake_connect):
+  async def main():
+    budget = ConnectionBudget(2)
+    a = await create_pool(minsize=0, maxsize=2, budget=budget)
+    b = await create_pool(minsize=0, maxsize=2, budget=budget, acquire_timeout=1)
+    conn_list = [await a.acquire() for _ in range(2)]
+    for conn in conn_list:
+      a.release(conn)
+    assert budget.used == 2 and a.freesize == 2
+    # b 用完预算时让 a 关闭 minsize 以外的空闲连接, 拿到 a 还回的预算
+    async with b.acquire():
+      assert a.freesize == 0
+      assert budget.used == 1
+  asyncio.run(main())
+
+
+def test_budget_acquire_timeout(fake_connect):
+  async def main():
+    budget = ConnectionBudget(1)
+    a = await create_pool(minsize=0, maxsize=2, budget=budget)
+    b = await create_pool(minsize=0, maxsize=2, budget=budget, acquire_timeout=0.05)
+    held = await a.acquire()
+    # 预算被正在使用的连接占满, 等到超时
+    with pytest.raises(PoolExhaustedError):
+      await b.acquire()
+    a.release(held)
+  asyncio.run(main())
+
+
+def test_budget_default_timeouts(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=2, budget=ConnectionBudget(2))
+    assert pool._acquire_timeout == ConnectionBudget.acquire_timeout
+    assert pool._idle_timeout == ConnectionBudget.idle_timeout
+  asyncio.run(main())
+
+
+@pytest.mark.parametrize("close_free", [False, True])
+def test_budget_units_held_until_sockets_closed(fake_connect, close_free):
+  async def main():
+    budget = ConnectionBudget(2)
+    pool = await create_pool(minsize=0, maxsize=2, budget=budget)
+    conn = await pool.acquire()
+    conn.writer.hold = True
+    if close_free:
+      pool.release(conn)
+      pool.close()
+    else:
+      # terminate 关闭正在使用的连接
+      pool.terminate()
+    closing = asyncio.create_task(pool.wait_closed())
+    await settle()
+    # socket 还没有关闭, 其他连接池不能用它的预算
+    assert budget.used == 1
+    assert not closing.done()
+    conn.writer.finish()
+    await closing
+    assert budget.used == 0
+  asyncio.run(main())
@@ -0,0 +1,143 @@
+"""
+count 的估算和缓存, 用假的连接池, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.repo import COUNT_EXACT, COUNT_ESTIMATED, COUNT_CACHED, count_cache, _estimated_rows
+from orange_mysql.shard import HashShard
+from orange_mysql.utils import SqlError
+from .fakes import fake_datasource, repo_type
+
+
+@pytest.fixture(autouse=True)
+def clear_count_cache():
+  count_cache.clear()
+  yield
+  count_cache.clear()
+
+
+def count_handler(total):
+  """统计返回 total[0], 改变 total[0] 模拟其他途径的写入"""
+  def handler(sql, param_list):
+    if sql.startswith("SELECT  count(*)"):
+      return [(total[0],)], 1
+    if sql.startswith("EXPLAIN"):
+      return [(1, "SIMPLE", "item", 200, 25.0)], 1, None, ["id", "select_type", "table", "rows", "filtered"]
+    if sql.startswith("SELECT TABLE_ROWS"):
+      return [(total[0] + 3,)], 1, None, ["TABLE_ROWS"]
+    return [], 1
+  return handler
+
+
+def test_estimated_rows():
+  assert _estimated_rows([("TABLE_ROWS",)], (120,)) == 120
+  assert _estimated_rows([("rows",), ("filtered",)], (200, 25.0)) == 50
+  assert _estimated_rows([("rows",), ("filtered",)], (200, None)) == 200
+  assert _estimated_rows([("rows",)], None) == 0
+
+
+def test_count_estimated():
+  async def main():
+    ds, executed = fake_datasource("default", count_handler([8]))
+    repo = repo_type({"default": ds})()
+    # 没有条件时读表的统计信息, 有条件时按 EXPLAIN 的 rows * filtered% 估算
+    assert await repo.query().count(COUNT_ESTIMATED) == 11
+    assert executed[-1][1] == ["item"]
+    assert await repo.query().gt("k", 1).count(COUNT_ESTIMATED) == 50
+    assert executed[-1][0].startswith("EXPLAIN SELECT  count(*)")
+    assert executed[-1][1] == [1]
+  asyncio.run(main())
+
+
+def test_count_estimated_sums_shards():
+  async def main():
+    ds_dict = {}
+    for name in ("s0", "s1"):
+      ds_dict[name], _ = fake_datasource(name, count_handler([8]))
+    repo = repo_type(ds_dict, shard_key="id", shard_func=HashShard(2), shards=["s0", "s1"])()
+    assert await repo.query().count(COUNT_ESTIMATED) == 22
+  asyncio.run(main())
+
+
+def test_count_cached_until_write():
+  async def main():
+    total = [8]
+    ds, executed = fake_datasource("default", count_handler(total))
+    repo = repo_type({"default": ds})()
+    assert await repo.query().gt("k", 1).count(COUNT_CACHED) == 8
+    total[0] = 9
+    # 缓存命中不查询, 条件参数不同是另一个缓存
+    assert await repo.query().gt("k", 1).count(COUNT_CACHED) == 8
+    assert await repo.query().gt("k", 2).count(COUNT_CACHED) == 9
+    assert await repo.query().gt("k", 1).count(COUNT_EXACT) == 9
+    assert len(executed) == 3
+    update = repo.update()
+    update.set("n", "x")
+    await update.eq("id", 1).execute()
+    # 写入之后清空这个表的缓存
+    assert await repo.query().gt("k", 1).count(COUNT_CACHED) == 9
+  asyncio.run(main())
+
+
+def test_count_cache_expires(monkeypatch, clock):
+  monkeypatch.setattr("orange_mysql.repo.time.monotonic", clock)
+
+  async def main():
+    total = [8]
+    ds, _ = fake_datasource("default", count_handler(total))
+    repo = repo_type({"default": ds})()
+    assert await repo.query().count(COUNT_CACHED) == 8
+    total[0] = 9
+    clock.now += count_cache.ttl - 1
+    assert await repo.query().count(COUNT_CACHED) == 8
+    clock.now += 2
+    assert await repo.query().count(COUNT_CACHED) == 9
+  asyncio.run(main())
+
+
+def test_count_cache_invalidated_after_commit():
+  async def main():
+    total = [8]
+    ds, _ = fake_datasource("default", count_handler(total))
+    repo = repo_type({"default": ds})()
+    # 同 Transaction: 固定连接, 提交时先取出回调再解除固定, 提交之后执行回调
+    token = ds.pin(ds.primary.conn)
+    update = repo.update()
+    update.set("n", "x")
+    await update.eq("id", 1).execute()
+    callback_list = ds.take_commit_callbacks()
+    ds.unpin(token)
+    # 提交之前其他连接统计到的是提交前的总数
+    assert await repo.query().count(COUNT_CACHED) == 8
+    total[0] = 9
+    for callback in callback_list:
+      callback()
+    assert await repo.query().count(COUNT_CACHED) == 9
+  asyncio.run(main())
+
+
+def test_count_cached_page_total():
+  async def main():
+    def handler(sql, param_list):
+      if sql.startswith("SELECT  count(*)"):
+        return [(8,)], 1
+      return [(1, 3, "a", None, None)], 1
+
+    ds, executed = fake_datasource("default", handler)
+    repo = repo_type({"default": ds})()
+    for _ in range(2):
+      item_list, total = await repo.query().get_page(1, 1, count_strategy=COUNT_CACHED)
+      assert [x.id for x in item_list] == [1] and total == 8
+    # 第二次总数用缓存, 只查询数据
+    assert [sql.startswith("SELECT  count(*)") for sql, _ in executed] == [True, False, False]
+  asyncio.run(main())
+
+
+def test_count_strategy_not_support():
+  async def main():
+    ds, _ = fake_datasource("default", count_handler([8]))
+    with pytest.raises(SqlError):
+      await repo_type({"default": ds})().query().count("unknown")
+  asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+延迟关联分页, 先按排序和翻页查出 id, 再按 id 查整行, 用假的连接池, 不需要数据库
+"""
+import asyncio
+
+from orange_mysql.repo import LeftJoinRepo, JoinItem
+from orange_mysql.shard import HashShard
+from .fakes import Item, ROW_LIST, mysql_sorted, fake_datasource, repo_type
+
+
+def row(id_):
+  """ROW_LIST 里的一行加上 ct ut"""
+  return ROW_LIST[id_ - 1] + (None, None)
+
+
+def table_handler(row_list):
+  """按 sql 的类型返回 row_list 上的结果, 查 id 按 k 倒序"""
+  def handler(sql, param_list):
+    if sql.startswith("SELECT  count(*)"):
+      return [(len(row_list),)], 1
+    if "limit" in sql:
+      ordered = mysql_sorted(row_list, True)
+      if sql.endswith("limit %s"):
+        # 分片查询取前 n 条, 带上排序字段
+        return [(r[0], r[1]) for r in ordered[:param_list[-1]]], 1
+      offset, size = param_list[-2:]
+      return [(r[0],) for r in ordered[offset:offset + size]], 1
+    # 按 id 查整行, 顺序和 id 列表无关
+    return [row(r[0]) for r in row_list if r[0] in param_list], 1
+  return handler
+
+
+def test_deferred_page_keeps_id_order():
+  async def main():
+    ds, executed = fake_datasource("default", table_handler(ROW_LIST))
+    repo = repo_type({"default": ds})()
+    item_list, total = await repo.query().order_desc("k").get_page(2, 3, deferred=True)
+    expect = [r[0] for r in mysql_sorted(ROW_LIST, True)[3:6]]
+    assert [x.id for x in item_list] == expect
+    assert total == len(ROW_LIST)
+    id_sql, id_param_list = executed[1]
+    assert id_sql.startswith("SELECT id\nFROM item") and id_sql.endswith("limit %s,%s")
+    assert id_param_list == [3, 3]
+    rows_sql, rows_param_list = executed[2]
+    assert rows_sql.endswith("WHERE id in (%s,%s,%s)")
+    assert rows_param_list == expect
+  asyncio.run(main())
+
+
+def test_deferred_page_skips_deleted_rows():
+  async def main():
+    def handler(sql, param_list):
+      if sql.startswith("SELECT  count(*)"):
+        return [(3,)], 1
+      if "limit" in sql:
+        return [(3,), (1,), (2,)], 1
+      # 两步之间 2 被删除
+      return [row(1), row(3)], 1
+
+    ds, _ = fake_datasource("default", handler)
+    item_list, total = await repo_type({"default": ds})().query().get_page(1, 3, deferred=True)
+    assert [x.id for x in item_list] == [3, 1]
+    assert total == 3
+  asyncio.run(main())
+
+
+def test_sharded_deferred_page():
+  async def main():
+    ds_dict, executed_dict = {}, {}
+    for i, name in enumerate(("s0", "s1")):
+      shard_row_list = [r for r in ROW_LIST if r[0] % 2 == i]
+      ds_dict[name], executed_dict[name] = fake_datasource(name, table_handler(shard_row_list))
+    repo = repo_type(ds_dict, shard_key="id", shard_func=HashShard(2), shards=["s0", "s1"])()
+    item_list, total = await repo.query().order_desc("k").get_page(2, 3, deferred=True)
+    expect = [r[0] for r in mysql_sorted(ROW_LIST, True)[3:6]]
+    assert [x.id for x in item_list] == expect
+    assert total == len(ROW_LIST)
+    for i, name in enumerate(("s0", "s1")):
+      # 每个分片取前 6 个 id, 只按这个分片上的 id 查整行
+      sql, param_list = executed_dict[name][1]
+      assert sql.startswith("SELECT id,k\nFROM item") and param_list == [6]
+      rows_param_list = executed_dict[name][2][1]
+      assert rows_param_list == [id_ for id_ in expect if id_ % 2 == i]
+  asyncio.run(main())
+
+
+def test_left_join_deferred_page_reads_main_table_alone(monkeypatch):
+  async def main():
+    def handler(sql, param_list):
+      if sql.startswith("SELECT  count(*)"):
+        return [(2,)], 1
+      if "limit" in sql:
+        return [(2,), (1,)], 1
+      return [row(1) + row(1), row(2) + row(2)], 1
+
+    ds, executed = fake_datasource("default", handler)
+    monkeypatch.setattr("orange_mysql.repo.get_datasource", lambda name: ds)
+    repo = LeftJoinRepo([JoinItem(Item, "item", "a"), JoinItem(Item, "item", "b", "b.id = a.id")])
+
+    item_list, total = await repo.query().eq("a.k", 3).order_desc("a.k").get_page(1, 2, deferred=True)
+    assert [(a.id, b.id) for a, b in item_list] == [(2, 2), (1, 1)]
+    # 条件和排序只用到主表, 统计和查 id 不联表, 只有这一页的 id 联表
+    assert all("LEFT JOIN" not in sql for sql, _ in executed[:2])
+    assert "LEFT JOIN" in executed[2][0] and executed[2][1] == [2, 1]
+
+    executed.clear()
+    await repo.query().eq("b.k", 3).get_page(1, 2, deferred=True)
+    assert all("LEFT JOIN" in sql for sql, _ in executed)
+  asyncio.run(main())
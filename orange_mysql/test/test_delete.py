@@ -0,0 +1,133 @@
+"""
+删除和按主键范围分批删除, 用假的连接池, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.pymysql.constants import ER
+from orange_mysql.pymysql.err import ProgrammingError, OperationalError
+from orange_mysql.shard import HashShard
+from orange_mysql.utils import SqlError
+from .fakes import fake_datasource, repo_type
+
+
+def table_handler(id_list, lag_list=None, replica_status_error=None):
+  """
+  id_list 是满足条件的行, 删除时从里面去掉
+  :param lag_list: 每次查询从库状态返回的复制延迟
+  :param replica_status_error: SHOW REPLICA STATUS 抛出的异常
+  """
+  def handler(sql, param_list):
+    if sql.startswith("SELECT id"):
+      last_id = param_list[-2] if "id > %s" in sql else 0
+      return [(id_,) for id_ in id_list if id_ > last_id][:param_list[-1]], 1
+    if sql.startswith("DELETE"):
+      low, high = param_list[-2:]
+      deleted = [id_ for id_ in id_list if low <= id_ <= high]
+      for id_ in deleted:
+        id_list.remove(id_)
+      return [], len(deleted)
+    if sql == "SHOW REPLICA STATUS" and replica_status_error is not None:
+      raise replica_status_error
+    return [(lag_list.pop(0),)], 1, None, ["Seconds_Behind_Source"]
+  return handler
+
+
+def test_delete_sql():
+  async def main():
+    ds, executed = fake_datasource("default", lambda sql, param_list: ([], 2))
+    repo = repo_type({"default": ds})()
+    assert await repo.delete().eq("k", 3).execute() == 2
+    assert executed[-1] == ("DELETE FROM `item`\nWHERE (k = %s)", [3])
+    # 没有条件不删除
+    with pytest.raises(AttributeError):
+      await repo.delete().execute()
+  asyncio.run(main())
+
+
+def test_chunk_sql():
+  async def main():
+    ds, _ = fake_datasource("default")
+    delete = repo_type({"default": ds})().delete().eq("k", 3).or_().eq("n", "a")
+    first_sql, next_sql, delete_sql = delete._build_chunk_sql()
+    # 条件加上括号, 和 id 范围是 AND 的关系
+    where = "WHERE ((k = %s) OR (n = %s))"
+    assert first_sql == f"SELECT id FROM `item`\n{where}\nORDER BY id\nlimit %s"
+    assert next_sql == f"SELECT id FROM `item`\n{where} AND id > %s\nORDER BY id\nlimit %s"
+    assert delete_sql == f"DELETE FROM `item`\n{where} AND id >= %s AND id <= %s"
+  asyncio.run(main())
+
+
+def test_chunked_batches():
+  async def main():
+    id_list = [1, 2, 3, 5, 8]
+    ds, executed = fake_datasource("default", table_handler(id_list), replica=False)
+    progress_list = []
+    delete = repo_type({"default": ds})().delete().gt("k", 0)
+    assert await delete.chunked(2, progress=lambda deleted, last_id: progress_list.append((deleted, last_id))) == 5
+    assert id_list == []
+    assert progress_list == [(2, 2), (4, 5), (5, 8)]
+    # 每批按上一批最后的 id 往后取, 按这一批的 id 范围删除
+    assert [param_list for _, param_list in executed] == [
+      [0, 2], [0, 1, 2], [0, 2, 2], [0, 3, 5], [0, 5, 2], [0, 8, 8]]
+  asyncio.run(main())
+
+
+def test_chunked_waits_for_replica_lag(monkeypatch):
+  sleep_list = []
+
+  async def sleep(seconds):
+    sleep_list.append(seconds)
+
+  monkeypatch.setattr("orange_mysql.repo.asyncio.sleep", sleep)
+
+  async def main():
+    ds, _ = fake_datasource("default", table_handler([1, 2, 3], lag_list=[10, 3, 0]))
+    delete = repo_type({"default": ds})().delete().gt("k", 0)
+    assert await delete.chunked(2, pause=0.1, max_replica_lag=5) == 3
+    # 第一批之前延迟 10 秒, 等待一次, 两批之间暂停 pause
+    assert sleep_list == [1, 0.1]
+  asyncio.run(main())
+
+
+def test_chunked_replica_status_fallback():
+  async def main():
+    error = ProgrammingError(ER.PARSE_ERROR, "You have an error in your SQL syntax")
+    ds, executed = fake_datasource("default", table_handler([1], [0], error))
+    assert await repo_type({"default": ds})().delete().gt("k", 0).chunked(2, max_replica_lag=5) == 1
+    # mysql 8.0.22 之前用 SHOW SLAVE STATUS
+    assert [sql for sql, _ in executed[:2]] == ["SHOW REPLICA STATUS", "SHOW SLAVE STATUS"]
+
+    denied = OperationalError(ER.SPECIFIC_ACCESS_DENIED_ERROR, "Access denied")
+    ds, _ = fake_datasource("default", table_handler([1], [0], denied))
+    with pytest.raises(OperationalError):
+      await repo_type({"default": ds})().delete().gt("k", 0).chunked(2, max_replica_lag=5)
+  asyncio.run(main())
+
+
+def test_chunked_not_in_transaction():
+  async def main():
+    ds, _ = fake_datasource("default", table_handler([1]))
+    token = ds.pin(ds.primary.conn)
+    try:
+      with pytest.raises(SqlError):
+        await repo_type({"default": ds})().delete().gt("k", 0).chunked(2)
+    finally:
+      ds.unpin(token)
+  asyncio.run(main())
+
+
+def test_chunked_shards_one_by_one():
+  async def main():
+    ds_dict = {}
+    for i, name in enumerate(("s0", "s1")):
+      ds_dict[name], _ = fake_datasource(
+        name, table_handler([id_ for id_ in range(1, 6) if id_ % 2 == i]), replica=False)
+    repo = repo_type(ds_dict, shard_key="id", shard_func=HashShard(2), shards=["s0", "s1"])()
+    progress_list = []
+    delete = repo.delete().gt("k", 0)
+    assert await delete.chunked(2, progress=lambda deleted, last_id: progress_list.append(deleted)) == 5
+    # 先删完 s0 再删 s1, 已删除行数累加
+    assert progress_list == [2, 4, 5]
+  asyncio.run(main())
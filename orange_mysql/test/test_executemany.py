@@ -0,0 +1,67 @@
+"""
+executemany 把 UPDATE DELETE 合并成多语句的包, 用真正的 aiomysql Cursor 和假的连接, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.aiomysql.cursors import Cursor
+from orange_mysql.pymysql.err import IntegrityError
+from .fakes import FakeWireConnection
+
+
+def run(handler, query, args, max_stmt_length=None):
+  """执行 executemany, 返回 (返回值, 游标, 连接)"""
+  async def main():
+    conn = FakeWireConnection(handler)
+    cur = Cursor(conn)
+    if max_stmt_length is not None:
+      cur.max_stmt_length = max_stmt_length
+    return await cur.executemany(query, args), cur, conn
+  return asyncio.run(main())
+
+
+def affected(sql, param_list):
+  """每条 UPDATE DELETE 影响的行数是语句里的 id"""
+  return [], int(sql.rsplit("=", 1)[1])
+
+
+@pytest.mark.parametrize("query", ["UPDATE item SET n=%s WHERE id=%s;", "  delete FROM item WHERE n=%s AND id=%s"])
+def test_statements_in_one_packet(query):
+  r, cur, conn = run(affected, query, [("a", 1), ("b", 2), ("c", 3)])
+  # 一次发送三条语句, 影响行数相加
+  assert len(conn.executed) == 1
+  assert conn.executed[0][0].count(";") == 2
+  assert r == cur.rowcount == 6
+  assert cur.batch_results == []
+
+
+def test_packets_split_by_max_stmt_length():
+  query = "UPDATE item SET n=%s WHERE id=%s"
+  r, _, conn = run(affected, query, [("abcdefgh", i) for i in range(1, 8)], max_stmt_length=100)
+  assert len(conn.executed) > 1
+  assert all(len(sql) <= 100 for sql, _ in conn.executed)
+  assert sum(sql.count(";") + 1 for sql, _ in conn.executed) == 7
+  assert r == sum(range(1, 8))
+
+
+def test_statement_error_raised():
+  def handler(sql, param_list):
+    if sql.endswith("=2"):
+      raise IntegrityError(1062, "Duplicate entry")
+    return affected(sql, param_list)
+
+  async def main():
+    conn = FakeWireConnection(handler)
+    cur = Cursor(conn)
+    # 第二条语句出错, 读取它的结果时抛出异常
+    with pytest.raises(IntegrityError):
+      await cur.executemany("UPDATE item SET n=%s WHERE id=%s", [("a", 1), ("b", 2), ("c", 3)])
+    assert len(conn.executed) == 1
+  asyncio.run(main())
+
+
+def test_other_statements_run_one_by_one():
+  r, cur, conn = run(lambda sql, param_list: ([], 1), "SELECT n FROM item WHERE id=%s", [(1,), (2,)])
+  assert [sql for sql, _ in conn.executed] == ["SELECT n FROM item WHERE id=1", "SELECT n FROM item WHERE id=2"]
+  assert r == 2 and cur.batch_results == [(None, 1), (None, 1)]
@@ -0,0 +1,88 @@
+"""
+同步查询的并行执行, 用假的 PooledDB, 不需要数据库
+"""
+import threading
+import time
+
+import pytest
+
+from orange_mysql import SyncBaseRepo, SyncFanOut
+from .fakes import fake_sync_datasource, repo_type
+
+
+def test_run_in_parallel_keeps_order():
+  barrier = threading.Barrier(3, timeout=2)
+
+  def call(value, delay):
+    def run():
+      # 三个查询同时在执行才能通过
+      barrier.wait()
+      time.sleep(delay)
+      return value
+    return run
+
+  with SyncFanOut(max_workers=3) as fan_out:
+    assert fan_out.run([call("a", 0.03), call("b", 0.0), call("c", 0.01)]) == ["a", "b", "c"]
+
+
+def test_as_completed_yields_errors():
+  def fail():
+    raise ValueError("bad")
+
+  with SyncFanOut(max_workers=2) as fan_out:
+    result_dict = dict(fan_out.as_completed([lambda: 1, fail]))
+    assert result_dict[0] == 1
+    assert isinstance(result_dict[1], ValueError)
+    with pytest.raises(ValueError):
+      fan_out.run([lambda: 1, fail])
+
+
+def test_timeout():
+  release = threading.Event()
+
+  def slow():
+    release.wait(2)
+    return "slow"
+
+  with SyncFanOut(max_workers=2) as fan_out:
+    try:
+      start = time.monotonic()
+      result_dict = dict(fan_out.as_completed([slow, lambda: "fast"], timeout=0.05))
+      assert time.monotonic() - start < 1
+      assert result_dict[1] == "fast"
+      assert isinstance(result_dict[0], TimeoutError)
+    finally:
+      release.set()
+
+
+def test_early_exit_cancels_pending():
+  started = []
+  release = threading.Event()
+
+  def call(index):
+    def run():
+      started.append(index)
+      if index > 0:
+        release.wait(2)
+      return index
+    return run
+
+  with SyncFanOut(max_workers=1) as fan_out:
+    result = fan_out.as_completed([call(i) for i in range(5)])
+    try:
+      assert next(result) == (0, 0)
+    finally:
+      result.close()
+      release.set()
+  # 只有一个线程, 提前结束时最多开始了下一个查询, 其余的被取消
+  assert started in ([0], [0, 1])
+
+
+def test_query_runs_get_list():
+  ds, executed = fake_sync_datasource("default", lambda sql, param_list: ([(1, 3, "a", None, None)], 1))
+  repo = repo_type({"default": ds}, base=SyncBaseRepo)()
+  with SyncFanOut(max_workers=2) as fan_out:
+    item_list, count = fan_out.run([repo.query().eq("k", 3), lambda: 7])
+  assert [x.n for x in item_list] == ["a"]
+  assert count == 7
+  assert executed[0][1] == [3]
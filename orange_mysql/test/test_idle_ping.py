@@ -0,0 +1,109 @@
+"""
+dbutils 的 IdlePing 按空闲时间 ping 的策略, 用假的连接和时钟, 不需要数据库
+"""
+import pytest
+
+from orange_mysql.dbutils.steady_db import IdlePing, connect
+
+
+class FakeConnection:
+
+  def __init__(self, server):
+    self.server = server
+
+  def ping(self, reconnect=False):
+    self.server.ping_count += 1
+    if self.server.idle_limit is not None and self.server.clock() - self.server.last > self.server.idle_limit:
+      raise ConnectionError("lost")
+    self.server.last = self.server.clock()
+    return True
+
+  def close(self):
+    pass
+
+
+class FakeServer:
+  """idle_limit 秒没有交互就断开连接, 相当于 mysql 的 wait_timeout"""
+
+  def __init__(self, clock, idle_limit=None):
+    self.clock = clock
+    self.idle_limit = idle_limit
+    self.last = clock()
+    self.ping_count = 0
+    self.connect_count = 0
+
+  def __call__(self):
+    self.connect_count += 1
+    self.last = self.clock()
+    return FakeConnection(self)
+
+
+def test_idle_ping_invalid_timeouts():
+  with pytest.raises(ValueError):
+    IdlePing(max_idle_timeout=1, min_idle_timeout=2)
+  with pytest.raises(ValueError):
+    IdlePing(min_idle_timeout=0)
+
+
+def test_idle_ping_threshold():
+  policy = IdlePing(max_idle_timeout=60, min_idle_timeout=1, margin=0.5)
+  assert policy.idle_timeout == 60
+  assert not policy.should_ping(59.9)
+  assert policy.should_ping(60)
+  # 空闲 30 秒后断开, 阈值降到一半
+  policy.lost_after(30)
+  assert policy.idle_timeout == 15
+  # 更长的空闲时间断开不会提高阈值
+  policy.lost_after(40)
+  assert policy.idle_timeout == 15
+  # ping 发现空闲 20 秒还活着, 阈值升到 20
+  policy.alive_after(20)
+  assert policy.idle_timeout == 20
+  policy.alive_after(10)
+  assert policy.idle_timeout == 20
+  # 限制在 min_idle_timeout max_idle_timeout 之间
+  policy.lost_after(0.1)
+  assert policy.idle_timeout == 1
+  policy.alive_after(1000)
+  assert policy.idle_timeout == 60
+
+
+def test_hot_connection_not_pinged(clock):
+  server = FakeServer(clock)
+  policy = IdlePing(max_idle_timeout=10, clock=clock)
+  con = connect(server, failures=(ConnectionError,), ping=policy)
+  for _ in range(5):
+    clock.now += 1
+    assert con._ping_check() is None
+  assert server.ping_count == 0
+  clock.now += 10
+  assert con._ping_check() is True
+  assert server.ping_count == 1
+  # ping 之后重新计算空闲时间
+  clock.now += 1
+  assert con._ping_check() is None
+  assert server.ping_count == 1
+
+
+def test_lost_connection_lowers_threshold(clock):
+  server = FakeServer(clock, idle_limit=8)
+  policy = IdlePing(max_idle_timeout=20, min_idle_timeout=1, margin=0.5, clock=clock)
+  con = connect(server, failures=(ConnectionError,), ping=policy)
+  clock.now += 30
+  # 空闲 30 秒后 ping 发现断开, 重新连接, 阈值降到 15
+  assert con._ping_check() is True
+  assert server.connect_count == 2
+  assert policy.idle_timeout == 15
+  # 空闲 12 秒还没到阈值, 不 ping
+  clock.now += 12
+  assert con._ping_check() is None
+  clock.now += 3
+  # 空闲 15 秒 ping 发现断开, 阈值降到 7.5, 之后空闲 7.5 秒就 ping, 连接还活着
+  assert con._ping_check() is True
+  assert policy.idle_timeout == 7.5
+  assert server.connect_count == 3
+  clock.now += 7.5
+  pings = server.ping_count
+  assert con._ping_check() is True
+  assert server.ping_count == pings + 1
+  assert server.connect_count == 3
@@ -0,0 +1,92 @@
+"""
+批量插入, 多行 VALUES 的分批和 id 回填, 用真正的 aiomysql Cursor 和假的连接, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.aiomysql.cursors import Cursor
+from orange_mysql.utils import SqlError
+from .fakes import Item, FakeWireConnection, fake_datasource, repo_type
+
+
+def insert_handler(next_id, increment=2, lost=0):
+  """
+  多行 insert 的 lastrowid 是第一行的 id, 按 increment 连续分配
+  :param lost: 每条 insert 少报的行数, 模拟影响行数和发送的行数对不上
+  """
+  def handler(sql, param_list):
+    if sql == "SELECT @@auto_increment_increment":
+      return [(increment,)], 1
+    if sql.startswith("insert"):
+      row_count = sql.count("),(") + 1
+      first_id = next_id[0]
+      next_id[0] += row_count * increment
+      return [], row_count - lost, first_id
+    return [], 0
+  return handler
+
+
+def new_item_list(count):
+  item_list = []
+  for i in range(count):
+    item = Item()
+    item.k = i
+    item.n = f"n{i}"
+    item_list.append(item)
+  return item_list
+
+
+def test_executemany_batch_results():
+  async def main():
+    conn = FakeWireConnection(insert_handler([1], 1))
+    cur = Cursor(conn)
+    cur.max_stmt_length = 60
+    sql = "insert into item (k,n) VALUES (%s,%s)"
+    assert await cur.executemany(sql, [(i, "abcdefgh") for i in range(5)]) == 5
+    # 超过 max_stmt_length 时拆成多条多行 insert, 每条记录 (第一行 id, 行数)
+    assert len(conn.executed) > 1
+    assert [rowcount for _, rowcount in cur.batch_results] == [sql.count("),(") + 1 for sql, _ in conn.executed]
+    first_id_list = [first_id for first_id, _ in cur.batch_results]
+    assert first_id_list[0] == 1 and first_id_list == sorted(first_id_list)
+    # 每次 executemany 重新记录, 逐条执行的语句也记录
+    await cur.executemany("SELECT %s", [(1,), (2,)])
+    assert cur.batch_results == [(None, 0), (None, 0)]
+  asyncio.run(main())
+
+
+def test_insert_many_fills_id():
+  async def main():
+    ds, executed = fake_datasource("default", insert_handler([101]), wire=True)
+    item_list = new_item_list(5)
+    assert await repo_type({"default": ds})().insert_many(item_list, batch_size=2) == 5
+    # 3 批在一个事务里, 自增 id 按 auto_increment_increment 回填
+    assert [sql.split(" ", 1)[0] for sql, _ in executed] == ["BEGIN", "SELECT", "insert", "insert", "insert", "COMMIT"]
+    assert [item.id for item in item_list] == [101, 103, 105, 107, 109]
+    assert all(item.ct is not None and item.ut is not None for item in item_list)
+    assert executed[2][0].count("),(") == 1
+  asyncio.run(main())
+
+
+def test_insert_many_rowcount_mismatch_rolls_back():
+  async def main():
+    ds, executed = fake_datasource("default", insert_handler([101], lost=1), wire=True)
+    item_list = new_item_list(3)
+    with pytest.raises(SqlError):
+      await repo_type({"default": ds})().insert_many(item_list)
+    assert executed[-1][0] == "ROLLBACK"
+    assert all(getattr(item, "id", None) is None for item in item_list)
+  asyncio.run(main())
+
+
+def test_insert_many_in_transaction_uses_outer():
+  async def main():
+    ds, executed = fake_datasource("default", insert_handler([1]), wire=True)
+    token = ds.pin(ds.primary.conn)
+    try:
+      await repo_type({"default": ds})().insert_many(new_item_list(2))
+    finally:
+      ds.unpin(token)
+    # 由外层的事务提交
+    assert "BEGIN" not in [sql for sql, _ in executed] and "COMMIT" not in [sql for sql, _ in executed]
+  asyncio.run(main())
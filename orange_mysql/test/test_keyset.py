@@ -0,0 +1,83 @@
+"""
+get_page_after 的翻页游标和翻页条件, 不需要数据库
+"""
+import datetime
+import decimal
+
+import pytest
+
+from orange_mysql.repo import _keyset_condition, _keyset_params, _encode_page_cursor, _decode_page_cursor
+from orange_mysql.utils import SqlError
+from .fakes import ROW_LIST, mysql_sorted
+
+
+@pytest.mark.parametrize("value", [
+  5, "abc", None, 1.5,
+  datetime.datetime(2024, 1, 2, 3, 4, 5, 6),
+  datetime.date(2024, 1, 2),
+  decimal.Decimal("12.3400"),
+])
+@pytest.mark.parametrize("desc", [False, True])
+def test_page_cursor_round_trip(value, desc):
+  field_list = ["k", "id"]
+  cursor = _encode_page_cursor(field_list, desc, [value, 7])
+  assert "=" not in cursor
+  decoded = _decode_page_cursor(cursor, field_list, desc)
+  assert decoded == [value, 7]
+  assert type(decoded[0]) is type(value)
+
+
+def test_page_cursor_mismatch():
+  cursor = _encode_page_cursor(["k", "id"], False, [1, 2])
+  with pytest.raises(SqlError):
+    _decode_page_cursor(cursor, ["n", "id"], False)
+  with pytest.raises(SqlError):
+    _decode_page_cursor(cursor, ["k", "id"], True)
+  with pytest.raises(SqlError):
+    _decode_page_cursor(cursor, ["id"], False)
+  with pytest.raises(SqlError):
+    _decode_page_cursor("not a cursor!", ["k", "id"], False)
+
+
+def test_page_cursor_value_not_support():
+  with pytest.raises(SqlError):
+    _encode_page_cursor(["k", "id"], False, [object(), 1])
+
+
+@pytest.mark.parametrize("desc", [False, True])
+@pytest.mark.parametrize("value_list", [[3, 7], [None, 7], [7]])
+def test_keyset_condition_params(desc, value_list):
+  column_list = ["id"] if len(value_list) == 1 else ["k", "id"]
+  sql = _keyset_condition(column_list, desc, len(value_list) > 1 and value_list[0] is None)
+  assert sql.count("%s") == len(_keyset_params(value_list))
+  assert sql.count("(") == sql.count(")")
+
+
+class _Null:
+  """sql 的 NULL, 和任何值比较都不成立"""
+  __lt__ = __gt__ = __eq__ = lambda self, other: False
+  __hash__ = object.__hash__
+
+
+NULL = _Null()
+
+
+def keyset_after(row_list, desc, last):
+  """用 python 执行 _keyset_condition 的条件, 返回上一页最后一条之后的行"""
+  sql = _keyset_condition(["k", "id"], desc, last[1] is None)
+  param_list = _keyset_params([last[1], last[0]])
+  py = sql.replace(" IS NOT NULL", " is not NULL").replace(" IS NULL", " is NULL")
+  py = py.replace(" AND ", " and ").replace(" OR ", " or ").replace(" = ", " == ")
+  py = py.replace("%s", "{}").format(*[repr(p) for p in param_list])
+  return [id_ for id_, k, _ in row_list
+          if eval(py, {"NULL": NULL}, {"k": NULL if k is None else k, "id": id_})]
+
+
+@pytest.mark.parametrize("desc", [False, True])
+def test_keyset_condition_walks_mysql_order(desc):
+  ordered = mysql_sorted(ROW_LIST, desc)
+  if not desc:
+    # 正序时相同的值按 id 正序, 和 ORDER BY k 加上 id 的翻页条件一致
+    ordered = sorted(ROW_LIST, key=lambda r: ((r[1] is not None, r[1] or 0), r[0]))
+  for i, last in enumerate(ordered):
+    assert sorted(keyset_after(ROW_LIST, desc, last)) == sorted(r[0] for r in ordered[i + 1:])
@@ -0,0 +1,149 @@
+"""
+连接池过载保护 AdaptiveLimiter CircuitBreaker 的状态变化, 不需要数据库
+"""
+import pytest
+
+from orange_mysql.aiomysql.overload import AdaptiveLimiter, CircuitBreaker, is_db_failure
+from orange_mysql.pymysql.err import OperationalError, ProgrammingError
+
+
+def test_db_failure():
+  assert is_db_failure(OperationalError(2013, "lost"))
+  assert is_db_failure(TimeoutError())
+  assert not is_db_failure(ProgrammingError(1064, "syntax"))
+  assert not is_db_failure(ValueError())
+
+
+# AdaptiveLimiter
+
+def test_limiter_invalid_limits():
+  with pytest.raises(ValueError):
+    AdaptiveLimiter(initial_limit=5, min_limit=10)
+  with pytest.raises(ValueError):
+    AdaptiveLimiter(initial_limit=50, max_limit=10)
+
+
+def test_limiter_rejects_at_limit():
+  limiter = AdaptiveLimiter(initial_limit=3, min_limit=1, max_limit=10)
+  assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+  assert limiter.inflight == 3
+  limiter.release(None)
+  assert limiter.inflight == 2
+  assert limiter.try_acquire()
+
+
+def test_limiter_backoff_on_db_failure():
+  limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, max_limit=20, backoff=0.5)
+  limiter.try_acquire()
+  limiter.release(0.01, OperationalError(2013, "lost"))
+  assert limiter.limit == 5
+  # 语句本身的错误不是数据库故障, 不降低并发
+  limiter.try_acquire()
+  limiter.release(0.01, ProgrammingError(1064, "syntax"))
+  assert limiter.limit == 5
+  for _ in range(10):
+    limiter.try_acquire()
+    limiter.release(0.01, OperationalError(2013, "lost"))
+  assert limiter.limit == 2
+
+
+def fill(limiter):
+  while limiter.try_acquire():
+    pass
+
+
+def run(limiter, latency, count):
+  """并发用满时观察到 count 次 latency 延迟"""
+  fill(limiter)
+  for _ in range(count):
+    limiter.release(latency)
+    fill(limiter)
+
+
+def test_limiter_grows_with_stable_latency():
+  limiter = AdaptiveLimiter(initial_limit=10, min_limit=1, max_limit=40)
+  run(limiter, 0.01, 200)
+  assert limiter.limit == 40
+
+
+def test_limiter_shrinks_when_latency_rises():
+  limiter = AdaptiveLimiter(initial_limit=40, min_limit=4, max_limit=40, long_window=1000)
+  run(limiter, 0.01, 200)
+  before = limiter.limit
+  run(limiter, 0.1, 30)
+  assert limiter.limit < before
+  assert limiter.limit >= 4
+
+
+def test_limiter_keeps_limit_when_idle():
+  # 并发没有用到一半时, 延迟稳定也不增加
+  limiter = AdaptiveLimiter(initial_limit=10, min_limit=1, max_limit=40)
+  for _ in range(200):
+    limiter.try_acquire()
+    limiter.release(0.01)
+  assert limiter.limit == 10
+
+
+# CircuitBreaker
+
+def test_breaker_opens_after_threshold(clock):
+  breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+  assert breaker.state == CircuitBreaker.CLOSED
+  assert breaker.record_failure(OperationalError(2003, "down")) is False
+  assert breaker.record_failure(OperationalError(2003, "down")) is False
+  assert breaker.allow()
+  assert breaker.record_failure(OperationalError(2003, "down")) is True
+  assert breaker.state == CircuitBreaker.OPEN
+  assert not breaker.allow()
+
+
+def test_breaker_ignores_query_errors_and_resets_on_success(clock):
+  breaker = CircuitBreaker(failure_threshold=2, clock=clock)
+  breaker.record_failure(OperationalError(2003, "down"))
+  assert breaker.record_failure(ProgrammingError(1064, "syntax")) is False
+  breaker.record_success()
+  # 成功之后重新计数
+  assert breaker.record_failure(OperationalError(2003, "down")) is False
+  assert breaker.state == CircuitBreaker.CLOSED
+
+
+def open_breaker(clock, half_open_max=1):
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, half_open_max=half_open_max, clock=clock)
+  breaker.record_failure()
+  return breaker
+
+
+def test_breaker_half_open_after_timeout(clock):
+  breaker = open_breaker(clock, half_open_max=2)
+  clock.now += 9.9
+  assert breaker.state == CircuitBreaker.OPEN
+  clock.now += 0.1
+  assert breaker.state == CircuitBreaker.HALF_OPEN
+  # 只放过 half_open_max 个探测
+  assert [breaker.allow() for _ in range(3)] == [True, True, False]
+  # 探测没有结果时还回去
+  breaker.release_probe()
+  assert breaker.allow()
+  assert not breaker.allow()
+
+
+def test_breaker_probe_success_closes(clock):
+  breaker = open_breaker(clock)
+  clock.now += 10
+  assert breaker.allow()
+  breaker.record_success()
+  assert breaker.state == CircuitBreaker.CLOSED
+  assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_probe_failure_opens_again(clock):
+  breaker = open_breaker(clock)
+  clock.now += 10
+  assert breaker.allow()
+  assert breaker.record_failure(OperationalError(2003, "down")) is True
+  assert breaker.state == CircuitBreaker.OPEN
+  # 重新开始计时
+  clock.now += 5
+  assert not breaker.allow()
+  clock.now += 5
+  assert breaker.allow()
@@ -0,0 +1,109 @@
+"""
+get_page 统计总数和查询这一页的方式, 用假的连接池, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql import SyncBaseRepo
+from orange_mysql.datasource import DataSource
+from orange_mysql.repo import PAGE_SEQUENTIAL, PAGE_MULTI_STATEMENT, PAGE_WINDOW, PAGE_CONCURRENT
+from orange_mysql.utils import SqlError
+from .fakes import ROW_LIST, FakePool, fake_datasource, fake_sync_datasource, repo_type
+
+
+def page_handler(row_list):
+  """按 sql 的类型返回 row_list 上的结果, PAGE_WINDOW 的每一行最后加上总数"""
+  def handler(sql, param_list):
+    if sql.startswith("SELECT  count(*)"):
+      return [(len(row_list),)], 1
+    offset, size = param_list[-2:]
+    r = [row + (None, None) for row in row_list[offset:offset + size]]
+    if "COUNT(*) OVER()" in sql:
+      r = [data + (len(row_list),) for data in r]
+    return r, 1
+  return handler
+
+
+# 每种方式和数据库的来回次数
+ROUND_TRIP_DICT = {PAGE_SEQUENTIAL: 2, PAGE_MULTI_STATEMENT: 1, PAGE_WINDOW: 1, PAGE_CONCURRENT: 2}
+
+
+@pytest.mark.parametrize("mode", list(ROUND_TRIP_DICT))
+def test_page_modes_same_result(mode):
+  async def main():
+    ds, executed = fake_datasource("default", page_handler(ROW_LIST))
+    repo = repo_type({"default": ds})()
+    item_list, total = await repo.query().get_page(2, 3, mode=mode)
+    assert [x.id for x in item_list] == [4, 5, 6]
+    assert total == len(ROW_LIST)
+    assert len(executed) == ROUND_TRIP_DICT[mode]
+  asyncio.run(main())
+
+
+def test_multi_statement_params():
+  async def main():
+    ds, executed = fake_datasource("default", page_handler(ROW_LIST))
+    repo = repo_type({"default": ds})()
+    await repo.query().gt("k", 0).get_page(2, 3, mode=PAGE_MULTI_STATEMENT)
+    sql, param_list = executed[0]
+    # 条件参数在统计和查询里各用一次
+    assert sql.startswith("SELECT  count(*)") and ";\nSELECT id" in sql
+    assert param_list == [0, 0, 3, 3]
+  asyncio.run(main())
+
+
+def test_window_empty_page_counts_again():
+  async def main():
+    ds, executed = fake_datasource("default", page_handler(ROW_LIST))
+    repo = repo_type({"default": ds})()
+    item_list, total = await repo.query().get_page(5, 3, mode=PAGE_WINDOW)
+    # 这一页没有数据, 总数要再统计一次
+    assert item_list == [] and total == len(ROW_LIST)
+    assert executed[-1][0].startswith("SELECT  count(*)")
+  asyncio.run(main())
+
+
+def test_sequential_skips_page_when_empty():
+  async def main():
+    ds, executed = fake_datasource("default", page_handler([]))
+    repo = repo_type({"default": ds})()
+    assert await repo.query().get_page(1, 3) == ([], 0)
+    assert len(executed) == 1
+  asyncio.run(main())
+
+
+def test_concurrent_runs_on_one_replica():
+  async def main():
+    handler = page_handler(ROW_LIST)
+    replica_list = [FakePool(f"replica-{i}", handler, []) for i in range(2)]
+    ds = DataSource("default", FakePool("primary", handler, []), replica_list)
+    repo = repo_type({"default": ds})()
+    for _ in range(2):
+      await repo.query().get_page(1, 3, mode=PAGE_CONCURRENT)
+    # 统计和这一页在同一个从库上, 两次查询轮流使用两个从库
+    assert [len(pool.conn.executed) for pool in replica_list] == [2, 2]
+    for pool in replica_list:
+      assert pool.conn.executed[0][0].startswith("SELECT  count(*)")
+  asyncio.run(main())
+
+
+def test_page_mode_not_support():
+  async def main():
+    ds, _ = fake_datasource("default", page_handler(ROW_LIST))
+    with pytest.raises(SqlError):
+      await repo_type({"default": ds})().query().get_page(1, 3, mode="unknown")
+  asyncio.run(main())
+
+
+def test_sync_page_modes():
+  ds, executed = fake_sync_datasource("default", page_handler(ROW_LIST))
+  repo = repo_type({"default": ds}, base=SyncBaseRepo)()
+  for mode in (PAGE_SEQUENTIAL, PAGE_MULTI_STATEMENT, PAGE_WINDOW):
+    executed.clear()
+    item_list, total = repo.query().get_page(2, 3, mode=mode)
+    assert [x.id for x in item_list] == [4, 5, 6]
+    assert total == len(ROW_LIST)
+    assert len(executed) == ROUND_TRIP_DICT[mode]
+  with pytest.raises(SqlError):
+    repo.query().get_page(1, 3, mode=PAGE_CONCURRENT)
@@ -0,0 +1,148 @@
+"""
+aiomysql 连接池的等待顺序, 获取超时, 统计, 用假的连接 (conftest 的 fake_connect), 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.aiomysql.overload import CircuitBreaker
+from orange_mysql.aiomysql.pool import (
+  create_pool, PoolExhaustedError, CircuitOpenError,
+  PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW,
+)
+from orange_mysql.pymysql.err import OperationalError
+
+
+async def wait_queued(pool, count):
+  """等到 count 个协程排队等待连接"""
+  while pool.metrics()["waiting"] < count:
+    await asyncio.sleep(0)
+
+
+async def served_order(pool, waiter_list):
+  """占住唯一的连接, waiter_list 的 (名字, 优先级) 依次排队, 归还后按拿到连接的顺序返回名字"""
+  conn = await pool.acquire()
+  order = []
+
+  async def wait(name, priority):
+    async with pool.acquire(priority=priority):
+      order.append(name)
+
+  task_list = []
+  for name, priority in waiter_list:
+    task_list.append(asyncio.create_task(wait(name, priority)))
+    await wait_queued(pool, len(task_list))
+  pool.release(conn)
+  await asyncio.gather(*task_list)
+  return order
+
+
+def test_priority_then_fifo(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=1)
+    order = await served_order(pool, [
+      ("low1", PRIORITY_LOW), ("normal1", PRIORITY_NORMAL), ("high1", PRIORITY_HIGH),
+      ("low2", PRIORITY_LOW), ("high2", PRIORITY_HIGH), ("normal2", PRIORITY_NORMAL),
+    ])
+    assert order == ["high1", "high2", "normal1", "normal2", "low1", "low2"]
+    assert len(fake_connect) == 1
+  asyncio.run(main())
+
+
+def test_acquire_timeout(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=1, acquire_timeout=0.05)
+    conn = await pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+      await pool.acquire()
+    # 单次获取的 timeout 覆盖连接池的 acquire_timeout
+    with pytest.raises(PoolExhaustedError):
+      await pool.acquire(timeout=0.01)
+    metrics = pool.metrics()
+    assert metrics["timeouts"] == 2
+    assert metrics["waiting"] == 0
+    pool.release(conn)
+    # 超时的等待者不影响之后的获取
+    async with pool.acquire() as again:
+      assert again is conn
+  asyncio.run(main())
+
+
+def test_circuit_rejections_not_counted_as_timeouts(fake_connect, clock):
+  async def main():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    pool = await create_pool(minsize=0, maxsize=1, breaker=breaker)
+    conn = await pool.acquire()
+    waiting = asyncio.create_task(pool.acquire())
+    await wait_queued(pool, 1)
+    # 数据库故障打开熔断, 排队的等待者立刻失败
+    await pool.release(conn, OperationalError(2013, "lost"))
+    with pytest.raises(CircuitOpenError):
+      await waiting
+    # 熔断期间直接拒绝
+    with pytest.raises(CircuitOpenError):
+      await pool.acquire()
+    metrics = pool.metrics()
+    assert metrics["rejected"] == 2
+    assert metrics["timeouts"] == 0
+    assert metrics["breaker"] == CircuitBreaker.OPEN
+  asyncio.run(main())
+
+
+# 分区
+
+def test_partition_max_and_reserved_min(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=3, acquire_timeout=0.02,
+                             partitions={"api": (1, 2), "batch": (0, 1)})
+    batch = await pool.acquire(partition="batch")
+    # batch 最多用 1 个
+    with pytest.raises(PoolExhaustedError):
+      await pool.acquire(partition="batch")
+    # 不属于分区的获取不能用 api 保留的 1 个
+    other = await pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+      await pool.acquire()
+    api = await pool.acquire(partition="api")
+    assert pool.metrics()["partition_used"] == {"api": 1, "batch": 1}
+    assert pool.partition_used("api") == 1
+    for conn in (batch, other, api):
+      pool.release(conn)
+    assert pool.metrics()["partition_used"] == {"api": 0, "batch": 0}
+  asyncio.run(main())
+
+
+def test_partition_waiter_does_not_block_others(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=3, partitions={"batch": (0, 1)})
+    batch = await pool.acquire(partition="batch")
+    # 排在前面的 batch 等待者到了上限, 后面的获取不用等它
+    waiting = asyncio.create_task(pool.acquire(partition="batch"))
+    await wait_queued(pool, 1)
+    async with pool.acquire(priority=PRIORITY_LOW) as conn:
+      assert conn is not batch
+    assert not waiting.done()
+    pool.release(batch)
+    pool.release(await waiting)
+  asyncio.run(main())
+
+
+@pytest.mark.parametrize("partitions", [
+  {"a": (-1, 2)},
+  {"a": (2, 1)},
+  {"a": (0, 5)},
+  {"a": (2, None), "b": (2, None)},
+])
+def test_partition_invalid(partitions):
+  async def main():
+    with pytest.raises(ValueError):
+      await create_pool(minsize=0, maxsize=3, partitions=partitions)
+  asyncio.run(main())
+
+
+def test_unknown_partition(fake_connect):
+  async def main():
+    pool = await create_pool(minsize=0, maxsize=3, partitions={"api": (1, 2)})
+    with pytest.raises(ValueError):
+      pool.acquire(partition="report")
+  asyncio.run(main())
@@ -0,0 +1,143 @@
+"""
+PooledDB 的 fast 模式, 用假的 DB-API 连接, 不需要数据库
+"""
+import gc
+import threading
+
+import pytest
+
+from orange_mysql.dbutils.pooled_db import PooledDB, TooManyConnections
+from .fakes import FakeSyncConnection
+
+
+class Creator:
+  """记录打开过的连接"""
+
+  threadsafety = 2
+
+  def __init__(self):
+    self.conn_list = []
+
+  def __call__(self):
+    conn = FakeSyncConnection()
+    self.conn_list.append(conn)
+    return conn
+
+
+def fast_pool(creator, **kwargs):
+  return PooledDB(creator, failures=(ConnectionError,), fast=True, **kwargs)
+
+
+def raw(pooled):
+  """池化连接下面的 DB-API 连接"""
+  return pooled._con._con
+
+
+def in_thread(func):
+  """在另一个线程执行 func, 返回结果或者抛出它的异常"""
+  result = []
+
+  def run():
+    try:
+      result.append((func(), None))
+    except Exception as e:
+      result.append((None, e))
+
+  thread = threading.Thread(target=run)
+  thread.start()
+  thread.join(2)
+  value, error = result[0]
+  if error is not None:
+    raise error
+  return value
+
+
+def test_thread_reuses_its_connection():
+  creator = Creator()
+  pool = fast_pool(creator, max_connections=4)
+  first = pool.connection(False)
+  first_raw = raw(first)
+  first.close()
+  for _ in range(3):
+    with pool.connection(False) as conn:
+      assert raw(conn) is first_raw
+  assert len(creator.conn_list) == 1
+
+
+def test_other_thread_takes_cached_connection_at_limit():
+  creator = Creator()
+  pool = fast_pool(creator, max_connections=1, blocking=True)
+  conn = pool.connection(False)
+  cached = raw(conn)
+  # 归还后留在这个线程的缓存里, 其他线程到了上限时拿走它, 不新建连接
+  conn.close()
+  assert in_thread(lambda: raw(pool.connection(False)) is cached)
+  assert len(creator.conn_list) == 1
+
+
+def test_blocking_waiter_gets_given_back_connection():
+  creator = Creator()
+  pool = fast_pool(creator, max_connections=2, blocking=True)
+  held = [pool.connection(False), pool.connection(False)]
+  got = []
+  waiter = threading.Thread(target=lambda: got.append(raw(pool.connection(False))))
+  waiter.start()
+  waiter.join(0.05)
+  # 到了上限, 一直等到有连接归还
+  assert waiter.is_alive()
+  given_back = raw(held[0])
+  held[0].close()
+  waiter.join(2)
+  assert got == [given_back]
+  assert len(creator.conn_list) == 2
+
+
+def test_non_blocking_limit():
+  pool = fast_pool(Creator(), max_connections=1)
+  conn = pool.connection(False)
+  with pytest.raises(TooManyConnections):
+    in_thread(lambda: pool.connection(False))
+  conn.close()
+
+
+def test_dead_thread_slot_dropped():
+  creator = Creator()
+  pool = fast_pool(creator, max_connections=2)
+
+  def use():
+    pool.connection(False).close()
+
+  for _ in range(3):
+    thread = threading.Thread(target=use)
+    thread.start()
+    thread.join()
+  gc.collect()
+  # 结束的线程缓存的连接放回队列, 线程的位置被删除
+  assert pool._slots == []
+  assert len(creator.conn_list) == 1
+  with pool.connection(False) as conn:
+    assert raw(conn) is creator.conn_list[0]
+
+
+def test_close_closes_idle_connections():
+  creator = Creator()
+  pool = fast_pool(creator, max_connections=3)
+  held = [pool.connection(False) for _ in range(3)]
+  for conn in held:
+    conn.close()
+  pool.close()
+  assert [conn.closed for conn in creator.conn_list] == [True, True, True]
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_discard_closes_and_frees_the_slot(fast):
+  creator = Creator()
+  pool = PooledDB(creator, failures=(ConnectionError,), fast=fast, max_connections=1)
+  conn = pool.connection(False)
+  discarded = raw(conn)
+  conn.discard()
+  assert discarded.closed
+  # 丢弃的连接不放回连接池, 也不再占用连接数
+  with pool.connection(False) as conn:
+    assert raw(conn) is not discarded
+  assert len(creator.conn_list) == 2
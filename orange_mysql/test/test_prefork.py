@@ -0,0 +1,73 @@
+"""
+prefork 多进程共用的连接预算和空闲连接回收, 不需要数据库
+"""
+import asyncio
+import os
+
+import pytest
+
+from orange_mysql.aiomysql.budget import ProcessConnectionBudget, ConnectionBudget
+from orange_mysql.aiomysql.pool import create_pool
+from .fakes import Child
+
+fork_only = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+
+@fork_only
+def test_process_budget_shared_by_processes(tmp_path):
+  path = str(tmp_path / "budget")
+
+  def take_two():
+    budget = ProcessConnectionBudget.shared(path, 3)
+    return [budget.try_acquire() for _ in range(2)]
+
+  child = Child(take_two)
+  try:
+    assert child.result() == "[True, True]"
+    budget = ProcessConnectionBudget.shared(path, 3)
+    # 子进程拿走了 2 个, 这个进程只剩 1 个
+    assert [budget.try_acquire() for _ in range(2)] == [True, False]
+  finally:
+    child.exit()
+  # 子进程退出时内核释放它的锁
+  assert budget.try_acquire()
+  budget.release(2)
+  assert budget.used == 0
+
+
+@fork_only
+def test_process_budget_warns_and_resets_at_fork(tmp_path):
+  budget = ProcessConnectionBudget.shared(str(tmp_path / "budget"), 2)
+  assert budget.try_acquire()
+  # 父进程持有预算时 fork 给出警告, 子进程不继承父进程的预算
+  with pytest.warns(RuntimeWarning):
+    child = Child(lambda: (budget.used, budget.try_acquire(), budget.try_acquire()))
+  try:
+    assert child.result() == "(0, True, False)"
+  finally:
+    child.exit()
+  budget.release()
+
+
+def test_shared_budget_limit_mismatch(tmp_path):
+  path = str(tmp_path / "budget")
+  assert ProcessConnectionBudget.shared(path, 2) is ProcessConnectionBudget.shared(path, 2)
+  with pytest.raises(ValueError):
+    ProcessConnectionBudget.shared(path, 3)
+
+
+def test_idle_connections_closed(fake_connect):
+  async def main():
+    budget = ConnectionBudget(4)
+    pool = await create_pool(minsize=1, maxsize=4, budget=budget, idle_timeout=0.05)
+    conn_list = [await pool.acquire() for _ in range(3)]
+    for conn in conn_list:
+      pool.release(conn)
+    assert pool.freesize == 3 and budget.used == 3
+    await asyncio.sleep(0.15)
+    # 空闲超时的连接关闭, 保留 minsize 个, 预算还给其他进程
+    assert pool.freesize == 1
+    assert budget.used == 1
+    # 最近归还的连接先被取走, 多出来的连接才会空闲
+    assert await pool.acquire() is conn_list[-1]
+  asyncio.run(main())
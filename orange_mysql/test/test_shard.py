@@ -0,0 +1,105 @@
+"""
+分片表: 各分片结果的归并, 分片写入之后的读写一致, 用假的连接池, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.shard import HashShard
+from .fakes import ROW_LIST, new_query, mysql_sorted, fake_datasource, repo_type
+
+
+# 分片结果归并
+
+def merge(shard_list, order_field, desc, select=None):
+  q = new_query()
+  if select is not None:
+    q.select(*select)
+  if desc:
+    q.order_desc(order_field)
+  else:
+    q.order(order_field)
+  # 分片查询编译 sql 时记录排序列的位置
+  q._statement("list", scatter=True)
+  return q._merge(shard_list)
+
+
+@pytest.mark.parametrize("desc", [False, True])
+def test_merge_sorted_with_null(desc):
+  shard_list = [mysql_sorted([r for r in ROW_LIST if r[0] % 3 == i], desc) for i in range(3)]
+  merged = merge(shard_list, "k", desc)
+  assert sorted(merged) == sorted(ROW_LIST)
+  k_list = [r[1] for r in merged]
+  null_count = k_list.count(None)
+  if desc:
+    # 倒序时 NULL 在最后, 相同的值按 id 倒序
+    assert k_list[-null_count:] == [None] * null_count
+    assert merged == mysql_sorted(ROW_LIST, True)
+  else:
+    # 正序时 NULL 在最前
+    assert k_list[:null_count] == [None] * null_count
+    assert k_list[null_count:] == sorted(k_list[null_count:])
+
+
+def test_merge_strips_hidden_sort_column():
+  # 排序字段没有被选择, 分片查询额外查出来, 归并之后去掉
+  shard_list = [[("b", 1), ("a", 3)], [("c", None), ("d", 2)]]
+  assert merge(shard_list, "k", False, select=["n"]) == [("c",), ("b",), ("d",), ("a",)]
+
+
+def test_merge_single_shard_and_no_order():
+  q = new_query()
+  q._statement("list", scatter=True)
+  assert q._merge([[(2,), (1,)], [(3,)]]) == [(2,), (1,), (3,)]
+  assert merge([[(1, 2, "a"), (2, 1, "b")]], "k", False) == [(1, 2, "a"), (2, 1, "b")]
+
+
+@pytest.mark.parametrize("desc", [False, True])
+def test_stream_pick_matches_merge(desc):
+  q = new_query()
+  q.order_desc("k") if desc else q.order("k")
+  q._statement("list", scatter=True)
+  shard_list = [mysql_sorted([r for r in ROW_LIST if r[0] % 3 == i], desc) for i in range(3)]
+  picked = []
+  while any(shard_list):
+    live = [s for s in shard_list if s]
+    picked.append(live[q._stream_pick([s[0] for s in live])].pop(0))
+  assert [r[1] for r in picked] == [r[1] for r in merge(
+    [mysql_sorted([r for r in ROW_LIST if r[0] % 3 == i], desc) for i in range(3)], "k", desc)]
+
+
+# 写入之后的读走主库
+
+def writer(repo, kind):
+  """repo 的 update 或 delete"""
+  if kind == "delete":
+    return repo.delete()
+  update = repo.update()
+  update.set("n", "x")
+  return update
+
+
+@pytest.mark.parametrize("kind", ["update", "delete"])
+def test_write_reads_primary_after_write(kind):
+  async def main():
+    ds, _ = fake_datasource("default", read_after_write=5)
+    repo = repo_type({"default": ds})()
+    assert ds.read_pool() is ds.replica_list[0]
+    assert await writer(repo, kind).eq("id", 1).execute() == 1
+    # 写入之后调用方的上下文里读走主库
+    assert ds.read_pool() is ds.primary
+  asyncio.run(main())
+
+
+@pytest.mark.parametrize("kind", ["update", "delete"])
+def test_sharded_write_reads_primary_after_write(kind):
+  async def main():
+    ds_dict = {}
+    for name in ("s0", "s1"):
+      ds_dict[name], _ = fake_datasource(name, read_after_write=5)
+    repo = repo_type(ds_dict, shard_key="id", shard_func=HashShard(2), shards=["s0", "s1"])()
+    # 没有分片键条件, 同时写入所有分片
+    assert await writer(repo, kind).gt("k", 1).execute() == 2
+    for ds in ds_dict.values():
+      assert ds.read_pool() is ds.primary
+  asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+查询结构 (条件结构, 查询字段, 排序, 语句类型) 作为 sql 缓存的键, 结构不同的查询不能拿到别的查询的 sql
+"""
+import pytest
+
+from orange_mysql.repo import SqlWhereBuilder, _StatementCache, statement_cache
+from .fakes import new_query
+
+
+def where(*call_list):
+  builder = SqlWhereBuilder()
+  for name, *args in call_list:
+    getattr(builder, name)(*args)
+  return builder
+
+
+# 条件结构
+
+def test_shape_ignores_values():
+  a = where(("eq", "k", 1), ("like", "n", "x"))
+  b = where(("eq", "k", 2), ("like", "n", "y"))
+  assert a._where_shape() == b._where_shape()
+  assert a._where_param_list != b._where_param_list
+
+
+@pytest.mark.parametrize("a, b", [
+  # 操作符不同
+  ([("eq", "k", 1)], [("ne", "k", 1)]),
+  ([("gt", "k", 1)], [("lt", "k", 1)]),
+  # 字段不同
+  ([("eq", "k", 1)], [("eq", "n", 1)]),
+  # in 的参数个数不同
+  ([("in_", "k", [1, 2])], [("in_", "k", [1, 2, 3])]),
+  # and 和 or
+  ([("eq", "k", 1), ("eq", "n", 1)], [("eq", "k", 1), ("or_",), ("eq", "n", 1)]),
+  # 条件的顺序
+  ([("eq", "k", 1), ("gt", "n", 1)], [("gt", "n", 1), ("eq", "k", 1)]),
+  # 直接写的 sql 和同样效果的条件
+  ([("where_sql", "(k = %s)", [1])], [("eq", "k", 1)]),
+  ([("where_sql", "(k = %s)", [1])], [("where_sql", "(k > %s)", [1])]),
+])
+def test_shape_differs(a, b):
+  assert where(*a)._where_shape() != where(*b)._where_shape()
+
+
+def test_statement_cache_key_collisions():
+  statement_cache.clear()
+
+  def sql_of(build, kind="list"):
+    q = new_query()
+    build(q)
+    return q._statement(kind)
+
+  # 参数不同结构相同, 命中同一条缓存
+  assert sql_of(lambda q: q.eq("k", 1)) == sql_of(lambda q: q.eq("k", 2))
+  # 结构不同的查询不能拿到别的查询的 sql
+  assert "(k = %s)" in sql_of(lambda q: q.eq("k", 1))
+  assert "(k != %s)" in sql_of(lambda q: q.ne("k", 1))
+  assert sql_of(lambda q: q.in_("k", [1, 2])).count("%s") == 2
+  assert sql_of(lambda q: q.in_("k", [1, 2, 3])).count("%s") == 3
+  assert "OR" in sql_of(lambda q: q.eq("k", 1).or_().eq("n", "a"))
+  assert "OR" not in sql_of(lambda q: q.eq("k", 1).eq("n", "a"))
+  assert "DESC" in sql_of(lambda q: q.eq("k", 1).order_desc("k"))
+  assert "DESC" not in sql_of(lambda q: q.eq("k", 1).order("k"))
+  assert sql_of(lambda q: q.select("n").eq("k", 1)).startswith("SELECT n\n")
+  assert sql_of(lambda q: q.eq("k", 1)).startswith("SELECT id,k,n\n")
+  # 语句类型和是否分片也在键里
+  assert sql_of(lambda q: q.eq("k", 1), "count").startswith("SELECT  count(*)")
+  assert sql_of(lambda q: q.eq("k", 1), "page").endswith("limit %s,%s")
+
+
+def test_statement_cache_clear_when_full():
+  cache = _StatementCache(max_size=2)
+  cache.put("a", 1)
+  cache.put("b", 2)
+  assert cache.get("a") == 1
+  cache.put("c", 3)
+  assert cache.get("a") is None and cache.get("b") is None
+  assert cache.get("c") == 3
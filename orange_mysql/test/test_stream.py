@@ -0,0 +1,69 @@
+"""
+流式查询, 读完时关闭游标, 提前结束时断开连接, 用假的连接池, 不需要数据库
+"""
+import asyncio
+import contextlib
+
+import pytest
+
+from orange_mysql import SyncBaseRepo
+from orange_mysql.utils import SqlError
+from .fakes import ROW_LIST, fake_datasource, fake_sync_datasource, repo_type
+
+
+def row_handler(sql, param_list):
+  return [row + (None, None) for row in ROW_LIST], len(ROW_LIST)
+
+
+def test_stream_reads_all():
+  async def main():
+    ds, _ = fake_datasource("default", row_handler, replica=False)
+    repo = repo_type({"default": ds})()
+    assert [x.id async for x in repo.query().stream(batch_size=3)] == [row[0] for row in ROW_LIST]
+    assert not ds.primary.conn.closed
+  asyncio.run(main())
+
+
+def test_stream_early_exit_closes_connection():
+  async def main():
+    ds, _ = fake_datasource("default", row_handler, replica=False)
+    repo = repo_type({"default": ds})()
+    async with contextlib.aclosing(repo.query().stream(batch_size=3)) as stream:
+      async for item in stream:
+        break
+    # 剩下的数据不读, 断开连接
+    assert ds.primary.conn.closed
+  asyncio.run(main())
+
+
+def test_stream_not_in_transaction():
+  async def main():
+    ds, _ = fake_datasource("default", row_handler)
+    token = ds.pin(ds.primary.conn)
+    try:
+      with pytest.raises(SqlError):
+        async for _ in repo_type({"default": ds})().query().stream():
+          pass
+    finally:
+      ds.unpin(token)
+  asyncio.run(main())
+
+
+def test_sync_stream_reads_all():
+  ds, _ = fake_sync_datasource("default", row_handler)
+  repo = repo_type({"default": ds}, base=SyncBaseRepo)()
+  assert [x.id for x in repo.query().stream(batch_size=3)] == [row[0] for row in ROW_LIST]
+  conn = ds.pool.conn
+  assert conn.cursor_list[-1].closed and not conn.discarded
+
+
+def test_sync_stream_early_exit_discards_connection():
+  ds, _ = fake_sync_datasource("default", row_handler)
+  repo = repo_type({"default": ds}, base=SyncBaseRepo)()
+  with contextlib.closing(repo.query().stream(batch_size=3)) as stream:
+    for item in stream:
+      break
+  conn = ds.pool.conn
+  # 游标不关闭 (关闭非缓冲游标会读完剩下的数据), 连接断开不放回连接池
+  assert conn.discarded and conn.closed
+  assert not conn.cursor_list[-1].closed
@@ -0,0 +1,74 @@
+"""
+同步 repo 和同步数据源, 用假的 PooledDB, 不需要数据库
+"""
+import os
+
+import pytest
+
+from orange_mysql import init, OrangeMySqlConfig, SyncBaseRepo
+from orange_mysql.datasource import SyncDataSource
+from orange_mysql.utils import SqlError
+from .fakes import Item, FakeSyncPool, fake_sync_datasource, repo_type, Child
+
+
+def item_handler(sql, param_list):
+  if sql.startswith("SELECT"):
+    return [(1, 3, "a", None, None), (2, 4, "b", None, None)], 2
+  if sql.startswith("insert"):
+    return [], 1, 11
+  return [], 2
+
+
+def test_sync_query_update_insert():
+  ds, executed = fake_sync_datasource("default", item_handler)
+  repo = repo_type({"default": ds}, base=SyncBaseRepo)()
+  item_list = repo.query().gt("k", 2).get_list()
+  assert [(x.id, x.k, x.n) for x in item_list] == [(1, 3, "a"), (2, 4, "b")]
+  assert executed[-1][1] == [2]
+  assert repo.query().eq("id", 1).get_first(dict)["n"] == "a"
+
+  update = repo.update()
+  update.set("n", "x")
+  assert update.eq("k", 3).execute() == 2
+  assert executed[-1][0].startswith("UPDATE `item`")
+  assert executed[-1][1][0] == "x" and executed[-1][1][-1] == 3
+
+  item = Item()
+  item.k = 5
+  item.n = "c"
+  repo.insert(item)
+  assert item.id == 11
+  # 每次用完都放回连接池
+  assert all(cursor.closed for cursor in ds.pool.conn.cursor_list)
+
+
+def test_sync_datasource_without_factory_after_fork():
+  ds = SyncDataSource("default", FakeSyncPool())
+  ds.reset_after_fork()
+  with pytest.raises(SqlError):
+    ds.connection()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_sync_pool_recreated_after_fork(monkeypatch):
+  created = []
+
+  def create_sync_pool(config):
+    created.append(FakeSyncPool())
+    return created[-1]
+
+  monkeypatch.setattr(init, "_create_sync_pool", create_sync_pool)
+  close_pool = init.orange_mysql_sync_init(OrangeMySqlConfig(
+    {"host": "localhost", "user": "root", "password": "pw", "db": "test"}))
+  try:
+    parent_pool = init.get_sync_datasource().pool
+    # 子进程不使用父进程的连接池, 第一次使用时重新创建
+    child = Child(lambda: (init.get_sync_datasource().pool is parent_pool, len(created), parent_pool.closed))
+    try:
+      assert child.result() == "(False, 2, False)"
+    finally:
+      child.exit()
+    assert init.get_sync_datasource().pool is parent_pool
+  finally:
+    close_pool()
+  assert parent_pool.closed
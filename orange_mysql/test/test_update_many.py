@@ -0,0 +1,79 @@
+"""
+按 id 批量更新 UPDATE ... SET col = CASE id WHEN ... END, 用假的连接池, 不需要数据库
+"""
+import asyncio
+import datetime
+
+import pytest
+
+from orange_mysql.shard import HashShard
+from orange_mysql.utils import SqlError
+from .fakes import Item, fake_datasource, repo_type
+
+
+def build(item_list, fields=None, chunk_size=500, fill_time=False):
+  """返回 [(数据源名字, [(sql, 参数列表)])]"""
+  async def main():
+    ds, _ = fake_datasource("default")
+    group_list = repo_type({"default": ds})()._build_update_many(item_list, fields, chunk_size, fill_time)
+    return [(ds.name, statement_list) for ds, statement_list in group_list]
+  return asyncio.run(main())
+
+
+def test_update_many_case_when_sql():
+  [(_, statement_list)] = build([{"id": 1, "n": "a", "k": 2}, {"id": 2, "n": "b"}])
+  sql, param_list = statement_list[0]
+  # 字段取第一条的键, 没有设置的字段保持原值
+  assert sql == ("UPDATE `item`\n"
+                 "SET `n` = CASE id WHEN %s THEN %s WHEN %s THEN %s ELSE `n` END, "
+                 "`k` = CASE id WHEN %s THEN %s ELSE `k` END\n"
+                 "WHERE id in (%s,%s)")
+  assert param_list == [1, "a", 2, "b", 1, 2, 1, 2]
+
+
+def test_update_many_objects_and_fill_time():
+  item = Item()
+  item.id = 3
+  item.n = "c"
+  item.ct = "ignored"
+  [(_, [(sql, param_list)])] = build([item], fill_time=True)
+  # 对象默认更新所有字段, 不更新 id ct, ut 设为当前时间
+  assert sql.split("\n")[1] == ("SET `k` = CASE id WHEN %s THEN %s ELSE `k` END, "
+                                "`n` = CASE id WHEN %s THEN %s ELSE `n` END, `ut`=%s")
+  assert param_list[:4] == [3, None, 3, "c"] and param_list[-1] == 3
+  assert isinstance(param_list[-2], datetime.datetime)
+
+
+def test_update_many_chunks_and_fields():
+  item_list = [{"id": i, "n": f"n{i}", "k": i} for i in range(1, 6)]
+  [(_, statement_list)] = build(item_list, fields=["k"], chunk_size=2)
+  # 每条 2 个参数 (id, 值), 最后是 WHERE id in 的 id 列表
+  assert [param_list[-len(param_list) // 3:] for _, param_list in statement_list] == [[1, 2], [3, 4], [5]]
+  assert all("`n`" not in sql for sql, _ in statement_list)
+  # 指定的字段所有条目都没有设置时不生成语句
+  assert build([{"id": 1, "n": "a"}], fields=["k"]) == [("default", [])]
+
+
+def test_update_many_invalid():
+  with pytest.raises(SqlError):
+    build([{"n": "a"}])
+  with pytest.raises(SqlError):
+    build([{"id": 1, "x": 1}])
+  with pytest.raises(SqlError):
+    build([{"id": 1, "n": "a"}], fields=["id"])
+
+
+def test_update_many_one_transaction_per_shard():
+  async def main():
+    ds_dict, executed_dict = {}, {}
+    for name in ("s0", "s1"):
+      ds_dict[name], executed_dict[name] = fake_datasource(
+        name, lambda sql, param_list: ([], sql.count("WHEN") if sql.startswith("UPDATE") else 0), wire=True)
+    repo = repo_type(ds_dict, shard_key="id", shard_func=HashShard(2), shards=["s0", "s1"])()
+    item_list = [{"id": i, "n": f"n{i}"} for i in range(1, 6)]
+    assert await repo.update_many(item_list, chunk_size=2, fill_time=False) == 5
+    # s0 有 2 4, s1 有 1 3 5 分成两条
+    assert [sql.split(" ", 1)[0] for sql, _ in executed_dict["s0"]] == ["BEGIN", "UPDATE", "COMMIT"]
+    assert [sql.split(" ", 1)[0] for sql, _ in executed_dict["s1"]] == ["BEGIN", "UPDATE", "UPDATE", "COMMIT"]
+    assert await repo.update_many([]) == 0
+  asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+批量插入或更新 INSERT ... ON DUPLICATE KEY UPDATE, 用真正的 aiomysql Cursor 和假的连接, 不需要数据库
+"""
+import asyncio
+
+import pytest
+
+from orange_mysql.utils import SqlError
+from .fakes import Item, fake_datasource, repo_type
+
+
+def upsert_sql(**kwargs):
+  async def main():
+    ds, _ = fake_datasource("default")
+    kwargs.setdefault("fill_time", True)
+    return repo_type({"default": ds})()._build_upsert_sql(
+      kwargs.get("update_fields"), kwargs.get("conflict_key"), kwargs.get("row_alias"), kwargs["fill_time"])
+  return asyncio.run(main())
+
+
+def test_upsert_sql_default_update_fields():
+  sql, field_list, update_fields = upsert_sql()
+  assert sql == ("insert into item (k,n,ct,ut) VALUES (%s,%s,%s,%s) "
+                 "ON DUPLICATE KEY UPDATE `k`=VALUES(`k`), `n`=VALUES(`n`), `ut`=VALUES(`ut`)")
+  assert [field.name for field in field_list] == ["k", "n", "ct", "ut"]
+  # 创建时间不更新
+  assert update_fields == ["k", "n", "ut"]
+
+
+def test_upsert_sql_conflict_key_and_alias():
+  sql, field_list, update_fields = upsert_sql(conflict_key="id", row_alias="new")
+  # 冲突键包含 id 时 id 也插入, 冲突键不更新
+  assert sql == ("insert into item (id,k,n,ct,ut) VALUES (%s,%s,%s,%s,%s) AS new "
+                 "ON DUPLICATE KEY UPDATE `k`=new.`k`, `n`=new.`n`, `ut`=new.`ut`")
+  assert update_fields == ["k", "n", "ut"]
+
+
+def test_upsert_sql_update_fields():
+  assert upsert_sql(update_fields=["n"])[2] == ["n", "ut"]
+  assert upsert_sql(update_fields=["n"], fill_time=False)[2] == ["n"]
+  with pytest.raises(SqlError):
+    upsert_sql(update_fields=["x"])
+  with pytest.raises(SqlError):
+    # id 没有插入, 不能更新
+    upsert_sql(update_fields=["id"])
+  with pytest.raises(SqlError):
+    upsert_sql(update_fields=[], fill_time=False)
+
+
+def new_item_list(count):
+  item_list = []
+  for i in range(count):
+    item = Item()
+    item.id = i + 1
+    item.n = f"n{i}"
+    item_list.append(item)
+  return item_list
+
+
+def upsert_handler(sql, param_list):
+  if sql.startswith("insert"):
+    # 第一行插入计 1, 其他行更新计 2
+    return [], 1 + 2 * sql.count("),(")
+  return [], 0
+
+
+@pytest.mark.parametrize("update_fields", [None, ["n", "ct"]])
+def test_upsert_many_fills_ct_only_when_updated(update_fields):
+  async def main():
+    ds, executed = fake_datasource("default", upsert_handler, wire=True)
+    item_list = new_item_list(3)
+    repo = repo_type({"default": ds})()
+    assert await repo.upsert_many(item_list, update_fields, conflict_key="id") == 5
+    assert [sql.split(" ", 1)[0] for sql, _ in executed] == ["BEGIN", "insert", "COMMIT"]
+    assert all(item.ut is not None for item in item_list)
+    if update_fields is None:
+      # 不知道哪些行是插入的, 创建时间只写进插入的参数, 不写回对象
+      assert all(getattr(item, "ct", None) is None for item in item_list)
+      assert executed[1][0].count(item_list[0].ut.strftime("%Y-%m-%d %H:%M:%S")) == 6
+    else:
+      # 冲突时也更新 ct, 每一行的 ct 都是这个值
+      assert all(item.ct == item.ut for item in item_list)
+  asyncio.run(main())
@@ -0,0 +1,77 @@
+from .datasource import DataSource
+from .init import get_datasource, DEFAULT_DATASOURCE
+from .utils import orange_sql_log
+
+
+class Transaction:
+  """
+  事务, 通过 contextvars 在当前上下文里固定一个主库连接,
+  里面所有 repo 的操作都用这个连接, 结束时统一 commit, 出异常 rollback
+
+  async with orange_mysql.transaction():
+    await user_repo.insert(user)
+    await account_repo.update().set(...).eq(...).execute()
+
+  嵌套的事务直接用外层的事务
+  """
+
+  __slots__ = ("__datasource_name", "__acquire_kw", "__datasource",
+               "__conn", "__token")
+
+  def __init__(self, datasource=DEFAULT_DATASOURCE, **acquire_kw):
+    """
+    :param datasource: 数据源名字
+    :param acquire_kw: 获取连接的参数 timeout priority partition
+    """
+    self.__datasource_name = datasource
+    self.__acquire_kw = acquire_kw
+    self.__datasource: DataSource = None
+    self.__conn = None
+    self.__token = None
+
+  async def __aenter__(self):
+    ds = get_datasource(self.__datasource_name)
+    self.__datasource = ds
+    conn = ds.pinned_conn()
+    if conn is not None:
+      return conn
+    conn = await ds.primary.acquire(**self.__acquire_kw)
+    try:
+      await conn.begin()
+    except BaseException as e:
+      await ds.primary.release(conn, e)
+      raise
+    self.__conn = conn
+    self.__token = ds.pin(conn)
+    orange_sql_log.debug("transaction begin")
+    return conn
+
+  async def __aexit__(self, exc_type, exc, tb):
+    conn = self.__conn
+    if conn is None:
+      # 嵌套事务, 由外层提交
+      return
+    ds = self.__datasource
+    self.__conn = None
+    callback_list = ds.take_commit_callbacks()
+    ds.unpin(self.__token)
+    error = exc
+    try:
+      if exc_type is None:
+        await conn.commit()
+        orange_sql_log.debug("transaction commit")
+        for callback in callback_list:
+          callback()
+      else:
+        await conn.rollback()
+        orange_sql_log.debug("transaction rollback")
+    except BaseException as e:
+      error = e
+      raise
+    finally:
+      await ds.primary.release(conn, error)
+
+
+def transaction(datasource=DEFAULT_DATASOURCE, **acquire_kw) -> Transaction:
+  """开启事务, 用法见 Transaction"""
+  return Transaction(datasource, **acquire_kw)
@@ -0,0 +1,55 @@
+"""
+比较 asyncio 和 uvloop 事件循环下的查询吞吐量, 需要能连上的 mysql
+
+python -m pool_test.loop_bench
+"""
+import asyncio
+import time
+
+from orange_mysql.init import orange_mysql_init_func_factory, OrangeMySqlConfig, get_datasource
+from orange_mysql.event_loop import new_event_loop, loop_name, uvloop_available
+from pool_test.test import db_config
+
+concurrency = 64
+query_count = 20000
+sql = "SELECT 1"
+
+
+async def bench():
+  config = OrangeMySqlConfig({**db_config, "minsize": 16, "maxsize": 16})
+  close_pool = await orange_mysql_init_func_factory(config)()
+  ds = get_datasource()
+  remain = query_count
+
+  async def worker():
+    nonlocal remain
+    while remain > 0:
+      remain -= 1
+      async with ds.acquire() as conn:
+        async with conn.cursor() as cursor:
+          await cursor.execute(sql)
+          await cursor.fetchall()
+
+  start = time.perf_counter()
+  await asyncio.gather(*[worker() for _ in range(concurrency)])
+  cost = time.perf_counter() - start
+  close_pool()
+  await ds.wait_closed()
+  return cost
+
+
+def run(prefer_uvloop):
+  loop = new_event_loop(prefer_uvloop)
+  try:
+    cost = loop.run_until_complete(bench())
+    print(f"{loop_name(loop):8} {query_count} queries {cost:.2f}s {query_count / cost:.0f} qps")
+  finally:
+    loop.close()
+
+
+if __name__ == '__main__':
+  run(False)
+  if uvloop_available():
+    run(True)
+  else:
+    print("uvloop not installed")
@@ -0,0 +1,78 @@
+"""
+PooledDB 多线程借还连接的吞吐量, 比较默认模式和 fast 模式, 用假的数据库模块, 不需要 mysql
+
+python -m pool_test.pooled_db_bench
+"""
+import threading
+import time
+
+from orange_mysql.dbutils.pooled_db import PooledDB
+
+thread_count = 64
+max_connections = 16
+borrow_count = 2000
+
+
+class FakeCursor:
+
+  def execute(self, sql, args=None):
+    pass
+
+  def fetchall(self):
+    return []
+
+  def close(self):
+    pass
+
+
+class FakeConnection:
+
+  def cursor(self):
+    return FakeCursor()
+
+  def rollback(self):
+    pass
+
+  def commit(self):
+    pass
+
+  def close(self):
+    pass
+
+
+class FakeDbApi:
+  threadsafety = 1
+  OperationalError = InterfaceError = InternalError = Exception
+
+  @staticmethod
+  def connect():
+    return FakeConnection()
+
+
+def bench(fast):
+  pool = PooledDB(FakeDbApi, max_connections=max_connections, blocking=True, ping=0, fast=fast)
+
+  def worker():
+    for _ in range(borrow_count):
+      with pool.connection(False) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchall()
+        cur.close()
+
+  thread_list = [threading.Thread(target=worker) for _ in range(thread_count)]
+  start = time.perf_counter()
+  for t in thread_list:
+    t.start()
+  for t in thread_list:
+    t.join()
+  cost = time.perf_counter() - start
+  pool.close()
+  total = thread_count * borrow_count
+  mode = "fast" if fast else "default"
+  print(f"{mode:8} {thread_count} threads {total} borrows {cost:.2f}s {total / cost:.0f}/s")
+
+
+if __name__ == '__main__':
+  bench(False)
+  bench(True)